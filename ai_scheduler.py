@@ -0,0 +1,146 @@
+import asyncio
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Tuple, TypeVar
+
+T = TypeVar("T")
+
+
+class SchedulerBusy(Exception):
+    """Очередь переполнена, запрос не принят"""
+
+
+class AIScheduler:
+    """Ограничитель одновременных запросов к ИИ с честными очередями
+
+    Одновременно выполняется не больше max_concurrent запросов. Остальные
+    ждут в очередях по чатам, а внутри чата по пользователям; свободный слот
+    отдаётся по кругу: следующий чат, в нём следующий пользователь. Поэтому
+    один шумный чат или пользователь не задерживает остальных.
+
+    Если очередь (общая, чата или пользователя) уже заполнена, run() сразу
+    бросает SchedulerBusy, чтобы ответить "занято", а не копить задержку.
+    """
+
+    def __init__(self,
+                 max_concurrent: int = 4,
+                 max_queue: int = 50,
+                 max_queue_per_chat: int = 5,
+                 max_per_user: int = 2):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_queue_per_chat = max_queue_per_chat
+        self.max_per_user = max_per_user
+        self.running = 0
+        self.queued = 0
+        self.rejected = 0
+        # chat_id -> user_id -> ожидающие
+        self._queues: Dict[int, Dict[int, Deque[asyncio.Future]]] = {}
+        # Порядок обхода: чаты, и внутри каждого чата пользователи
+        self._chat_ring: Deque[int] = deque()
+        self._user_rings: Dict[int, Deque[int]] = {}
+        self._chat_queued: Dict[int, int] = {}
+        self._user_load: Dict[Tuple[int, int], int] = {}
+
+    def _check_limits(self, chat_id: int, user_id: int):
+        if self._user_load.get((chat_id, user_id), 0) >= self.max_per_user:
+            raise SchedulerBusy("user")
+        if self.running < self.max_concurrent and not self.queued:
+            return
+        if self.queued >= self.max_queue:
+            raise SchedulerBusy("global")
+        if self._chat_queued.get(chat_id, 0) >= self.max_queue_per_chat:
+            raise SchedulerBusy("chat")
+
+    def _enqueue(self, chat_id: int, user_id: int) -> asyncio.Future:
+        waiter = asyncio.get_running_loop().create_future()
+        users = self._queues.get(chat_id)
+        if users is None:
+            users = self._queues[chat_id] = {}
+            self._user_rings[chat_id] = deque()
+            self._chat_ring.append(chat_id)
+        queue = users.get(user_id)
+        if queue is None:
+            queue = users[user_id] = deque()
+            self._user_rings[chat_id].append(user_id)
+        queue.append(waiter)
+        self.queued += 1
+        self._chat_queued[chat_id] = self._chat_queued.get(chat_id, 0) + 1
+        return waiter
+
+    def _dequeue(self, chat_id: int, user_id: int, waiter: asyncio.Future):
+        users = self._queues[chat_id]
+        queue = users[user_id]
+        queue.remove(waiter)
+        self.queued -= 1
+        self._chat_queued[chat_id] -= 1
+        if not queue:
+            del users[user_id]
+            self._user_rings[chat_id].remove(user_id)
+        if not users:
+            del self._queues[chat_id]
+            del self._user_rings[chat_id]
+            del self._chat_queued[chat_id]
+            self._chat_ring.remove(chat_id)
+
+    def _is_queued(self, chat_id: int, user_id: int,
+                   waiter: asyncio.Future) -> bool:
+        return waiter in self._queues.get(chat_id, {}).get(user_id, ())
+
+    def _grant_next(self):
+        """Отдать освободившийся слот следующему по кругу"""
+        while self.running < self.max_concurrent and self._chat_ring:
+            chat_id = self._chat_ring[0]
+            self._chat_ring.rotate(-1)
+            user_ring = self._user_rings[chat_id]
+            user_id = user_ring[0]
+            user_ring.rotate(-1)
+            waiter = self._queues[chat_id][user_id][0]
+            self._dequeue(chat_id, user_id, waiter)
+            if waiter.done():
+                # Ожидающего отменили, а его задача ещё не успела выйти из
+                # очереди сама: слот достаётся следующему
+                continue
+            self.running += 1
+            waiter.set_result(None)
+
+    def _release(self, chat_id: int, user_id: int):
+        self.running -= 1
+        key = (chat_id, user_id)
+        self._user_load[key] -= 1
+        if not self._user_load[key]:
+            del self._user_load[key]
+        self._grant_next()
+
+    async def run(self, chat_id: int, user_id: int,
+                  factory: Callable[[], Awaitable[T]]) -> T:
+        """Выполнить factory() с учётом лимитов и очереди"""
+        try:
+            self._check_limits(chat_id, user_id)
+        except SchedulerBusy:
+            self.rejected += 1
+            raise
+        key = (chat_id, user_id)
+        self._user_load[key] = self._user_load.get(key, 0) + 1
+
+        if self.running < self.max_concurrent and not self.queued:
+            self.running += 1
+        else:
+            waiter = self._enqueue(chat_id, user_id)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    # Слот уже выдан, возвращаем его
+                    self._release(chat_id, user_id)
+                else:
+                    if self._is_queued(chat_id, user_id, waiter):
+                        self._dequeue(chat_id, user_id, waiter)
+                    self._user_load[key] -= 1
+                    if not self._user_load[key]:
+                        del self._user_load[key]
+                raise
+
+        try:
+            return await factory()
+        finally:
+            self._release(chat_id, user_id)
@@ -0,0 +1,173 @@
+import heapq
+import logging
+import time
+from typing import Dict, List, Optional, Tuple
+
+from storage import Namespace
+
+# Виды активности; счётчики хранятся списками в этом порядке
+KINDS = ("message", "media", "reaction")
+KIND_INDEX = {kind: index for index, kind in enumerate(KINDS)}
+
+Counters = List[int]
+
+
+def _empty() -> Counters:
+    return [0] * len(KINDS)
+
+
+class DayBucket:
+    """Счётчики чата за одни сутки: всего, по часам и по пользователям"""
+
+    __slots__ = ("totals", "hours", "users")
+
+    def __init__(self):
+        self.totals: Counters = _empty()
+        self.hours: Dict[int, Counters] = {}
+        self.users: Dict[int, Counters] = {}
+
+    def to_dict(self) -> dict:
+        return {"totals": self.totals, "hours": self.hours, "users": self.users}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "DayBucket":
+        bucket = cls()
+        bucket.totals = list(data["totals"])
+        # JSON превращает int-ключи в строки
+        bucket.hours = {int(hour): list(c) for hour, c in data["hours"].items()}
+        bucket.users = {int(user): list(c) for user, c in data["users"].items()}
+        return bucket
+
+
+class ActivityStats:
+    """Инкрементальная статистика активности по чатам
+
+    Каждое событие увеличивает счётчики в корзине своих суток: общие, часа
+    суток и пользователя. Запросы ("кто активнее за неделю", "активность по
+    дням/часам") проходят только по нужным корзинам, без чтения журнала.
+    Храним retention_days последних суток; сутки считаются в часовом поясе
+    utc_offset_hours.
+
+    С namespace постоянного хранилища корзина (чат, сутки) сохраняется
+    отдельным ключом, так что запись идёт только по изменившимся суткам.
+    """
+
+    def __init__(self,
+                 retention_days: int = 30,
+                 utc_offset_hours: float = 0.0,
+                 namespace: Optional[Namespace] = None):
+        self.retention_days = retention_days
+        self.utc_offset = utc_offset_hours * 3600
+        self.namespace = namespace
+        self._chats: Dict[int, Dict[int, DayBucket]] = {}
+
+    def _local(self, timestamp: Optional[float]) -> Tuple[int, int]:
+        """(номер суток, час суток) для момента времени"""
+        local = (time.time() if timestamp is None else timestamp) + self.utc_offset
+        day, seconds = divmod(int(local), 86400)
+        return day, seconds // 3600
+
+    def today(self) -> int:
+        return self._local(None)[0]
+
+    def record(self,
+               chat_id: int,
+               user_id: int,
+               kind: str,
+               timestamp: Optional[float] = None):
+        """Учесть событие kind ("message", "media", "reaction")"""
+        index = KIND_INDEX[kind]
+        day, hour = self._local(timestamp)
+        days = self._chats.get(chat_id)
+        if days is None:
+            days = self._chats[chat_id] = {}
+        bucket = days.get(day)
+        if bucket is None:
+            if day <= self.today() - self.retention_days:
+                return
+            bucket = days[day] = DayBucket()
+            self._evict(chat_id, days)
+        bucket.totals[index] += 1
+        counters = bucket.hours.get(hour)
+        if counters is None:
+            counters = bucket.hours[hour] = _empty()
+        counters[index] += 1
+        counters = bucket.users.get(user_id)
+        if counters is None:
+            counters = bucket.users[user_id] = _empty()
+        counters[index] += 1
+        if self.namespace is not None:
+            self.namespace.set(f"{chat_id}:{day}", bucket.to_dict())
+
+    def _evict(self, chat_id: int, days: Dict[int, DayBucket]):
+        oldest = self.today() - self.retention_days
+        for day in [day for day in days if day <= oldest]:
+            del days[day]
+            if self.namespace is not None:
+                self.namespace.delete(f"{chat_id}:{day}")
+
+    def _recent(self, chat_id: int, days: int) -> List[Tuple[int, DayBucket]]:
+        buckets = self._chats.get(chat_id, {})
+        today = self.today()
+        return [(day, buckets[day]) for day in range(today - days + 1, today + 1)
+                if day in buckets]
+
+    def totals(self, chat_id: int, days: int = 1) -> Counters:
+        """Суммы счётчиков чата за последние days суток"""
+        result = _empty()
+        for _, bucket in self._recent(chat_id, days):
+            for index, value in enumerate(bucket.totals):
+                result[index] += value
+        return result
+
+    def by_day(self, chat_id: int, days: int = 7) -> List[Tuple[int, Counters]]:
+        """Счётчики по суткам, от старых к новым, включая пустые"""
+        buckets = self._chats.get(chat_id, {})
+        today = self.today()
+        return [(day, list(buckets[day].totals) if day in buckets else _empty())
+                for day in range(today - days + 1, today + 1)]
+
+    def by_hour(self, chat_id: int, days: int = 7) -> List[Counters]:
+        """Счётчики по часу суток (0-23), сложенные за days суток"""
+        result = [_empty() for _ in range(24)]
+        for _, bucket in self._recent(chat_id, days):
+            for hour, counters in bucket.hours.items():
+                for index, value in enumerate(counters):
+                    result[hour][index] += value
+        return result
+
+    def top_users(self,
+                  chat_id: int,
+                  n: int = 5,
+                  days: int = 7,
+                  kind: Optional[str] = None) -> List[Tuple[int, int]]:
+        """n самых активных пользователей: [(user_id, событий)]
+
+        Без kind считаются все виды активности.
+        """
+        scores: Dict[int, int] = {}
+        index = None if kind is None else KIND_INDEX[kind]
+        for _, bucket in self._recent(chat_id, days):
+            for user_id, counters in bucket.users.items():
+                value = sum(counters) if index is None else counters[index]
+                scores[user_id] = scores.get(user_id, 0) + value
+        return heapq.nlargest(n, ((user_id, score)
+                                  for user_id, score in scores.items() if score),
+                              key=lambda item: item[1])
+
+    def load(self):
+        """Поднять корзины из постоянного хранилища"""
+        if self.namespace is None:
+            return
+        oldest = self.today() - self.retention_days
+        loaded = 0
+        for key, data in self.namespace.items():
+            chat_key, day_key = key.split(":")
+            day = int(day_key)
+            if day <= oldest:
+                self.namespace.delete(key)
+                continue
+            self._chats.setdefault(int(chat_key),
+                                   {})[day] = DayBucket.from_dict(data)
+            loaded += 1
+        logging.info(f"Загружено {loaded} суточных корзин активности")
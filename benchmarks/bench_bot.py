@@ -0,0 +1,302 @@
+"""Бенчмарк обработки апдейтов ботом на локальных заглушках Telegram и Cohere
+
+Каждый сценарий запускается в отдельном процессе: поднимаются заглушки
+Bot API (tools/fake_telegram.py) и Cohere (tools/fake_cohere.py), бот
+импортируется с настройками на них, синтетические апдейты подаются прямо в
+Dispatcher. Считаются пропускная способность, задержка обработки апдейта
+(p50/p99), время старта и пиковая память процесса.
+
+    python benchmarks/bench_bot.py                      # все сценарии
+    python benchmarks/bench_bot.py ship stats --participants 200000
+    python benchmarks/bench_bot.py --json after.json --compare before.json
+
+Сценарии: spam (обычные сообщения и медиа), commands (развлекательные
+команды), coral (всплеск "коралл ..."), ship и stats (большой журнал
+участников), callbacks (флуд нажатий "участие" с повторами).
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "tools"))
+
+from fake_telegram import (make_callback_update,  # noqa: E402
+                           make_message_update)
+
+SPAM_TEXTS = ["привет всем", "как дела?", "ахаха", "кто идёт вечером?", "ок",
+              "смотрите что нашёл", "😂😂😂", "согласен", None, None]
+COMMANDS = ["пинг", "факт", "цитата", "кубик", "монетка", "предсказание",
+            "комплимент", "гороскоп", "загадка", "покер"]
+QUESTIONS = ["что такое коралловый риф?", "посоветуй фильм", "как дела?",
+             "расскажи анекдот", "сколько щупалец у осьминога?"]
+
+
+def chat_id_for(index: int) -> int:
+    return -1000000000000 - index
+
+
+def gen_spam(rng: random.Random, args) -> List[dict]:
+    return [
+        make_message_update(n, chat_id_for(rng.randrange(args.chats)),
+                            rng.randrange(1, args.users + 1),
+                            rng.choice(SPAM_TEXTS))
+        for n in range(1, args.updates + 1)
+    ]
+
+
+def gen_commands(rng: random.Random, args) -> List[dict]:
+    return [
+        make_message_update(n, chat_id_for(rng.randrange(args.chats)),
+                            rng.randrange(1, args.users + 1),
+                            rng.choice(COMMANDS))
+        for n in range(1, args.updates + 1)
+    ]
+
+
+def gen_coral(rng: random.Random, args) -> List[dict]:
+    return [
+        make_message_update(n, chat_id_for(rng.randrange(args.chats)),
+                            rng.randrange(1, args.users + 1),
+                            f"коралл {rng.choice(QUESTIONS)}")
+        for n in range(1, args.updates + 1)
+    ]
+
+
+def gen_command(text: str) -> Callable[[random.Random, object], List[dict]]:
+
+    def gen(rng: random.Random, args) -> List[dict]:
+        return [
+            make_message_update(n, chat_id_for(rng.randrange(args.chats)),
+                                rng.randrange(1, args.users + 1), text)
+            for n in range(1, args.updates + 1)
+        ]
+
+    return gen
+
+
+def gen_callbacks(rng: random.Random, args) -> List[dict]:
+    updates = []
+    for n in range(1, args.updates + 1):
+        if updates and rng.random() < 0.2:
+            # Повторная доставка уже виденного нажатия
+            updates.append(dict(rng.choice(updates), update_id=n))
+            continue
+        chat_id = chat_id_for(rng.randrange(args.chats))
+        user_id = rng.randrange(1, args.users + 1)
+        updates.append(
+            make_callback_update(n, chat_id, user_id,
+                                 f"register_{chat_id}_{user_id}"))
+    return updates
+
+
+SCENARIOS: Dict[str, Callable] = {
+    "spam": gen_spam,
+    "commands": gen_commands,
+    "coral": gen_coral,
+    "ship": gen_command("шип"),
+    "stats": gen_command("статистика"),
+    "callbacks": gen_callbacks,
+}
+# Сценарии, для которых заранее пишется большой журнал участников
+LARGE_LOG_SCENARIOS = {"ship", "stats"}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def write_participants(path: str, rng: random.Random, participants: int,
+                       chats: int):
+    from participants import encode_record
+    with open(path, 'wb') as f:
+        f.write(b"".join(
+            encode_record(chat_id_for(rng.randrange(chats)), user_id,
+                          f"@user{user_id}", "message")
+            for user_id in range(1, participants + 1)))
+
+
+def percentile(values: List[float], share: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+async def run_child(name: str, args) -> dict:
+    rng = random.Random(args.seed)
+    workdir = tempfile.mkdtemp(prefix="coral-bench-")
+    os.chdir(workdir)
+    if name in LARGE_LOG_SCENARIOS:
+        write_participants("participants.log", rng, args.participants,
+                           args.chats)
+
+    from fake_cohere import FakeCohere
+    from fake_telegram import FakeBotAPI
+    api_port, cohere_port = free_port(), free_port()
+    api = FakeBotAPI(latency=args.api_latency)
+    await api.start("127.0.0.1", api_port)
+    cohere = FakeCohere(latency=args.cohere_latency,
+                        token_delay=args.token_delay)
+    await cohere.start("127.0.0.1", cohere_port)
+
+    os.environ.update({
+        "TELEGRAM_TOKEN": "123456:BENCH",
+        "TELEGRAM_API_URL": f"http://127.0.0.1:{api_port}",
+        "COHERE_API_KEY": "bench",
+        "COHERE_URL": f"http://127.0.0.1:{cohere_port}",
+        "CONTENT_FILE": os.path.join(ROOT, "content.json"),
+        "PARTICIPANTS_FILE": os.path.join(workdir, "participants.log"),
+    })
+    if not args.flood_limits:
+        # Меряем сам бот, а не лимиты Telegram
+        os.environ.update({
+            "OUTBOUND_GLOBAL_RATE": "1000000",
+            "OUTBOUND_GROUP_PER_MINUTE": "1000000",
+            "OUTBOUND_PRIVATE_RATE": "1000000",
+        })
+
+    # Импорт aiogram и модуля бота — постоянная часть, её не считаем
+    import main as bot_main
+    started = time.perf_counter()
+    await bot_main.start_services()
+    startup = time.perf_counter() - started
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    updates = SCENARIOS[name](rng, args)
+    latencies: List[float] = []
+    errors = 0
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def feed(update: dict):
+        nonlocal errors
+        async with semaphore:
+            update_started = time.perf_counter()
+            try:
+                await bot_main.dp.feed_raw_update(bot_main.bot, update)
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - update_started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(feed(update) for update in updates))
+    elapsed = time.perf_counter() - started
+
+    await bot_main.stop_services()
+    await cohere.close()
+    await api.close()
+
+    latencies.sort()
+    return {
+        "scenario": name,
+        "updates": len(updates),
+        "elapsed": elapsed,
+        "throughput": len(updates) / elapsed,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "max_ms": latencies[-1] * 1000,
+        "startup_ms": startup * 1000,
+        # ru_maxrss в Linux — в КиБ
+        "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "rss_growth_mb": (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss -
+                          rss_before) / 1024,
+        "errors": errors,
+        "sent": api.calls["sendmessage"] + api.calls["editmessagetext"],
+        "cohere_requests": cohere.requests,
+        "ai_rejected": bot_main.ai_scheduler.rejected,
+    }
+
+
+def run_scenario(name: str, args) -> dict:
+    """Запустить сценарий в отдельном процессе и вернуть его результат"""
+    command = [
+        sys.executable, os.path.abspath(__file__), name, "--child",
+        "--updates", str(args.updates), "--chats", str(args.chats),
+        "--users", str(args.users), "--participants", str(args.participants),
+        "--concurrency", str(args.concurrency), "--seed", str(args.seed),
+        "--api-latency", str(args.api_latency), "--cohere-latency",
+        str(args.cohere_latency), "--token-delay", str(args.token_delay)
+    ]
+    if args.flood_limits:
+        command.append("--flood-limits")
+    output = subprocess.run(command,
+                            check=True,
+                            stdout=subprocess.PIPE,
+                            text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+COLUMNS = [("throughput", "апд/с", "{:9.0f}"), ("p50_ms", "p50 мс", "{:8.2f}"),
+           ("p99_ms", "p99 мс", "{:8.2f}"), ("startup_ms", "старт мс", "{:9.0f}"),
+           ("rss_mb", "RSS МиБ", "{:8.1f}")]
+
+
+def print_results(results: List[dict], baseline: Dict[str, dict]):
+    header = f"{'сценарий':<10}" + "".join(
+        f"{title:>{len(fmt.format(0))}}" for _, title, fmt in COLUMNS)
+    print(header + "  ответов  ошибок")
+    for result in results:
+        row = f"{result['scenario']:<10}" + "".join(
+            fmt.format(result[key]) for key, _, fmt in COLUMNS)
+        print(f"{row}{result['sent']:9d}{result['errors']:8d}")
+        base = baseline.get(result["scenario"])
+        if base:
+            print(f"{'  vs база':<10}" + "".join(
+                f"{(result[key] / base[key] - 1) * 100:+{len(fmt.format(0)) - 1}.0f}%"
+                if base[key] else " " * len(fmt.format(0))
+                for key, _, fmt in COLUMNS))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("scenarios", nargs="*",
+                        help=f"сценарии: {', '.join(SCENARIOS)} (по умолчанию все)")
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--chats", type=int, default=20)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--participants", type=int, default=100000,
+                        help="участников в журнале для ship/stats")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--api-latency", type=float, default=0.0)
+    parser.add_argument("--cohere-latency", type=float, default=0.05)
+    parser.add_argument("--token-delay", type=float, default=0.0)
+    parser.add_argument("--flood-limits", action="store_true",
+                        help="не снимать лимиты отправки OutboundLimiter")
+    parser.add_argument("--json", help="сохранить результаты в файл")
+    parser.add_argument("--compare", help="сравнить с сохранёнными результатами")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"неизвестные сценарии: {', '.join(sorted(unknown))}")
+
+    if args.child:
+        print(json.dumps(asyncio.run(run_child(args.scenarios[0], args))))
+        return
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = {result["scenario"]: result for result in json.load(f)}
+    results = []
+    for name in args.scenarios or list(SCENARIOS):
+        print(f"… {name}", file=sys.stderr)
+        results.append(run_scenario(name, args))
+    print_results(results, baseline)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Сравнение: новая aiohttp-сессия на каждый запрос против общего CohereClient
+
+Поднимает локальный заменитель /v1/chat и гоняет по нему запросы:
+
+    python benchmarks/bench_cohere_session.py --requests 500 --concurrency 10
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import aiohttp
+from aiohttp import web
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cohere_client import CohereClient  # noqa: E402
+
+
+async def fake_chat(request: web.Request) -> web.Response:
+    await request.json()
+    return web.json_response({"text": "🐙 ok"})
+
+
+async def start_server(host: str, port: int) -> web.AppRunner:
+    app = web.Application()
+    app.router.add_post("/v1/chat", fake_chat)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+async def run_batch(call, requests: int, concurrency: int) -> float:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            await call()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    return time.perf_counter() - started
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--port", type=int, default=18080)
+    args = parser.parse_args()
+
+    runner = await start_server("127.0.0.1", args.port)
+    base_url = f"http://127.0.0.1:{args.port}"
+    payload = {"message": "привет", "chat_history": []}
+
+    async def per_request_session():
+        async with aiohttp.ClientSession() as session:
+            async with session.post(f"{base_url}/v1/chat",
+                                    json=payload) as resp:
+                await resp.json()
+
+    client = CohereClient("bench", base_url=base_url,
+                          pool_size=args.concurrency)
+    await client.start()
+
+    async def shared_session():
+        await client.chat(payload)
+
+    try:
+        for name, call in (("сессия на запрос", per_request_session),
+                           ("общая сессия", shared_session)):
+            elapsed = await run_batch(call, args.requests, args.concurrency)
+            print(f"{name:>18}: {elapsed:.3f} с, "
+                  f"{args.requests / elapsed:.0f} запр/с, "
+                  f"{elapsed / args.requests * 1000:.2f} мс/запр")
+    finally:
+        await client.close()
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
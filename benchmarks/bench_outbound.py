@@ -0,0 +1,103 @@
+"""Отправка без учёта лимитов против OutboundLimiter
+
+Заглушка Bot API держит лимиты, как Telegram (30 сообщений в секунду на
+бота, 20 в минуту на группу) и отвечает 429 сверх них. Бот рассылает пачку
+сообщений по группам: сначала напрямую, затем через OutboundLimiter.
+
+    python benchmarks/bench_outbound.py --messages 300 --chats 50
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), "tools"))
+
+from aiogram import Bot  # noqa: E402
+from aiogram.client.session.aiohttp import AiohttpSession  # noqa: E402
+from aiogram.client.telegram import TelegramAPIServer  # noqa: E402
+from aiogram.exceptions import TelegramRetryAfter  # noqa: E402
+
+from fake_telegram import FakeBotAPI  # noqa: E402
+from outbound import OutboundLimiter, PRIORITY_HIGH, PRIORITY_NORMAL  # noqa: E402
+
+API_PORT = 8093
+
+
+async def run(messages: int, chats: int, limiter: bool) -> dict:
+    api = FakeBotAPI(global_rate=30, chat_per_minute=20)
+    await api.start("127.0.0.1", API_PORT)
+    bot = Bot("123456:BENCH",
+              session=AiohttpSession(api=TelegramAPIServer.from_base(
+                  f"http://127.0.0.1:{API_PORT}")))
+    outbound = OutboundLimiter(max_retries=10) if limiter else None
+    if outbound is not None:
+        bot.session.middleware(outbound)
+
+    latencies = {PRIORITY_HIGH: [], PRIORITY_NORMAL: []}
+    lost = 0
+
+    async def send(index: int):
+        nonlocal lost
+        chat_id = -1000000000000 - index % chats
+        # Каждое пятое сообщение — "ответ ИИ"
+        priority = PRIORITY_HIGH if index % 5 == 0 else PRIORITY_NORMAL
+        started = time.perf_counter()
+        try:
+            if outbound is None:
+                await bot.send_message(chat_id, f"#{index}")
+            else:
+                with outbound.priority(priority):
+                    await bot.send_message(chat_id, f"#{index}")
+        except TelegramRetryAfter:
+            lost += 1
+            return
+        latencies[priority].append(time.perf_counter() - started)
+
+    order = list(range(messages))
+    random.shuffle(order)
+    started = time.perf_counter()
+    await asyncio.gather(*(send(index) for index in order))
+    elapsed = time.perf_counter() - started
+    await bot.session.close()
+    await api.close()
+    return {
+        "elapsed": elapsed,
+        "delivered": len(api.sent),
+        "lost": lost,
+        "flood_errors": api.flood_errors,
+        "latencies": latencies
+    }
+
+
+def report(name: str, result: dict, messages: int):
+    print(f"{name}: доставлено {result['delivered']}/{messages} за "
+          f"{result['elapsed']:.1f} с ({result['delivered'] / result['elapsed']:.1f}/с), "
+          f"ответов 429: {result['flood_errors']}, потеряно: {result['lost']}")
+    for priority, title in ((PRIORITY_HIGH, "высокий"),
+                            (PRIORITY_NORMAL, "обычный")):
+        values = result["latencies"][priority]
+        if values:
+            print(f"    приоритет {title}: медиана задержки "
+                  f"{statistics.median(values):.2f} с")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=300)
+    parser.add_argument("--chats", type=int, default=50)
+    args = parser.parse_args()
+
+    report("Напрямую", await run(args.messages, args.chats, False),
+           args.messages)
+    report("OutboundLimiter", await run(args.messages, args.chats, True),
+           args.messages)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,87 @@
+"""Старый текстовый participants.txt против бинарного журнала
+
+Генерирует текстовый лог, переводит его в бинарный и сжимает, сравнивая
+размер на диске и время построения индекса при старте:
+
+    python benchmarks/bench_participants_log.py --records 200000 --unique 20000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from participants import (compact_log, convert_text_log, iter_keys,  # noqa: E402
+                          parse_participant_line, read_log)
+
+
+def load_text(path: str) -> int:
+    """Построение индекса так, как это делал старый ParticipantStore.load()"""
+    index = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            key = parse_participant_line(line)
+            if key is not None:
+                index.setdefault(key[0], set()).add(key[1])
+    return sum(map(len, index.values()))
+
+
+def load_binary(path: str) -> int:
+    index = {}
+    for chat_id, user_id in iter_keys(read_log(path)):
+        index.setdefault(chat_id, set()).add(user_id)
+    return sum(map(len, index.values()))
+
+
+def timed(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--records", type=int, default=200000)
+    parser.add_argument("--unique", type=int, default=20000)
+    parser.add_argument("--chats", type=int, default=50)
+    args = parser.parse_args()
+
+    actions = ["message", "reaction", "register", "button_register"]
+    participants = [(-1000000000000 - random.randrange(args.chats),
+                     random.randrange(10**9, 8 * 10**9))
+                    for _ in range(args.unique)]
+    with tempfile.TemporaryDirectory() as directory:
+        text_path = os.path.join(directory, "participants.txt")
+        log_path = os.path.join(directory, "participants.log")
+        with open(text_path, 'w', encoding='utf-8') as f:
+            for _ in range(args.records):
+                chat_id, user_id = random.choice(participants)
+                f.write(f"Chat: {chat_id}, User: {user_id}, "
+                        f"Name: @user_{user_id}, "
+                        f"Action: {random.choice(actions)}\n")
+
+        text_count, text_time = timed(load_text, text_path)
+        convert_text_log(text_path, log_path)
+        binary_size = os.path.getsize(log_path)
+        binary_count, binary_time = timed(load_binary, log_path)
+        compact_log(log_path)
+        compact_count, compact_time = timed(load_binary, log_path)
+        assert text_count == binary_count == compact_count
+
+        text_size = os.path.getsize(text_path)
+        print(f"Участников: {text_count} (записей в логе: {args.records})")
+        for name, size, elapsed in (
+            ("текст", text_size, text_time),
+            ("бинарный", binary_size, binary_time),
+            ("бинарный сжатый", os.path.getsize(log_path), compact_time),
+        ):
+            print(f"{name:>16}: {size / 1024:8.0f} КиБ "
+                  f"(x{text_size / size:4.1f}), загрузка "
+                  f"{elapsed * 1000:7.1f} мс (x{text_time / elapsed:4.1f})")
+
+
+if __name__ == "__main__":
+    main()
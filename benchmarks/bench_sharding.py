@@ -0,0 +1,103 @@
+"""Масштабирование BOT_MODE=sharded по числу воркеров
+
+Для каждого числа воркеров поднимает заглушку Bot API, запускает бота
+(фронт + воркеры), отправляет на вебхук пачку апдейтов из многих чатов и
+ждёт, пока на каждый придёт ответ sendMessage:
+
+    python benchmarks/bench_sharding.py --workers 1 2 4 --updates 5000
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "tools"))
+
+from fake_telegram import FakeBotAPI, make_message_update, send_updates  # noqa: E402
+
+
+async def wait_healthy(url: str, timeout: float = 120.0):
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.monotonic() < deadline:
+            try:
+                async with session.get(url) as resp:
+                    if resp.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    raise TimeoutError(f"{url} не ответил за {timeout} с")
+
+
+async def run_once(workers: int, updates: int, chats: int,
+                   api_port: int, bot_port: int,
+                   flood_limits: bool = False) -> float:
+    api = FakeBotAPI()
+    await api.start("127.0.0.1", api_port)
+    workdir = tempfile.mkdtemp(prefix="coral-shard-")
+    env = dict(os.environ,
+               TELEGRAM_TOKEN="123456:BENCH",
+               TELEGRAM_API_URL=f"http://127.0.0.1:{api_port}",
+               BOT_MODE="sharded",
+               SHARD_WORKERS=str(workers),
+               WEBHOOK_PORT=str(bot_port),
+               CONTENT_FILE=os.path.join(ROOT, "content.json"),
+               PYTHONPATH=ROOT)
+    if not flood_limits:
+        # Меряем сам бот, а не лимиты Telegram
+        env.update(OUTBOUND_GLOBAL_RATE="1000000",
+                   OUTBOUND_GROUP_PER_MINUTE="1000000",
+                   OUTBOUND_PRIVATE_RATE="1000000")
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, os.path.join(ROOT, "main.py"),
+        cwd=workdir, env=env,
+        stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL)
+    try:
+        await wait_healthy(f"http://127.0.0.1:{bot_port}/healthz")
+        batch = [
+            make_message_update(i, -1000000000000 - i % chats, i % 500 + 1,
+                                "пинг") for i in range(1, updates + 1)
+        ]
+        started = time.perf_counter()
+        await send_updates(f"http://127.0.0.1:{bot_port}/webhook", batch,
+                           concurrency=50)
+        while api.calls["sendmessage"] < updates:
+            await asyncio.sleep(0.01)
+        return time.perf_counter() - started
+    finally:
+        process.terminate()
+        await process.wait()
+        await api.close()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--updates", type=int, default=5000)
+    parser.add_argument("--chats", type=int, default=200)
+    parser.add_argument("--api-port", type=int, default=18181)
+    parser.add_argument("--bot-port", type=int, default=18180)
+    parser.add_argument("--flood-limits", action="store_true",
+                        help="не снимать лимиты отправки OutboundLimiter")
+    args = parser.parse_args()
+
+    print(f"Ядер: {os.cpu_count()}, апдейтов: {args.updates}, чатов: {args.chats}")
+    baseline = None
+    for workers in args.workers:
+        elapsed = await run_once(workers, args.updates, args.chats,
+                                 args.api_port, args.bot_port,
+                                 args.flood_limits)
+        rate = args.updates / elapsed
+        baseline = baseline or rate
+        print(f"воркеров {workers:>2}: {elapsed:6.2f} с, {rate:7.0f} апд/с, "
+              f"x{rate / baseline:.2f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
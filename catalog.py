@@ -0,0 +1,84 @@
+import asyncio
+import json
+import logging
+import os
+import random
+from types import MappingProxyType
+from typing import Any, Dict, Optional
+
+
+def freeze(value: Any) -> Any:
+    """Списки -> кортежи, словари -> read-only прокси (рекурсивно)"""
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    if isinstance(value, dict):
+        return MappingProxyType({key: freeze(item) for key, item in value.items()})
+    return value
+
+
+class ContentCatalog:
+    """Пулы ответов развлекательных команд из внешнего JSON-файла
+
+    Файл читается один раз, каждый пул хранится неизменяемым кортежем,
+    а случайный ответ выбирается за O(1) без пересборки списков на каждую
+    команду. После start() файл проверяется раз в reload_interval секунд и
+    перечитывается при изменении; битый файл не заменяет рабочие пулы.
+    """
+
+    def __init__(self, path: str, reload_interval: float = 30.0):
+        self.path = path
+        self.reload_interval = reload_interval
+        self._pools: Dict[str, tuple] = {}
+        self._mtime: Optional[float] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def load(self):
+        """Прочитать файл и атомарно заменить пулы"""
+        mtime = os.path.getmtime(self.path)
+        with open(self.path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        pools = {}
+        for name, items in data.items():
+            if not isinstance(items, list) or not items:
+                raise ValueError(f"Пул '{name}' должен быть непустым списком")
+            pools[name] = freeze(items)
+        self._pools = pools
+        self._mtime = mtime
+        logging.info(f"Загружено {len(pools)} пулов контента из {self.path}")
+
+    def reload_if_changed(self) -> bool:
+        """Перечитать файл, если он изменился. Вернуть True, если перечитан"""
+        try:
+            if os.path.getmtime(self.path) == self._mtime:
+                return False
+            self.load()
+            return True
+        except (OSError, ValueError) as e:
+            logging.error(f"Не удалось перечитать {self.path}: {e}")
+            return False
+
+    def pool(self, name: str) -> tuple:
+        return self._pools[name]
+
+    def choice(self, name: str) -> Any:
+        """Случайный элемент пула"""
+        return random.choice(self._pools[name])
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.reload_interval)
+            self.reload_if_changed()
+
+    def start(self):
+        """Включить отслеживание изменений файла"""
+        if self._task is None and self.reload_interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,129 @@
+import asyncio
+import logging
+import random
+import time
+from typing import Awaitable, Callable, Dict, Optional, Set
+
+from storage import Namespace
+
+
+class ChatInfoCache:
+    """Кэш админов и числа участников по чатам
+
+    Данные чата считаются свежими ttl секунд. Первый запрос по чату ждёт
+    загрузки, а устаревшие данные отдаются сразу, пока в фоне идёт одно
+    обновление на чат ("stale-while-revalidate"). invalidate() помечает чат
+    устаревшим, например когда в нём сменились админы.
+
+    С namespace постоянного хранилища удачно загруженные данные
+    сохраняются, и после рестарта load() отдаёт их сразу, не дожидаясь
+    запросов к Telegram.
+
+    Чтобы чаты, загруженные одновременно (после деплоя — все сразу), не
+    устаревали тоже одновременно, срок свежести каждого чата случайно
+    укорачивается на долю jitter от ttl. Устаревшие на момент load() чаты
+    получают сроки, разнесённые по следующим ttl * jitter секундам, и
+    обновляются постепенно, а не на первом же сообщении в каждом.
+    """
+
+    def __init__(self,
+                 fetch_admins: Callable[[int], Awaitable[Set[int]]],
+                 fetch_member_count: Callable[[int], Awaitable[Optional[int]]],
+                 ttl: float = 600.0,
+                 error_ttl: float = 60.0,
+                 jitter: float = 0.0,
+                 namespace: Optional[Namespace] = None):
+        self.fetch_admins = fetch_admins
+        self.fetch_member_count = fetch_member_count
+        self.ttl = ttl
+        self.error_ttl = error_ttl
+        self.jitter = jitter
+        self.hits = 0
+        self.misses = 0
+        self.admins: Dict[int, Set[int]] = {}
+        self.member_counts: Dict[int, int] = {}
+        self.fetched_at: Dict[int, float] = {}
+        self.namespace = namespace
+        self._refreshing: Dict[int, asyncio.Task] = {}
+
+    def __contains__(self, chat_id: int) -> bool:
+        return chat_id in self.fetched_at
+
+    def load(self):
+        """Поднять сохранённые данные чатов с их возрастом"""
+        if self.namespace is None:
+            return
+        now, wall_now = time.monotonic(), time.time()
+        for chat_key, record in self.namespace.items():
+            chat_id = int(chat_key)
+            self.admins[chat_id] = set(record["admins"])
+            if record["count"] is not None:
+                self.member_counts[chat_id] = record["count"]
+            fetched_at = now - (wall_now - record["fetched"])
+            if now - fetched_at >= self.ttl:
+                fetched_at = now - self.ttl + self._spread()
+            self.fetched_at[chat_id] = fetched_at
+        logging.info(f"Загружены данные {len(self.fetched_at)} чатов")
+
+    def _spread(self) -> float:
+        return random.uniform(0, self.ttl * self.jitter)
+
+    def is_fresh(self, chat_id: int) -> bool:
+        fetched_at = self.fetched_at.get(chat_id)
+        return fetched_at is not None and time.monotonic() - fetched_at < self.ttl
+
+    async def _refresh(self, chat_id: int):
+        try:
+            admins, count = await asyncio.gather(
+                self.fetch_admins(chat_id), self.fetch_member_count(chat_id))
+            self.admins[chat_id] = admins
+            if count is not None:
+                self.member_counts[chat_id] = count
+            self.fetched_at[chat_id] = time.monotonic() - self._spread()
+            if self.namespace is not None:
+                self.namespace.set(
+                    str(chat_id), {
+                        "admins": admins,
+                        "count": self.member_counts.get(chat_id),
+                        "fetched": time.time()
+                    })
+            logging.info(f"Найдено {len(admins)} админов в чате {chat_id}")
+        except Exception as e:
+            logging.error(f"Ошибка обновления данных чата {chat_id}: {e}")
+            self.admins.setdefault(chat_id, set())
+            # Повторим не раньше чем через error_ttl, а не на каждой команде
+            self.fetched_at[chat_id] = (time.monotonic() - self.ttl +
+                                        min(self.ttl, self.error_ttl))
+        finally:
+            self._refreshing.pop(chat_id, None)
+
+    def refresh_in_background(self, chat_id: int) -> asyncio.Task:
+        """Запустить обновление чата, если оно ещё не идёт"""
+        task = self._refreshing.get(chat_id)
+        if task is None:
+            task = self._refreshing[chat_id] = asyncio.create_task(
+                self._refresh(chat_id))
+        return task
+
+    async def get(self, chat_id: int):
+        """Обеспечить наличие данных чата; свежесть догоняется в фоне"""
+        if self.is_fresh(chat_id):
+            self.hits += 1
+            return
+        self.misses += 1
+        task = self.refresh_in_background(chat_id)
+        if chat_id not in self.fetched_at:
+            # Данных ещё нет совсем — придётся подождать первую загрузку
+            await asyncio.shield(task)
+
+    def invalidate(self, chat_id: int):
+        """Пометить данные чата устаревшими"""
+        if chat_id in self.fetched_at:
+            self.fetched_at[chat_id] = float("-inf")
+
+    async def close(self):
+        """Отменить фоновые обновления: после закрытия сессии бота они не нужны"""
+        tasks = list(self._refreshing.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,286 @@
+import asyncio
+import json
+import logging
+import random
+import time
+from typing import AsyncIterator, Dict, Optional
+
+import aiohttp
+
+# Статусы, при которых есть смысл повторить запрос
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class CohereError(Exception):
+    """Cohere ответил не 200"""
+
+    def __init__(self, status: int, text: str = ""):
+        super().__init__(f"Cohere API вернул {status}")
+        self.status = status
+        self.text = text
+
+
+class CohereUnavailable(Exception):
+    """Circuit breaker разомкнут, запрос в Cohere не отправлялся"""
+
+    def __init__(self, retry_in: float):
+        super().__init__(f"Cohere недоступен, повтор через {retry_in:.0f} с")
+        self.retry_in = retry_in
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Retry-After в секундах (форму с HTTP-датой Cohere не использует)"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return None
+
+
+class CircuitBreaker:
+    """Размыкатель: после серии ошибок перестаёт пускать запросы
+
+    closed — запросы идут как обычно; после failure_threshold ошибок подряд
+    переходит в open и сразу отказывает, пока не пройдёт reset_timeout;
+    затем half_open пропускает один пробный запрос: успех замыкает цепь,
+    ошибка снова размыкает.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened = 0
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if (self._state == self.OPEN
+                and time.monotonic() - self._opened_at >= self.reset_timeout):
+            self._state = self.HALF_OPEN
+            self._probe_in_flight = False
+        return self._state
+
+    def retry_in(self) -> float:
+        return max(0.0,
+                   self.reset_timeout - (time.monotonic() - self._opened_at))
+
+    def allow(self) -> bool:
+        """Можно ли отправить запрос сейчас"""
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        if state == self.HALF_OPEN and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        return False
+
+    def record_success(self):
+        if self._state != self.CLOSED:
+            logging.info("Cohere снова отвечает, circuit breaker замкнут")
+        self._state = self.CLOSED
+        self.failures = 0
+        self._probe_in_flight = False
+
+    def abort_probe(self):
+        """Пробный запрос оборвался без ответа (отменён): пробовать снова"""
+        if self._state == self.HALF_OPEN:
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self._state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self._state != self.OPEN:
+                logging.warning(
+                    f"Cohere не отвечает (ошибок подряд: {self.failures}), "
+                    f"circuit breaker разомкнут на {self.reset_timeout:.0f} с")
+                self.opened += 1
+            self._state = self.OPEN
+            self._opened_at = time.monotonic()
+            self._probe_in_flight = False
+
+
+class CohereClient:
+    """Клиент Cohere Chat API поверх одной долгоживущей сессии
+
+    Сессия создаётся один раз (start() в main()) и переиспользует
+    keep-alive соединения из ограниченного пула, DNS-ответы кэшируются,
+    поэтому TCP+TLS рукопожатие не добавляется к каждому ответу ИИ.
+
+    Временные ошибки (429/5xx, сетевые сбои, таймауты) повторяются с
+    экспоненциальной задержкой и джиттером, Retry-After учитывается. Пока
+    CircuitBreaker разомкнут, запросы сразу падают с CohereUnavailable.
+    """
+
+    def __init__(self,
+                 api_key: str,
+                 base_url: str = "https://api.cohere.ai",
+                 pool_size: int = 20,
+                 dns_ttl: int = 300,
+                 keepalive_timeout: float = 60.0,
+                 connect_timeout: float = 5.0,
+                 total_timeout: float = 60.0,
+                 max_retries: int = 3,
+                 backoff_base: float = 0.5,
+                 backoff_max: float = 10.0,
+                 breaker: Optional[CircuitBreaker] = None):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+        self.pool_size = pool_size
+        self.dns_ttl = dns_ttl
+        self.keepalive_timeout = keepalive_timeout
+        self.connect_timeout = connect_timeout
+        self.total_timeout = total_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = breaker or CircuitBreaker()
+        self.counters: Dict[str, int] = {
+            "requests": 0,
+            "retries": 0,
+            "failures": 0,
+            "short_circuited": 0
+        }
+        # Ответы по HTTP-коду, сетевые сбои — по имени исключения
+        self.statuses: Dict[str, int] = {}
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    @property
+    def headers(self) -> dict:
+        return {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+
+    async def start(self):
+        """Создать общую сессию с пулом соединений"""
+        if self._session is not None and not self._session.closed:
+            return
+        connector = aiohttp.TCPConnector(
+            limit=self.pool_size,
+            limit_per_host=self.pool_size,
+            ttl_dns_cache=self.dns_ttl,
+            keepalive_timeout=self.keepalive_timeout)
+        timeout = aiohttp.ClientTimeout(total=self.total_timeout,
+                                        connect=self.connect_timeout)
+        self._session = aiohttp.ClientSession(connector=connector,
+                                              timeout=timeout)
+        logging.info(f"Сессия Cohere открыта (пул {self.pool_size})")
+
+    async def close(self):
+        """Закрыть сессию и все соединения пула"""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            raise RuntimeError("CohereClient не запущен, вызовите start()")
+        return self._session
+
+    def stats(self) -> Dict[str, object]:
+        """Счётчики запросов и состояние circuit breaker"""
+        return dict(self.counters,
+                    breaker_state=self.breaker.state,
+                    breaker_opened=self.breaker.opened)
+
+    def _count_status(self, status: str):
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+
+    def _backoff(self, attempt: int) -> float:
+        # "Full jitter": случайная задержка до экспоненциального потолка
+        return random.uniform(
+            0, min(self.backoff_max, self.backoff_base * 2**(attempt - 1)))
+
+    async def _open(self, payload: dict) -> aiohttp.ClientResponse:
+        """Открыть ответ POST /v1/chat с повторами временных ошибок"""
+        if not self.breaker.allow():
+            self.counters["short_circuited"] += 1
+            raise CohereUnavailable(self.breaker.retry_in())
+        probe = self.breaker.state == CircuitBreaker.HALF_OPEN
+        try:
+            return await self._post(payload)
+        except BaseException:
+            # Иначе отменённая проба навсегда оставит размыкатель занятым
+            if probe:
+                self.breaker.abort_probe()
+            raise
+
+    async def _post(self, payload: dict) -> aiohttp.ClientResponse:
+        attempt = 0
+        while True:
+            self.counters["requests"] += 1
+            delay = None
+            try:
+                resp = await self.session.post(f"{self.base_url}/v1/chat",
+                                               headers=self.headers,
+                                               json=payload)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = e
+                self._count_status(type(e).__name__)
+            else:
+                self._count_status(str(resp.status))
+                if resp.status == 200:
+                    self.breaker.record_success()
+                    return resp
+                error = CohereError(resp.status, await resp.text())
+                resp.release()
+                if resp.status not in RETRY_STATUSES:
+                    # Ошибка в самом запросе, Cohere при этом здоров
+                    self.breaker.record_success()
+                    raise error
+                delay = parse_retry_after(resp.headers.get("Retry-After"))
+
+            self.counters["failures"] += 1
+            self.breaker.record_failure()
+            attempt += 1
+            if attempt > self.max_retries or self.breaker.state != CircuitBreaker.CLOSED:
+                raise error
+            if delay is None:
+                delay = self._backoff(attempt)
+            elif delay > self.backoff_max:
+                # Ждать дольше, чем пользователь готов, нет смысла
+                raise error
+            self.counters["retries"] += 1
+            logging.warning(
+                f"Cohere: {error!r}, повтор {attempt}/{self.max_retries} через {delay:.1f} с"
+            )
+            await asyncio.sleep(delay)
+
+    async def chat(self, payload: dict) -> dict:
+        """POST /v1/chat, вернуть JSON ответа"""
+        resp = await self._open(payload)
+        async with resp:
+            return await resp.json()
+
+    async def chat_stream(self, payload: dict) -> AsyncIterator[str]:
+        """POST /v1/chat со stream=true, отдавать куски текста по мере прихода
+
+        Cohere присылает события построчно (NDJSON): текст приходит в
+        событиях text-generation, поток заканчивается событием stream-end.
+        Повторы возможны только до первого куска текста.
+        """
+        resp = await self._open(dict(payload, stream=True))
+        async with resp:
+            async for raw_line in resp.content:
+                line = raw_line.strip()
+                if not line:
+                    continue
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    logging.warning(f"Непонятная строка потока Cohere: {line!r}")
+                    continue
+                event_type = event.get("event_type")
+                if event_type == "text-generation":
+                    yield event.get("text", "")
+                elif event_type == "stream-end":
+                    return
@@ -0,0 +1,58 @@
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from aiogram.types import Message
+
+CommandHandler = Callable[[Message, str], Awaitable[None]]
+
+
+class CommandRegistry:
+    """Таблица текстовых команд без слэша
+
+    Точные команды и их синонимы ищутся одним обращением к словарю, команды
+    с префиксом ("коралл ...") — по одной проверке на каждую длину префикса.
+    Обычный текст, не похожий на команду, отсеивается за те же несколько
+    поисков, сколько бы команд ни было зарегистрировано.
+    """
+
+    def __init__(self):
+        self.exact: Dict[str, CommandHandler] = {}
+        self.prefixes: Dict[str, CommandHandler] = {}
+        self._prefix_lengths: List[int] = []
+
+    def command(self, *names: str):
+        """Декоратор: команда, совпадающая с текстом целиком"""
+
+        def decorator(handler: CommandHandler) -> CommandHandler:
+            for name in names:
+                self.exact[name] = handler
+            return handler
+
+        return decorator
+
+    def prefix(self, *prefixes: str):
+        """Декоратор: команда по началу текста, остаток уходит в args"""
+
+        def decorator(handler: CommandHandler) -> CommandHandler:
+            for prefix in prefixes:
+                self.prefixes[prefix] = handler
+            # Длинные префиксы проверяются первыми
+            self._prefix_lengths = sorted({len(p)
+                                           for p in self.prefixes},
+                                          reverse=True)
+            return handler
+
+        return decorator
+
+    def resolve(self, text: str) -> Optional[Tuple[CommandHandler, int]]:
+        """Найти обработчик для текста (уже в нижнем регистре и без пробелов
+        по краям). Вернуть (обработчик, длина префикса) или None"""
+        handler = self.exact.get(text)
+        if handler is not None:
+            return handler, len(text)
+        for length in self._prefix_lengths:
+            if len(text) < length:
+                continue
+            handler = self.prefixes.get(text[:length])
+            if handler is not None:
+                return handler, length
+        return None
@@ -0,0 +1,59 @@
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable
+
+
+class RecentKeys:
+    """Ограниченное множество недавно виденных ключей (например, id апдейтов)
+
+    Хранит не больше max_size последних ключей: повторная доставка
+    приходит вскоре после первой, старые ключи можно забывать.
+    """
+
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        self.duplicates = 0
+        self._keys: "OrderedDict[Hashable, None]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def add(self, key: Hashable) -> bool:
+        """Запомнить ключ. Вернуть False, если он уже встречался"""
+        if key in self._keys:
+            self.duplicates += 1
+            return False
+        self._keys[key] = None
+        if len(self._keys) > self.max_size:
+            self._keys.popitem(last=False)
+        return True
+
+
+class Debouncer:
+    """Не чаще одного события на ключ за interval секунд"""
+
+    def __init__(self, interval: float = 1.0, max_size: int = 10000):
+        self.interval = interval
+        self.max_size = max_size
+        self.suppressed = 0
+        self._last: Dict[Hashable, float] = {}
+
+    def hit(self, key: Hashable) -> bool:
+        """Отметить событие. Вернуть False, если предыдущее было слишком недавно"""
+        now = time.monotonic()
+        last = self._last.get(key)
+        if last is not None and now - last < self.interval:
+            self.suppressed += 1
+            return False
+        if last is None and len(self._last) >= self.max_size:
+            self._prune(now)
+        self._last[key] = now
+        return True
+
+    def _prune(self, now: float):
+        # Ключи старше interval уже ничего не ограничивают
+        for key in [
+                key for key, last in self._last.items()
+                if now - last >= self.interval
+        ]:
+            del self._last[key]
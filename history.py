@@ -0,0 +1,155 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from typing import Deque, List, Optional, Tuple
+
+from storage import Namespace
+
+DialogKey = Tuple[int, int]
+
+
+class Dialog:
+    """Сообщения одного диалога и их суммарная длина"""
+
+    __slots__ = ("messages", "chars", "touched")
+
+    def __init__(self):
+        self.messages: Deque[dict] = deque()
+        self.chars = 0
+        self.touched = time.monotonic()
+
+
+class HistoryStore:
+    """История разговоров с ИИ по ключу (chat_id, user_id)
+
+    Каждый диалог обрезается по бюджету символов (старые сообщения уходят
+    первыми), а всего диалогов хранится не больше max_dialogs: лишние
+    вытесняются по LRU, неактивные дольше ttl секунд удаляются. Так память
+    не растёт на долгоживущем процессе, а в Cohere уходит меньше текста.
+
+    Если передан namespace постоянного хранилища, каждый изменённый диалог
+    попадает туда, а load() поднимает историю после рестарта.
+    """
+
+    def __init__(self,
+                 max_chars: int = 4000,
+                 max_dialogs: int = 1000,
+                 ttl: float = 6 * 3600,
+                 namespace: Optional[Namespace] = None,
+                 evict_interval: float = 60.0):
+        self.max_chars = max_chars
+        self.max_dialogs = max_dialogs
+        self.ttl = ttl
+        self.namespace = namespace
+        self.evict_interval = evict_interval
+        self._dialogs: "OrderedDict[DialogKey, Dialog]" = OrderedDict()
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._dialogs)
+
+    def _expired(self, dialog: Dialog, now: float) -> bool:
+        return self.ttl > 0 and now - dialog.touched > self.ttl
+
+    @staticmethod
+    def _storage_key(key: DialogKey) -> str:
+        return f"{key[0]}:{key[1]}"
+
+    def _forget(self, key: DialogKey):
+        del self._dialogs[key]
+        if self.namespace is not None:
+            self.namespace.delete(self._storage_key(key))
+
+    def _persist(self, key: DialogKey, dialog: Dialog):
+        if self.namespace is not None:
+            # Время на диске — по настенным часам, monotonic после рестарта другой
+            age = time.monotonic() - dialog.touched
+            self.namespace.set(self._storage_key(key), {
+                "touched": time.time() - age,
+                "messages": dialog.messages
+            })
+
+    def get(self, chat_id: int, user_id: int) -> List[dict]:
+        """Копия истории диалога (пустая, если её нет или она устарела)"""
+        key = (chat_id, user_id)
+        dialog = self._dialogs.get(key)
+        if dialog is None:
+            return []
+        if self._expired(dialog, time.monotonic()):
+            self._forget(key)
+            return []
+        return list(dialog.messages)
+
+    def append(self, chat_id: int, user_id: int, role: str, message: str):
+        """Добавить сообщение в диалог и обрезать его по бюджету"""
+        key = (chat_id, user_id)
+        now = time.monotonic()
+        dialog = self._dialogs.get(key)
+        if dialog is None or self._expired(dialog, now):
+            dialog = self._dialogs[key] = Dialog()
+        self._dialogs.move_to_end(key)
+        dialog.touched = now
+        dialog.messages.append({"role": role, "message": message})
+        dialog.chars += len(message)
+        # Последнее сообщение оставляем, даже если оно само больше бюджета
+        while dialog.chars > self.max_chars and len(dialog.messages) > 1:
+            dialog.chars -= len(dialog.messages.popleft()["message"])
+        self._persist(key, dialog)
+        while len(self._dialogs) > self.max_dialogs:
+            self._forget(next(iter(self._dialogs)))
+
+    def evict_expired(self) -> int:
+        """Удалить устаревшие диалоги, вернуть их количество"""
+        now = time.monotonic()
+        expired = [
+            key for key, dialog in self._dialogs.items()
+            if self._expired(dialog, now)
+        ]
+        for key in expired:
+            self._forget(key)
+        return len(expired)
+
+    def load(self):
+        """Поднять историю из постоянного хранилища"""
+        if self.namespace is None:
+            return
+        now, wall_now = time.monotonic(), time.time()
+        restored = []
+        for storage_key, record in self.namespace.items():
+            chat_id, user_id = map(int, storage_key.split(":"))
+            dialog = Dialog()
+            dialog.touched = now - (wall_now - record["touched"])
+            if self._expired(dialog, now):
+                self.namespace.delete(storage_key)
+                continue
+            for message in record["messages"]:
+                dialog.messages.append(message)
+                dialog.chars += len(message["message"])
+            restored.append(((chat_id, user_id), dialog))
+        # Самые давние диалоги — в начало LRU
+        restored.sort(key=lambda item: item[1].touched)
+        self._dialogs = OrderedDict(restored)
+        while len(self._dialogs) > self.max_dialogs:
+            self._forget(next(iter(self._dialogs)))
+        logging.info(f"Загружено {len(self._dialogs)} диалогов")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.evict_interval)
+            self.evict_expired()
+
+    def start(self):
+        """Включить периодическую очистку устаревших диалогов"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """Остановить фоновую очистку"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -1,37 +1,278 @@
 import logging
-import ssl
-import aiohttp
 import asyncio
 import random
 import os
-from typing import List, Dict, Set
+import signal
+import time
+from contextlib import aclosing
+from typing import List, Dict, Optional, Set
 from dotenv import load_dotenv
 from aiogram import Bot, Dispatcher
-from aiogram.types import Message, ChatMemberOwner, ChatMemberAdministrator, ChatMember, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.types import Message, ChatMemberOwner, ChatMemberAdministrator, ChatMember, ChatMemberUpdated, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, Update
 from aiogram.filters import Command
-from aiogram.enums import ParseMode, ChatType
+from aiogram.enums import ParseMode, ChatType, ChatMemberStatus
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
 from aiogram.fsm.storage.memory import MemoryStorage
+from participants import ParticipantStore
+from storage import ChunkedSets, PersistentFSMStorage, SQLiteBackend, StateStore
+from outbound import OutboundLimiter, PRIORITY_HIGH, PRIORITY_LOW, SendSkipped
+from dedup import Debouncer, RecentKeys
+from analytics import ActivityStats
+from metrics import LoopLagMonitor, MetricsServer, Registry, TelegramMetricsMiddleware
+from tracing import TraceRequestMiddleware, Tracer, span
+from profiler import SamplingProfiler, format_profile
+from cohere_client import CircuitBreaker, CohereClient, CohereError, CohereUnavailable
+from ai_scheduler import AIScheduler, SchedulerBusy
+from history import HistoryStore
+from reply_cache import ReplyCache
+from user_cache import UserCache
+from chat_cache import ChatInfoCache
+from commands import CommandRegistry
+from catalog import ContentCatalog
+from webhook import register_webhook, run_webhook
+from sharding import run_sharded
 
 # Загрузка переменных окружения
 load_dotenv("misc.env")
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
 COHERE_API_KEY = os.getenv("COHERE_API_KEY")
 ADMIN_ID = int(os.getenv("ADMIN_ID", "0"))
+# Бинарный журнал участников; старый participants.txt переводится в него сам
+PARTICIPANTS_FILE = os.getenv("PARTICIPANTS_FILE", "participants.log")
+PARTICIPANTS_MAX_BYTES = int(
+    os.getenv("PARTICIPANTS_MAX_BYTES", str(16 * 1024 * 1024)))
+PARTICIPANTS_BATCH_SIZE = int(os.getenv("PARTICIPANTS_BATCH_SIZE", "100"))
+PARTICIPANTS_FLUSH_INTERVAL = float(
+    os.getenv("PARTICIPANTS_FLUSH_INTERVAL", "1.0"))
+COHERE_URL = os.getenv("COHERE_URL", "https://api.cohere.ai")
+COHERE_POOL_SIZE = int(os.getenv("COHERE_POOL_SIZE", "20"))
+COHERE_CONNECT_TIMEOUT = float(os.getenv("COHERE_CONNECT_TIMEOUT", "5"))
+COHERE_TIMEOUT = float(os.getenv("COHERE_TIMEOUT", "60"))
+COHERE_MAX_RETRIES = int(os.getenv("COHERE_MAX_RETRIES", "3"))
+COHERE_BREAKER_THRESHOLD = int(os.getenv("COHERE_BREAKER_THRESHOLD", "5"))
+COHERE_BREAKER_RESET = float(os.getenv("COHERE_BREAKER_RESET", "30"))
+AI_MAX_CONCURRENT = int(os.getenv("AI_MAX_CONCURRENT", "4"))
+AI_MAX_QUEUE = int(os.getenv("AI_MAX_QUEUE", "50"))
+AI_MAX_QUEUE_PER_CHAT = int(os.getenv("AI_MAX_QUEUE_PER_CHAT", "5"))
+AI_MAX_PER_USER = int(os.getenv("AI_MAX_PER_USER", "2"))
+AI_STREAMING = os.getenv("AI_STREAMING", "1") == "1"
+AI_STREAM_EDIT_INTERVAL = float(os.getenv("AI_STREAM_EDIT_INTERVAL", "1.5"))
+# Кэш ответов ИИ на одинаковые вопросы; REPLY_CACHE_SIZE=0 — выключен
+REPLY_CACHE_SIZE = int(os.getenv("REPLY_CACHE_SIZE", "500"))
+REPLY_CACHE_TTL = float(os.getenv("REPLY_CACHE_TTL", "600"))
+# Кэшируются вопросы с историей диалога не длиннее стольких сообщений
+REPLY_CACHE_MAX_HISTORY = int(os.getenv("REPLY_CACHE_MAX_HISTORY", "0"))
+HISTORY_MAX_CHARS = int(os.getenv("HISTORY_MAX_CHARS", "4000"))
+HISTORY_MAX_DIALOGS = int(os.getenv("HISTORY_MAX_DIALOGS", "1000"))
+HISTORY_TTL = float(os.getenv("HISTORY_TTL", str(6 * 3600)))
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "3600"))
+# Минимальный интервал между нажатиями кнопок одним пользователем
+CALLBACK_DEBOUNCE = float(os.getenv("CALLBACK_DEBOUNCE", "1.0"))
+# Статистика активности: сколько суток хранить и часовой пояс суток
+STATS_RETENTION_DAYS = int(os.getenv("STATS_RETENTION_DAYS", "30"))
+STATS_UTC_OFFSET = float(os.getenv("STATS_UTC_OFFSET", "3"))
+CHAT_INFO_TTL = float(os.getenv("CHAT_INFO_TTL", "600"))
+# Доля CHAT_INFO_TTL, на которую случайно разносятся обновления чатов
+CHAT_INFO_JITTER = float(os.getenv("CHAT_INFO_JITTER", "0.2"))
+CONTENT_FILE = os.getenv("CONTENT_FILE", "content.json")
+CONTENT_RELOAD_INTERVAL = float(os.getenv("CONTENT_RELOAD_INTERVAL", "30"))
+# Файл SQLite для FSM, историй, индекса участников и данных чатов;
+# без него всё живёт только в памяти процесса
+STATE_DB = os.getenv("STATE_DB") or None
+STATE_FLUSH_INTERVAL = float(os.getenv("STATE_FLUSH_INTERVAL", "2.0"))
+# Лимиты исходящих сообщений (flood control Telegram)
+OUTBOUND_GLOBAL_RATE = float(os.getenv("OUTBOUND_GLOBAL_RATE", "30"))
+OUTBOUND_GROUP_PER_MINUTE = float(os.getenv("OUTBOUND_GROUP_PER_MINUTE", "20"))
+OUTBOUND_PRIVATE_RATE = float(os.getenv("OUTBOUND_PRIVATE_RATE", "1"))
+# Свой Bot API сервер (локальный telegram-bot-api или заглушка для тестов)
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL") or None
+# Метрики Prometheus на http://METRICS_HOST:METRICS_PORT/metrics; 0 — выключены
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.5"))
+# Апдейты дольше TRACE_SLOW_MS пишутся в лог с разбивкой по участкам; 0 — выключено
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", "1000"))
+# Профилировщик по команде "профиль" или сигналу SIGUSR1
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.005"))
+PROFILE_SECONDS = float(os.getenv("PROFILE_SECONDS", "30"))
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "300"))
+# Режим получения апдейтов: polling или webhook
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or None
+WEBHOOK_URL = os.getenv("WEBHOOK_URL") or None
+# BOT_MODE=sharded: фронт-вебхук и столько процессов-воркеров
+SHARD_WORKERS = int(os.getenv("SHARD_WORKERS", str(os.cpu_count() or 1)))
+# Номер воркера; задаёт фронт при запуске воркеров
+SHARD_INDEX = os.getenv("SHARD_INDEX")
+# Фронт режима sharded только раскладывает апдейты, состояние — у воркеров
+SHARD_FRONT = BOT_MODE == "sharded" and SHARD_INDEX is None
 
 # Инициализация
-bot = Bot(token=TELEGRAM_TOKEN)
-storage = MemoryStorage()
+bot = Bot(token=TELEGRAM_TOKEN,
+          session=AiohttpSession(api=TelegramAPIServer.from_base(
+              TELEGRAM_API_URL)) if TELEGRAM_API_URL else None)
+if TRACE_SLOW_MS:
+    # До outbound: спан запроса включает ожидание в очереди отправки
+    bot.session.middleware(TraceRequestMiddleware())
+# Все исходящие запросы проходят через планировщик с лимитами Telegram
+outbound = OutboundLimiter(global_rate=OUTBOUND_GLOBAL_RATE,
+                           group_per_minute=OUTBOUND_GROUP_PER_MINUTE,
+                           private_rate=OUTBOUND_PRIVATE_RATE)
+bot.session.middleware(outbound)
+# Метрики процесса; счётчики копятся всегда, HTTP-сервер — при METRICS_PORT
+metrics = Registry()
+telegram_requests = metrics.counter("coral_telegram_requests_total",
+                                    "Запросы к Bot API по методам и исходу",
+                                    ("method", "status"))
+telegram_latency = metrics.histogram("coral_telegram_request_seconds",
+                                     "Длительность запроса к Bot API",
+                                     ("method", ))
+# После outbound: ожидание в его очереди не входит в длительность запроса
+bot.session.middleware(
+    TelegramMetricsMiddleware(telegram_requests, telegram_latency))
+state_store = StateStore(SQLiteBackend(STATE_DB),
+                         flush_interval=STATE_FLUSH_INTERVAL
+                         ) if STATE_DB and not SHARD_FRONT else None
+
+
+def state_namespace(name: str):
+    """Раздел постоянного хранилища или None, если STATE_DB не задан"""
+    return state_store.namespace(name) if state_store else None
+
+
+storage = PersistentFSMStorage(
+    state_namespace("fsm")) if state_store else MemoryStorage()
 dp = Dispatcher(storage=storage)
+tracer = Tracer(threshold=TRACE_SLOW_MS / 1000)
+if TRACE_SLOW_MS:
+    tracer.setup(dp)
+profiler = SamplingProfiler(PROFILE_DIR,
+                            interval=PROFILE_INTERVAL,
+                            source_root=os.path.dirname(os.path.abspath(__file__)))
+commands = CommandRegistry()
+content = ContentCatalog(CONTENT_FILE, reload_interval=CONTENT_RELOAD_INTERVAL)
+cohere = CohereClient(COHERE_API_KEY,
+                      base_url=COHERE_URL,
+                      pool_size=COHERE_POOL_SIZE,
+                      connect_timeout=COHERE_CONNECT_TIMEOUT,
+                      total_timeout=COHERE_TIMEOUT,
+                      max_retries=COHERE_MAX_RETRIES,
+                      breaker=CircuitBreaker(
+                          failure_threshold=COHERE_BREAKER_THRESHOLD,
+                          reset_timeout=COHERE_BREAKER_RESET))
+ai_scheduler = AIScheduler(max_concurrent=AI_MAX_CONCURRENT,
+                           max_queue=AI_MAX_QUEUE,
+                           max_queue_per_chat=AI_MAX_QUEUE_PER_CHAT,
+                           max_per_user=AI_MAX_PER_USER)
+reply_cache = ReplyCache(
+    max_size=REPLY_CACHE_SIZE,
+    ttl=REPLY_CACHE_TTL,
+    max_history=REPLY_CACHE_MAX_HISTORY) if REPLY_CACHE_SIZE else None
 
 # Хранилище истории чата и участников
-user_histories = {}
+user_histories = HistoryStore(max_chars=HISTORY_MAX_CHARS,
+                              max_dialogs=HISTORY_MAX_DIALOGS,
+                              ttl=HISTORY_TTL,
+                              namespace=state_namespace("histories"))
+# Активные участники чатов; при STATE_DB переживают рестарт
 chat_members: Dict[int, Set[int]] = {}
-chat_admins: Dict[int, Set[int]] = {}
+chat_members_saved = ChunkedSets(
+    state_namespace("members")) if state_store else None
+user_cache = UserCache(max_size=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+activity = ActivityStats(retention_days=STATS_RETENTION_DAYS,
+                         utc_offset_hours=STATS_UTC_OFFSET,
+                         namespace=state_namespace("activity"))
 
 # Файл для хранения участников
-participants_file = "participants.txt"
+participants_file = PARTICIPANTS_FILE
+participant_store = ParticipantStore(participants_file,
+                                     batch_size=PARTICIPANTS_BATCH_SIZE,
+                                     flush_interval=PARTICIPANTS_FLUSH_INTERVAL,
+                                     namespace=state_namespace("participants"),
+                                     max_bytes=PARTICIPANTS_MAX_BYTES,
+                                     legacy_path="participants.txt")
+
+
+# Метрики обработки; очереди и кэши читаются в момент запроса /metrics
+update_latency = metrics.histogram("coral_update_seconds",
+                                   "Полная обработка апдейта по типу",
+                                   ("type", ))
+command_latency = metrics.histogram("coral_command_seconds",
+                                    "Обработка текстовой команды",
+                                    ("command", ))
+cohere_latency = metrics.histogram(
+    "coral_cohere_seconds", "Ответ Cohere с повторами: chat — целиком, "
+    "stream_first — до первого куска, stream — весь поток", ("mode", ))
+metrics.counter("coral_cohere_requests_total",
+                "Попытки запросов к Cohere по HTTP-коду или ошибке",
+                ("status", ),
+                collect=lambda: {(status, ): count
+                                 for status, count in cohere.statuses.items()})
+metrics.counter("coral_cohere_events_total",
+                "Повторы, сбои и отказы circuit breaker Cohere", ("event", ),
+                collect=lambda: {(event, ): count
+                                 for event, count in cohere.counters.items()})
+metrics.gauge("coral_cohere_breaker_open", "1, если circuit breaker разомкнут",
+              collect=lambda: {
+                  (): float(cohere.breaker.state != CircuitBreaker.CLOSED)
+              })
+metrics.gauge("coral_queue_depth", "Глубина внутренних очередей", ("queue", ),
+              collect=lambda: {
+                  ("ai_running", ): ai_scheduler.running,
+                  ("ai_queued", ): ai_scheduler.queued,
+                  ("outbound_waiting", ): outbound.waiting,
+                  ("participants_pending", ): participant_store.pending,
+                  ("state_pending", ):
+                  state_store.pending if state_store else 0,
+              })
+metrics.counter("coral_dropped_total",
+                "Отклонённые и отсеянные события по причине", ("reason", ),
+                collect=lambda: {
+                    ("ai_rejected", ): ai_scheduler.rejected,
+                    ("callback_duplicate", ): seen_callbacks.duplicates,
+                    ("callback_debounced", ): registration_debounce.suppressed,
+                })
+metrics.counter("coral_outbound_total",
+                "Исходящие запросы через OutboundLimiter", ("event", ),
+                collect=lambda: {
+                    ("sent", ): outbound.sent,
+                    ("delayed", ): outbound.delayed,
+                    ("retried", ): outbound.retried,
+                    ("skipped", ): outbound.skipped,
+                })
+metrics.counter("coral_cache_requests_total",
+                "Обращения к кэшам по результату", ("cache", "result"),
+                collect=lambda: {
+                    ("users", "hit"): user_cache.hits,
+                    ("users", "miss"): user_cache.misses,
+                    ("chats", "hit"): chat_info.hits,
+                    ("chats", "miss"): chat_info.misses,
+                    ("replies", "hit"): reply_cache.hits if reply_cache is not None else 0,
+                    ("replies", "miss"):
+                    reply_cache.misses if reply_cache is not None else 0,
+                })
+metrics.counter("coral_ai_coalesced_total",
+                "Вопросы к ИИ, дождавшиеся ответа такого же идущего запроса",
+                collect=lambda: {
+                    (): reply_cache.coalesced if reply_cache is not None else 0
+                })
+loop_lag = LoopLagMonitor(
+    metrics.histogram("coral_loop_lag_seconds",
+                      "Опоздание пробуждения event loop"),
+    metrics.gauge("coral_loop_lag_last_seconds",
+                  "Последнее измеренное опоздание event loop"),
+    interval=LOOP_LAG_INTERVAL)
+metrics_server = MetricsServer(metrics, METRICS_HOST,
+                               METRICS_PORT) if METRICS_PORT else None
 
 
 class Form(StatesGroup):
@@ -43,106 +284,114 @@ def save_participant(chat_id: int,
                      username: str = None,
                      first_name: str = None,
                      action: str = "register"):
-    """Сохранить участника в файл"""
-    # Проверяем, есть ли уже такой пользователь в файле (любое действие)
-    if os.path.exists(participants_file):
-        with open(participants_file, 'r', encoding='utf-8') as f:
-            existing_lines = f.readlines()
-            for line in existing_lines:
-                if f"Chat: {chat_id}, User: {user_id}" in line:
-                    return  # Пользователь уже существует, не добавляем повторно
-
-    with open(participants_file, 'a', encoding='utf-8') as f:
-        user_info = f"@{username}" if username else first_name or f"User_{user_id}"
-        f.write(
-            f"Chat: {chat_id}, User: {user_id}, Name: {user_info}, Action: {action}\n"
-        )
+    """Сохранить участника в файл (запись идёт в фоне пачками)"""
+    # Дубликаты (любое действие) отсекаются по индексу в памяти, файл не читается
+    with span("save_participant"):
+        participant_store.add(chat_id, user_id, username, first_name, action)
+
+
+def load_participants_from_file(chat_id: int) -> Set[int]:
+    """Участники конкретного чата из индекса (файл не перечитывается)"""
+    return participant_store.members(chat_id)
+
+
+async def get_chat_member_count(chat_id: int) -> int:
+    """Получить количество участников чата"""
+    count = await bot.get_chat_member_count(chat_id)
+    logging.info(f"Участников в чате {chat_id}: {count}")
+    return count
+
+
+async def get_chat_admin_ids(chat_id: int) -> Set[int]:
+    """Получить админов чата (без ботов)"""
+    admins = await bot.get_chat_administrators(chat_id)
+    admin_ids = set()
+    for admin in admins:
+        # Заодно запоминаем имена — упоминания админов не потребуют запросов
+        user_cache.remember(admin.user.id, admin.user.username,
+                            admin.user.first_name)
+        if not admin.user.is_bot:
+            admin_ids.add(admin.user.id)
+    return admin_ids
+
+
+chat_info = ChatInfoCache(get_chat_admin_ids,
+                          get_chat_member_count,
+                          ttl=CHAT_INFO_TTL,
+                          jitter=CHAT_INFO_JITTER,
+                          namespace=state_namespace("chats"))
+chat_admins = chat_info.admins
+
+
+def add_chat_member(chat_id: int, user_id: int):
+    """Добавить пользователя в кэш активных участников чата"""
+    members = chat_members.get(chat_id)
+    if members is None:
+        members = chat_members[chat_id] = set()
+    elif user_id in members:
+        return
+    members.add(user_id)
+    if chat_members_saved is not None:
+        chat_members_saved.add(str(chat_id), user_id)
 
 
-def load_participants_from_file(chat_id: int) -> List[int]:
-    """Загрузить участников из файла для конкретного чата"""
-    participants = []
-    if os.path.exists(participants_file):
-        with open(participants_file, 'r', encoding='utf-8') as f:
-            for line in f:
-                if f"Chat: {chat_id}" in line:
-                    # Извлекаем user_id из строки формата "Chat: -1002629246104, User: 1693165490, Name: @RookingIt, Action: message"
-                    parts = line.split(", ")
-                    for part in parts:
-                        if part.startswith("User: "):
-                            user_id = int(part.replace("User: ", ""))
-                            if user_id not in participants:
-                                participants.append(user_id)
-                            break
-    return participants
-
-
-async def get_chat_members(chat_id: int) -> List[int]:
-    """Получить список участников чата"""
-    try:
-        members = []
-        # Получаем количество участников через get_chat_members_count
-        count = await bot.get_chat_member_count(chat_id)
-        logging.info(f"Участников в чате {chat_id}: {count}")
-        return members
-    except Exception as e:
-        logging.error(f"Ошибка получения участников: {e}")
-        return []
+def load_chat_members():
+    """Поднять кэш активных участников из постоянного хранилища"""
+    if chat_members_saved is None:
+        return
+    for chat_key, members in chat_members_saved.load().items():
+        chat_members[int(chat_key)] = members
+    logging.info(f"Загружены активные участники {len(chat_members)} чатов")
 
 
 async def update_chat_members(chat_id: int):
-    """Обновить кэш участников чата"""
-    members = await get_chat_members(chat_id)
-    chat_members[chat_id] = set(members)
-    # Получить админов
-    try:
-        admins = await bot.get_chat_administrators(chat_id)
-        admin_ids = []
-        for admin in admins:
-            if not admin.user.is_bot:
-                admin_ids.append(admin.user.id)
-        chat_admins[chat_id] = set(admin_ids)
-        logging.info(f"Найдено {len(admin_ids)} админов в чате {chat_id}")
-    except Exception as e:
-        logging.error(f"Ошибка получения админов: {e}")
-        chat_admins[chat_id] = set()
+    """Обновить кэш админов и числа участников чата, если он устарел"""
+    chat_members.setdefault(chat_id, set())
+    with span("update_chat_members"):
+        await chat_info.get(chat_id)
+
+
+MARKDOWN_SPECIAL_CHARS = "_*[]()~`>#+-=|{}.!"
+
+
+def escape_markdown(text: str) -> str:
+    """Экранировать специальные символы для Markdown"""
+    for char in MARKDOWN_SPECIAL_CHARS:
+        text = text.replace(char, f"\\{char}")
+    return text
+
+
+def format_mention(user_id: int, username: str = None,
+                   first_name: str = None) -> str:
+    """Упоминание пользователя в Markdown"""
+    if username:
+        return f"@{escape_markdown(username)}"
+    if first_name:
+        return f"[{escape_markdown(first_name)}](tg://user?id={user_id})"
+    return f"[User {user_id}](tg://user?id={user_id})"
 
 
 async def get_user_mention(user_id: int, chat_id: int) -> str:
-    """Получить упоминание пользователя"""
+    """Получить упоминание пользователя (сначала из кэша, потом через API)"""
+    cached = user_cache.get(user_id)
+    if cached is not None:
+        return format_mention(user_id, *cached)
     try:
         member = await bot.get_chat_member(chat_id, user_id)
         user = member.user
-        if user.username:
-            # Экранируем специальные символы для Markdown
-            username = user.username.replace('_', '\\_').replace(
-                '*', '\\*').replace('[', '\\[').replace(']', '\\]').replace(
-                    '(',
-                    '\\(').replace(')', '\\)').replace('~', '\\~').replace(
-                        '`',
-                        '\\`').replace('>', '\\>').replace('#', '\\#').replace(
-                            '+', '\\+').replace('-', '\\-').replace(
-                                '=', '\\=').replace('|', '\\|').replace(
-                                    '{', '\\{').replace('}', '\\}').replace(
-                                        '.', '\\.').replace('!', '\\!')
-            return f"@{username}"
-        else:
-            # Экранируем имя для Markdown
-            first_name = user.first_name.replace('_', '\\_').replace(
-                '*', '\\*').replace('[', '\\[').replace(']', '\\]').replace(
-                    '(',
-                    '\\(').replace(')', '\\)').replace('~', '\\~').replace(
-                        '`',
-                        '\\`').replace('>', '\\>').replace('#', '\\#').replace(
-                            '+', '\\+').replace('-', '\\-').replace(
-                                '=', '\\=').replace('|', '\\|').replace(
-                                    '{', '\\{').replace('}', '\\}').replace(
-                                        '.', '\\.').replace('!', '\\!')
-            return f"[{first_name}](tg://user?id={user_id})"
+        user_cache.remember(user_id, user.username, user.first_name)
+        return format_mention(user_id, user.username, user.first_name)
     except Exception:
         return f"[User {user_id}](tg://user?id={user_id})"
 
 
+async def get_user_mentions(user_ids: List[int], chat_id: int) -> List[str]:
+    """Упоминания нескольких пользователей; промахи кэша запрашиваются параллельно"""
+    with span(f"get_user_mentions {len(user_ids)}"):
+        return list(await asyncio.gather(
+            *(get_user_mention(user_id, chat_id) for user_id in user_ids)))
+
+
 def is_group_chat(message: Message) -> bool:
     """Проверить, является ли чат групповым"""
     return message.chat.type in [ChatType.GROUP, ChatType.SUPERGROUP]
@@ -154,94 +403,285 @@ async def log_user_activity(message: Message, action: str = "message"):
         chat_id = message.chat.id
         user_id = message.from_user.id
         user = message.from_user
+        user_cache.remember(user_id, user.username, user.first_name)
 
         # Добавляем в кэш
-        if chat_id not in chat_members:
-            chat_members[chat_id] = set()
-        chat_members[chat_id].add(user_id)
+        add_chat_member(chat_id, user_id)
+        activity.record(chat_id, user_id, action, message.date.timestamp())
 
         # Сохраняем в файл
         save_participant(chat_id, user_id, user.username, user.first_name,
                          action)
 
 
-async def ask_cohere(user_id: int, prompt: str):
-    """Запрос к Cohere API"""
-    url = "https://api.cohere.ai/v1/chat"
-    headers = {
-        "Authorization": f"Bearer {COHERE_API_KEY}",
-        "Content-Type": "application/json"
+PREAMBLE = (
+    "Ты — Коралл, умный и дружелюбный групповой бот. Ты помогаешь участникам группы, "
+    "отвечаешь на вопросы, развлекаешь и создаёшь позитивную атмосферу. "
+    "Ты говоришь живо, с юмором, но всегда вежливо и конструктивно. "
+    "Отвечай коротко и по делу 🐙")
+AI_UNAVAILABLE_TEXT = "🌊 Коралл временно не может думать — ИИ недоступен. Попробуй через минуту!"
+EMPTY_REPLY_TEXT = "(пустой ответ)"
+# Предельная длина текста одного сообщения Telegram
+MESSAGE_LIMIT = 4096
+
+
+def build_cohere_payload(chat_id: int, user_id: int, prompt: str) -> dict:
+    """Собрать запрос к Cohere с историей диалога пользователя в этом чате"""
+    return {
+        "model": "command-r-plus",
+        "message": prompt,
+        "chat_history": user_histories.get(chat_id, user_id),
+        "preamble": PREAMBLE
     }
 
-    history = user_histories.get(user_id, [])
-    history.append({"role": "USER", "message": prompt})
-
-    payload = {
-        "model":
-        "command-r-plus",
-        "message":
-        prompt,
-        "chat_history":
-        history,
-        "preamble":
-        ("Ты — Коралл, умный и дружелюбный групповой бот. Ты помогаешь участникам группы, "
-         "отвечаешь на вопросы, развлекаешь и создаёшь позитивную атмосферу. "
-         "Ты говоришь живо, с юмором, но всегда вежливо и конструктивно. "
-         "Отвечай коротко и по делу 🐙")
-    }
 
+def remember_reply(chat_id: int, user_id: int, prompt: str, reply: str):
+    """Сохранить вопрос и ответ бота в историю диалога"""
+    user_histories.append(chat_id, user_id, "USER", prompt)
+    user_histories.append(chat_id, user_id, "CHATBOT", reply)
+
+
+def fit_message(text: str, suffix: str = "") -> str:
+    """Обрезать text так, чтобы вместе с suffix он влез в одно сообщение"""
+    limit = MESSAGE_LIMIT - len(suffix)
+    if len(text) > limit:
+        text = text[:limit - 1] + "…"
+    return text + suffix
+
+
+class ReplyEditor:
+    """Промежуточные правки потокового ответа в фоне
+
+    Чтение потока только отдаёт последний текст в update(), а одна фоновая
+    задача правит сообщение не чаще interval секунд, считая от конца
+    предыдущей правки. Пока правка идёт, новые куски лишь заменяют текст, так
+    что ни очередь правок, ни ожидание Telegram не тормозят чтение потока.
+    """
+
+    def __init__(self, sent: Message, text: str, interval: float):
+        self.sent = sent
+        self.shown = text
+        self.interval = interval
+        self._text = text
+        self._changed = asyncio.Event()
+        self._editing = False
+        self._closed = False
+        self._task = asyncio.create_task(self._run())
+
+    def update(self, text: str):
+        if text != self._text:
+            self._text = text
+            self._changed.set()
+
+    async def _run(self):
+        while not self._closed:
+            await asyncio.sleep(self.interval)
+            await self._changed.wait()
+            self._changed.clear()
+            text = self._text
+            self._editing = True
+            try:
+                with outbound.priority(PRIORITY_LOW):
+                    await self.sent.edit_text(text)
+                self.shown = text
+            except SendSkipped:
+                # Лимит чата исчерпан: попробуем с новым текстом позже
+                self._changed.set()
+            except TelegramBadRequest as e:
+                # Не страшно: итог всё равно будет в финальной правке
+                logging.warning(f"Не удалось обновить ответ ИИ: {e}")
+            finally:
+                self._editing = False
+
+    async def close(self):
+        """Остановить правки; уже отправленной дать закончиться"""
+        self._closed = True
+        if not self._editing:
+            self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+
+
+async def answer_markdown(message: Message, text: str):
+    """Ответить с Markdown, а при битой разметке — простым текстом"""
+    text = fit_message(text)
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, headers=headers,
-                                    json=payload) as resp:
-                if resp.status != 200:
-                    return f"❌ Ошибка AI: {resp.status}"
-                result = await resp.json()
-                reply = result.get("text", "(пустой ответ)")
-                history.append({"role": "CHATBOT", "message": reply})
-                user_histories[user_id] = history[-10:]
-                return reply
-    except Exception as e:
-        return f"💥 Ошибка при запросе: {e}"
+        await message.answer(text, parse_mode=ParseMode.MARKDOWN)
+    except TelegramBadRequest as e:
+        logging.warning(f"Не удалось применить Markdown: {e}")
+        await message.answer(text)
 
 
-@dp.message()
-async def handle_message(message: Message, state: FSMContext):
-    if not message.text:
-        # Логируем любую активность (стикеры, фото и т.д.)
-        await log_user_activity(message, "media")
+def cohere_error_text(error: Exception) -> str:
+    """Сообщение пользователю об ошибке запроса к ИИ"""
+    if isinstance(error, CohereUnavailable):
+        return AI_UNAVAILABLE_TEXT
+    if isinstance(error, CohereError):
+        return f"❌ Ошибка AI: {error.status}"
+    return f"💥 Ошибка при запросе: {error}"
+
+
+async def ask_cohere(chat_id: int,
+                     user_id: int,
+                     prompt: str,
+                     cache_key: Optional[str] = None):
+    """Запрос к Cohere API
+
+    С cache_key ответ или ошибка достаются и тем, кто ждёт такой же вопрос.
+    """
+    payload = build_cohere_payload(chat_id, user_id, prompt)
+
+    started = time.perf_counter()
+    try:
+        with span("cohere chat"):
+            result = await cohere.chat(payload)
+        cohere_latency.observe(time.perf_counter() - started, mode="chat")
+        reply = result.get("text") or ""
+    except Exception as e:
+        if cache_key is not None:
+            reply_cache.end(cache_key, error=e)
+        return cohere_error_text(e)
+    if cache_key is not None:
+        reply_cache.end(cache_key, reply)
+    reply = reply or EMPTY_REPLY_TEXT
+    remember_reply(chat_id, user_id, prompt, reply)
+    return reply
+
+
+async def answer_cohere_streaming(message: Message,
+                                  user_id: int,
+                                  prompt: str,
+                                  cache_key: Optional[str] = None):
+    """Потоковый ответ Cohere: первое сообщение по первым токенам, дальше правки
+
+    Промежуточные правки идут в фоне через ReplyEditor не чаще
+    AI_STREAM_EDIT_INTERVAL; финальная правка применяет Markdown. Ответ длиннее MESSAGE_LIMIT
+    показывается обрезанным, а ошибки Telegram не выдаются за ошибки ИИ.
+    С cache_key итоговый ответ или ошибка достаются и тем, кто ждёт такой же
+    вопрос.
+    """
+    payload = build_cohere_payload(message.chat.id, user_id, prompt)
+    reply = ""
+    sent = None
+    editor = None
+
+    started = time.perf_counter()
+    try:
+        with span("cohere stream"):
+            try:
+                async with aclosing(cohere.chat_stream(payload)) as stream:
+                    async for chunk in stream:
+                        if not reply:
+                            cohere_latency.observe(
+                                time.perf_counter() - started,
+                                mode="stream_first")
+                        reply += chunk
+                        if not reply.strip():
+                            continue
+                        text = fit_message(reply)
+                        if sent is None:
+                            sent = await message.answer(text)
+                            editor = ReplyEditor(sent, text,
+                                                 AI_STREAM_EDIT_INTERVAL)
+                        else:
+                            editor.update(text)
+            finally:
+                if editor is not None:
+                    await editor.close()
+    except TelegramAPIError:
+        # Ошибка Telegram, а не ИИ: ожидающие такой же вопрос спросят сами
+        raise
+    except Exception as e:
+        if cache_key is not None:
+            reply_cache.end(cache_key, error=e)
+        error = cohere_error_text(e)
+        try:
+            if sent is None:
+                await message.answer(error)
+            else:
+                await sent.edit_text(fit_message(reply, f"\n\n{error}"))
+        except TelegramBadRequest as telegram_error:
+            logging.warning(f"Не удалось сообщить об ошибке ИИ: {telegram_error}")
+        return
+    cohere_latency.observe(time.perf_counter() - started, mode="stream")
+    if cache_key is not None:
+        reply_cache.end(cache_key, reply)
+
+    if not reply.strip():
+        reply = EMPTY_REPLY_TEXT
+    remember_reply(message.chat.id, user_id, prompt, reply)
+    if sent is None:
+        await answer_markdown(message, reply)
+    else:
+        text = fit_message(reply)
+        try:
+            await sent.edit_text(text, parse_mode=ParseMode.MARKDOWN)
+        except TelegramBadRequest as e:
+            # "message is not modified" или битая разметка — оставляем как есть
+            if text != editor.shown:
+                logging.warning(f"Не удалось применить Markdown: {e}")
+                await sent.edit_text(text)
+
+
+@commands.prefix("коралл", "coral")
+async def cmd_coral(message: Message, args: str):
+    """Вопрос к ИИ"""
+    prompt = args
+    if not prompt:
+        await message.answer("🐙 Коралл слушает! О чём хочешь поговорить?")
         return
 
-    text = message.text.lower().strip()
+    user_id = message.from_user.id
+    chat_id = message.chat.id
+    # Ответ ИИ ждали дольше всех, он уходит раньше развлекательных команд
+    with outbound.priority(PRIORITY_HIGH):
+        cache_key = reply_cache.key(build_cohere_payload(
+            chat_id, user_id, prompt)) if reply_cache is not None else None
+        if cache_key is not None:
+            # Такой же вопрос уже задавали: ответ из кэша или из идущего
+            # запроса, без очереди ИИ и без второго вызова API
+            try:
+                shared = await reply_cache.join(cache_key)
+            except Exception as e:
+                await message.answer(cohere_error_text(e))
+                return
+            if shared is not None:
+                shared = shared or EMPTY_REPLY_TEXT
+                remember_reply(chat_id, user_id, prompt, shared)
+                await answer_markdown(message, shared)
+                return
+            reply_cache.begin(cache_key)
+        try:
+            if AI_STREAMING:
+                await ai_scheduler.run(
+                    chat_id, user_id, lambda: answer_cohere_streaming(
+                        message, user_id, prompt, cache_key))
+                return
+            response = await ai_scheduler.run(
+                chat_id, user_id,
+                lambda: ask_cohere(chat_id, user_id, prompt, cache_key))
+        except SchedulerBusy:
+            await message.answer(
+                "🐙 Коралл сейчас отвечает другим, щупалец не хватает! Попробуй чуть позже."
+            )
+            return
+        finally:
+            if cache_key is not None:
+                # Очередь переполнена или обработчик прерван — ожидающие
+                # спросят сами; после ответа это ничего не делает
+                reply_cache.abandon(cache_key)
+        await answer_markdown(message, response)
 
-    # Логируем сообщение
-    await log_user_activity(message, "message")
 
-    if is_group_chat(message):
-        chat_id = message.chat.id
-        if chat_id not in chat_members:
-            await update_chat_members(chat_id)
-
-    # Команды без слэша
-    if text.startswith("коралл") or text.startswith("coral"):
-        prompt = message.text[6:].strip() if text.startswith(
-            "коралл") else message.text[5:].strip()
-        if prompt:
-            response = await ask_cohere(message.from_user.id, prompt)
-            await message.answer(response, parse_mode=ParseMode.MARKDOWN)
-        else:
-            await message.answer("🐙 Коралл слушает! О чём хочешь поговорить?")
+@commands.command("пинг", "ping")
+async def cmd_ping(message: Message, args: str):
+    """Проверка связи"""
+    await message.answer(content.choice("ping"))
 
-    elif text in ["пинг", "ping"]:
-        ping_responses = [
-            "🏓 Понг! Коралл на связи!", "🎯 Попал! Я здесь!",
-            "⚡ Молниеносно отвечаю!", "🚀 Коралл в деле!", "💫 Как дела? Я тут!",
-            "🌊 Плещусь в чате!", "🐙 Щупальца готовы к работе!"
-        ]
-        await message.answer(random.choice(ping_responses))
 
-    elif text in ["помощь", "команды", "help"]:
-        help_text = """🐙 **Команды Коралла:**
+@commands.command("помощь", "команды", "help")
+async def cmd_help(message: Message, args: str):
+    """Список команд"""
+    help_text = """🐙 **Команды Коралла:**
 
 **Общение:**
 • коралл [вопрос] — поговорить с ИИ
@@ -272,483 +712,455 @@ async def handle_message(message: Message, state: FSMContext):
 **Инфо:**
 • статистика — статистика группы
 • админы — список админов"""
-        await message.answer(help_text, parse_mode=ParseMode.MARKDOWN)
+    await message.answer(help_text, parse_mode=ParseMode.MARKDOWN)
 
-    elif text == "участие":
-        if not is_group_chat(message):
-            await message.answer("🐙 Эта команда работает только в группах!")
-            return
 
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[[
-            InlineKeyboardButton(
-                text="Нажмите на кнопку, чтобы добавиться в список участников",
-                callback_data=
-                f"register_{message.chat.id}_{message.from_user.id}")
-        ]])
+@commands.command("участие")
+async def cmd_join(message: Message, args: str):
+    """Кнопка регистрации в списке участников"""
+    if not is_group_chat(message):
+        await message.answer("🐙 Эта команда работает только в группах!")
+        return
 
-        await message.answer("🐙 Хотите участвовать в активностях группы?",
-                             reply_markup=keyboard)
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[[
+        InlineKeyboardButton(
+            text="Нажмите на кнопку, чтобы добавиться в список участников",
+            callback_data=
+            f"register_{message.chat.id}_{message.from_user.id}")
+    ]])
 
-    elif text == "шип":
-        if not is_group_chat(message):
-            await message.answer("🐙 Эта команда работает только в группах!")
-            return
+    await message.answer("🐙 Хотите участвовать в активностях группы?",
+                         reply_markup=keyboard)
 
-        # Загружаем участников из файла
-        file_participants = load_participants_from_file(message.chat.id)
 
-        # Объединяем с участниками из кэша
-        cache_participants = list(chat_members.get(message.chat.id, set()))
-        all_participants = list(set(file_participants + cache_participants))
+@commands.command("шип")
+async def cmd_ship(message: Message, args: str):
+    """Случайная парочка из участников чата"""
+    if not is_group_chat(message):
+        await message.answer("🐙 Эта команда работает только в группах!")
+        return
 
-        # Если нет участников, добавляем текущего пользователя
-        if not all_participants:
-            if message.chat.id not in chat_members:
-                chat_members[message.chat.id] = set()
-            chat_members[message.chat.id].add(message.from_user.id)
-            all_participants = [message.from_user.id]
+    # Участники из индекса файла
+    file_participants = load_participants_from_file(message.chat.id)
 
-        if len(all_participants) < 2:
-            await message.answer(
-                "🐙 В группе слишком мало участников для выбора! Нужно минимум 2 участника."
-            )
-            return
+    # Объединяем с участниками из кэша
+    cache_participants = chat_members.get(message.chat.id, set())
+    all_participants = list(file_participants | cache_participants)
 
-        pair = random.sample(all_participants, 2)
-        mention1 = await get_user_mention(pair[0], message.chat.id)
-        mention2 = await get_user_mention(pair[1], message.chat.id)
-        wishes = [
-            "Желаем вам счастья и любви!",
-            "Пусть ваша дружба крепнет с каждым днём!",
-            "Любите и поддерживайте друг друга!",
-            "Пусть ваши дни будут полны радости и понимания!",
-            "Всегда оставайтесь рядом и цените моменты вместе!",
-            "Пусть ваша связь будет крепкой как кораллы!",
-            "Вместе вы непобедимы!",
-            "Пусть каждый день приносит новые приключения!",
-            "Ваша дружба — настоящее сокровище!",
-            "Пусть смех и радость не покидают вас!"
-        ]
-        wish = random.choice(wishes)
-        await message.answer(f"💕 Парочка: {mention1} и {mention2}. {wish}",
-                             parse_mode=ParseMode.MARKDOWN)
-
-    elif text == "предсказание":
-        predictions = [
-            "🔮 Не бойся менять жизнь!", "✨ Что-то хорошее произойдёт скоро.",
-            "🌟 Ты на правильном пути.", "🍀 Удача улыбнётся тебе сегодня.",
-            "🎯 Твои мечты ближе, чем кажется.",
-            "🌈 После дождичка в четверг будет радуга.",
-            "💎 Ты найдёшь то, что давно искал.",
-            "🚀 Впереди тебя ждут новые возможности.",
-            "🎪 Жизнь готовит тебе приятный сюрприз.",
-            "🌸 Твоя доброта вернётся к тебе сторицей."
-        ]
-        await message.answer(random.choice(predictions))
-
-    elif text == "миссия":
-        tasks = [
-            "🎯 Скажи 'банан' в разговоре незаметно.",
-            "🤝 Отправь сообщение дружелюбно кому-то.",
-            "💝 Сделай комплимент участнику.", "📚 Поделись интересным фактом.",
-            "🎵 Напой песню (текстом).", "🤔 Задай философский вопрос.",
-            "🎭 Расскажи смешную историю.", "🌟 Поблагодари кого-то за что-то.",
-            "🎨 Опиши свой идеальный день.", "🚀 Поделись своей мечтой."
-        ]
-        mission = random.choice(tasks)
-        await message.answer(f"🎯 Твоя миссия: {mission}")
-
-    elif text == "цитата":
-        quotes = [
-            "💫 'Будь собой — все остальные роли уже заняты.' — Оскар Уайльд",
-            "🌟 'Жизнь — это то, что происходит, пока ты строишь планы.' — Джон Леннон",
-            "🎯 'Единственный способ делать отличную работу — любить то, что делаешь.' — Стив Джобс",
-            "🌈 'Счастье — это не цель, а побочный продукт жизни.' — Элеонор Рузвельт",
-            "🚀 'Будущее принадлежит тем, кто верит в красоту своих мечтаний.' — Элеонор Рузвельт",
-            "💎 'Не ждите особого случая — каждый день особенный.' — Неизвестный автор",
-            "🌸 'Улыбка — это кривая, которая всё выпрямляет.' — Филлис Диллер",
-            "⭐ 'Начинайте там, где вы есть. Используйте то, что у вас есть. Делайте то, что можете.' — Артур Эш"
-        ]
-        await message.answer(random.choice(quotes))
-
-    elif text == "факт":
-        facts = [
-            "🐙 Осьминоги имеют три сердца и голубую кровь!",
-            "🍯 Мёд никогда не портится — археологи находили съедобный мёд возрастом 3000 лет!",
-            "🌙 На Луне твой вес был бы в 6 раз меньше!",
-            "🐧 Пингвины могут прыгать на высоту до 2 метров!",
-            "🌊 В океане больше артефактов истории, чем во всех музеях мира!",
-            "🧠 Человеческий мозг использует 20% всей энергии тела!",
-            "🦋 Бабочки пробуют еду лапками!",
-            "🌍 Банан — это ягода, а клубника — нет!",
-            "⚡ Молния в 5 раз горячее поверхности Солнца!",
-            "🐨 Коалы спят 22 часа в сутки!"
-        ]
-        await message.answer(random.choice(facts))
-
-    elif text == "комплимент":
-        compliments = [
-            "✨ Ты освещаешь этот чат своим присутствием!",
-            "🌟 У тебя потрясающее чувство юмора!",
-            "💫 Ты делаешь мир лучше просто тем, что есть!",
-            "🎨 Твоя креативность вдохновляет!",
-            "🌈 Ты как радуга после дождя — приносишь радость!",
-            "💎 Ты ценнее любых драгоценностей!",
-            "🚀 Твоя энергия заразительна в лучшем смысле!",
-            "🌸 Ты как весенний цветок — приносишь красоту в жизнь!",
-            "⭐ Ты звезда этого чата!", "🎵 Твой голос важен и нужен!"
-        ]
-        await message.answer(random.choice(compliments))
-
-    elif text == "мотивация":
-        motivations = [
-            "💪 Ты сильнее, чем думаешь!",
-            "🎯 Каждый маленький шаг ведёт к большой цели!",
-            "🌟 Твои возможности безграничны!",
-            "🚀 Сегодня отличный день для новых достижений!",
-            "💫 Ты уже на пути к успеху!",
-            "🏆 Победа начинается с первого шага!",
-            "🌈 После каждой бури выходит солнце!",
-            "💎 Ты создан для великих дел!", "⚡ В тебе есть сила изменить мир!",
-            "🌸 Верь в себя — это первый шаг к успеху!"
-        ]
-        await message.answer(random.choice(motivations))
-
-    elif text == "викторина":
-        questions = [
-            "🤔 Какой цвет получится, если смешать красный и синий?",
-            "🌍 Какая самая высокая гора в мире?",
-            "🐧 Где живут пингвины — на Северном или Южном полюсе?",
-            "🌙 Сколько спутников у Земли?",
-            "🍯 Что производят пчёлы кроме мёда?",
-            "🌊 Какой океан самый большой?", "🦕 В какую эпоху жили динозавры?",
-            "🌟 Какая звезда ближайшая к Земле?",
-            "🏛️ В какой стране находится Тадж-Махал?",
-            "🎵 Сколько струн у классической гитары?"
-        ]
-        await message.answer(random.choice(questions))
-
-    elif text == "челлендж":
-        challenges = [
-            "📱 Час без телефона — сможешь?",
-            "💧 Выпей 8 стаканов воды сегодня!",
-            "📚 Прочитай 10 страниц любой книги.",
-            "🚶 Пройди 10000 шагов сегодня!", "🧘 Помедитируй 5 минут.",
-            "📞 Позвони старому другу.", "🎨 Нарисуй что-нибудь за 5 минут.",
-            "🌱 Посади семечко или полей растение.",
-            "📝 Напиши список из 10 вещей, за которые благодарен.",
-            "🎵 Выучи слова новой песни."
-        ]
-        challenge = random.choice(challenges)
-        await message.answer(f"🏆 Челлендж дня: {challenge}")
-
-    elif text == "гороскоп":
-        # Сначала выбираем случайный знак зодиака
-        signs = [{
-            "sign":
-            "♈ Овен",
-            "predictions": [
-                "Сегодня ваша энергия на пике! Отличное время для новых начинаний.",
-                "Марс дарит вам силу и уверенность. Действуйте решительно!",
-                "Ваша импульсивность сегодня сыграет вам на руку.",
-                "Лидерские качества помогут вам достичь цели."
-            ]
-        }, {
-            "sign":
-            "♉ Телец",
-            "predictions": [
-                "Стабильность и терпение — ваши союзники сегодня.",
-                "Венера благословляет ваши отношения и финансы.",
-                "Не торопитесь — медленно, но верно к успеху.",
-                "Ваша практичность принесёт материальную выгоду."
-            ]
-        }, {
-            "sign":
-            "♊ Близнецы",
-            "predictions": [
-                "День полон интересных встреч и неожиданных открытий.",
-                "Меркурий усиливает вашу коммуникабельность.",
-                "Новая информация откроет перспективы.",
-                "Ваше остроумие очарует окружающих."
-            ]
-        }, {
-            "sign":
-            "♋ Рак",
-            "predictions": [
-                "Доверьтесь своей интуиции — она не подведёт.",
-                "Луна усиливает ваши эмоции и чувствительность.",
-                "Семейные дела требуют внимания.",
-                "Забота о близких принесёт радость."
-            ]
-        }, {
-            "sign":
-            "♌ Лев",
-            "predictions": [
-                "Ваш шарм и харизма сегодня особенно заметны!",
-                "Солнце освещает путь к славе и признанию.",
-                "Творческие проекты получат одобрение.",
-                "Ваша щедрость будет вознаграждена."
-            ]
-        }, {
-            "sign":
-            "♍ Дева",
-            "predictions": [
-                "Внимание к деталям принесёт успех в делах.",
-                "Меркурий помогает в анализе и планировании.",
-                "Организованность — ваше преимущество.",
-                "Здоровье требует заботы и внимания."
-            ]
-        }, {
-            "sign":
-            "♎ Весы",
-            "predictions": [
-                "Гармония и баланс — ключ к решению проблем.",
-                "Венера дарит красоту и эстетическое наслаждение.",
-                "Партнёрские отношения на подъёме.",
-                "Справедливость восторжествует в ваших делах."
-            ]
-        }, {
-            "sign":
-            "♏ Скорпион",
-            "predictions": [
-                "Глубокие размышления приведут к важным выводам.",
-                "Плутон раскрывает скрытые тайны.",
-                "Ваша проницательность поразит других.",
-                "Трансформации принесут обновление."
-            ]
-        }, {
-            "sign":
-            "♐ Стрелец",
-            "predictions": [
-                "Приключения и новые горизонты ждут вас!",
-                "Юпитер расширяет ваши возможности.",
-                "Путешествия или обучение принесут пользу.",
-                "Ваш оптимизм заразителен."
-            ]
-        }, {
-            "sign":
-            "♑ Козерог",
-            "predictions": [
-                "Упорство и дисциплина приведут к цели.",
-                "Сатурн учит терпению и мудрости.",
-                "Карьерные перспективы улучшаются.", "Ваш авторитет растёт."
-            ]
-        }, {
-            "sign":
-            "♒ Водолей",
-            "predictions": [
-                "Ваши оригинальные идеи найдут понимание.",
-                "Уран приносит неожиданные возможности.",
-                "Дружба и сотрудничество важны сегодня.",
-                "Будущее начинается прямо сейчас."
-            ]
-        }, {
-            "sign":
-            "♓ Рыбы",
-            "predictions": [
-                "Творчество и мечты вдохновят на новые свершения.",
-                "Нептун усиливает интуицию и воображение.",
-                "Сострадание откроет новые возможности.",
-                "Искусство и музыка принесут гармонию."
-            ]
-        }]
-
-        # Выбираем случайный знак зодиака
-        chosen_sign = random.choice(signs)
-        # Выбираем случайное предсказание для этого знака
-        prediction = random.choice(chosen_sign["predictions"])
-
-        await message.answer(f"{chosen_sign['sign']}: {prediction}")
-
-    elif text == "рецепт":
-        recipes = [
-            "🍝 Паста Карбонара: спагетти + яйца + бекон + сыр пармезан + чёрный перец",
-            "🥗 Греческий салат: помидоры + огурцы + фета + оливки + оливковое масло",
-            "🍲 Борщ: свёкла + капуста + морковь + лук + мясо + сметана",
-            "🥪 Авокадо тост: хлеб + авокадо + лимон + соль + перец",
-            "🍛 Плов: рис + мясо + морковь + лук + специи",
-            "🥞 Блинчики: мука + молоко + яйца + сахар + соль",
-            "🍕 Пицца Маргарита: тесто + томатный соус + моцарелла + базилик",
-            "🍜 Рамен: лапша + бульон + яйцо + зелёный лук + нори",
-            "🧀 Сырники: творог + яйцо + мука + сахар + сметана",
-            "🥙 Шаурма: лаваш + мясо + овощи + соус"
-        ]
-        recipe = random.choice(recipes)
-        await message.answer(f"👨‍🍳 Рецепт дня:\n{recipe}")
-
-    elif text == "игра":
-        games = [
-            "🎲 Игра 'Угадай число': Я загадал число от 1 до 100. Попробуй угадать!",
-            "🎯 Игра 'Правда или ложь': Коралл имеет 8 щупалец — правда или ложь?",
-            "🧩 Игра '20 вопросов': Загадай предмет, а я попробую угадать за 20 вопросов!",
-            "🎪 Игра 'Ассоциации': Слово 'море' — какая первая ассоциация?",
-            "🎭 Игра 'Рифма': Придумай рифму к слову 'коралл'!",
-            "🎨 Игра 'Описание': Опиши смайлик только словами: 🐙",
-            "🔤 Игра 'Последняя буква': Город на букву 'М'!",
-            "🎵 Игра 'Песня': Допой строчку: 'В лесу родилась...'",
-            "🌍 Игра 'География': Назови страну на букву 'И'!",
-            "🎬 Игра 'Фильм': Угадай фильм по описанию: 'Рыба-клоун ищет сына'"
-        ]
-        game = random.choice(games)
-        await message.answer(f"🎮 {game}")
-
-    elif text == "загадка":
-        riddles = [
-            "🤔 Что можно увидеть с закрытыми глазами? (Ответ: сон)",
-            "🏠 В доме его нет, а на улице есть. Что это? (Ответ: буква 'У')",
-            "⏰ Что становится больше, если поставить вверх ногами? (Ответ: число 6)",
-            "🌊 Без рук, без ног, а гору разрушает. Что это? (Ответ: вода)",
-            "🔥 Красный петушок по жердочке бежит. Что это? (Ответ: огонь)",
-            "❄️ Зимой и летом одним цветом. Что это? (Ответ: ёлка)",
-            "🌙 Что идёт, не двигаясь с места? (Ответ: время)",
-            "🎯 У него есть шляпа, но нет головы. Что это? (Ответ: гриб)",
-            "🍯 Не мёд, а липнет. Что это? (Ответ: клей)",
-            "📚 Кто говорит на всех языках? (Ответ: эхо)"
-        ]
-        riddle = random.choice(riddles)
-        await message.answer(f"🧩 {riddle}")
-
-    elif text == "история":
-        stories = [
-            "📚 В 1912 году титаник затонул, но история о героизме оркестра, игравшего до конца, стала легендой.",
-            "🏺 Клеопатра жила ближе по времени к высадке на Луну, чем к строительству пирамид!",
-            "🎨 Ван Гог продал за всю жизнь только одну картину — 'Красные виноградники'.",
-            "🐘 Наполеон боялся... котов! У великого полководца была айлурофобия.",
-            "📡 Факс был изобретён в 1843 году — до изобретения телефона!",
-            "🗽 Статуя Свободы изначально была коричневой, но окислилась до зелёного цвета.",
-            "🦖 Динозавры жили на Земле 165 миллионов лет, а люди — всего 300 тысяч.",
-            "🍫 Шоколад когда-то использовался как валюта ацтеками и майя.",
-            "📖 Шекспир изобрёл более 1700 слов, которые мы используем до сих пор.",
-            "🚀 Нил Армстронг оставил на Луне сумку с мусором — она там до сих пор!"
-        ]
-        story = random.choice(stories)
-        await message.answer(f"📜 {story}")
-
-    elif text == "покер":
-        cards = [
-            "🂡", "🂢", "🂣", "🂤", "🂥", "🂦", "🂧", "🂨", "🂩", "🂪", "🂫", "🂭", "🂮",
-            "🂱", "🂲", "🂳", "🂴", "🂵", "🂶", "🂷", "🂸", "🂹", "🂺", "🂻", "🂽", "🂾",
-            "🃁", "🃂", "🃃", "🃄", "🃅", "🃆", "🃇", "🃈", "🃉", "🃊", "🃋", "🃍", "🃎",
-            "🃑", "🃒", "🃓", "🃔", "🃕", "🃖", "🃗", "🃘", "🃙", "🃚", "🃛", "🃝", "🃞"
-        ]
-        card_names = [
-            "Туз пик", "Двойка пик", "Тройка пик", "Четвёрка пик",
-            "Пятёрка пик", "Шестёрка пик", "Семёрка пик", "Восьмёрка пик",
-            "Девятка пик", "Десятка пик", "Валет пик", "Дама пик",
-            "Король пик", "Туз червей", "Двойка червей", "Тройка червей",
-            "Четвёрка червей", "Пятёрка червей", "Шестёрка червей",
-            "Семёрка червей", "Восьмёрка червей", "Девятка червей",
-            "Десятка червей", "Валет червей", "Дама червей", "Король червей",
-            "Туз бубей", "Двойка бубей", "Тройка бубей", "Четвёрка бубей",
-            "Пятёрка бубей", "Шестёрка бубей", "Семёрка бубей",
-            "Восьмёрка бубей", "Девятка бубей", "Десятка бубей", "Валет бубей",
-            "Дама бубей", "Король бубей", "Туз треф", "Двойка треф",
-            "Тройка треф", "Четвёрка треф", "Пятёрка треф", "Шестёрка треф",
-            "Семёрка треф", "Восьмёрка треф", "Девятка треф", "Десятка треф",
-            "Валет треф", "Дама треф", "Король треф"
-        ]
-        card_index = random.randint(0, len(cards) - 1)
-        card = cards[card_index]
-        card_name = card_names[card_index]
-        await message.answer(f"🎰 Ваша карта: {card} {card_name}")
-
-    elif text == "монетка":
-        coin_results = ["🪙 Орёл!", "🪙 Решка!"]
-        result = random.choice(coin_results)
-        await message.answer(f"🎯 {result}")
-
-    elif text == "кубик":
-        dice_faces = ["⚀", "⚁", "⚂", "⚃", "⚄", "⚅"]
-        numbers = ["1", "2", "3", "4", "5", "6"]
-        dice_index = random.randint(0, 5)
-        dice_face = dice_faces[dice_index]
-        number = numbers[dice_index]
-        await message.answer(f"🎲 Выпало: {dice_face} ({number})")
-
-    elif text == "статистика":
-        if not is_group_chat(message):
-            await message.answer("🐙 Эта команда работает только в группах!")
-            return
+    # Если нет участников, добавляем текущего пользователя
+    if not all_participants:
+        add_chat_member(message.chat.id, message.from_user.id)
+        all_participants = [message.from_user.id]
+
+    if len(all_participants) < 2:
+        await message.answer(
+            "🐙 В группе слишком мало участников для выбора! Нужно минимум 2 участника."
+        )
+        return
+
+    pair = random.sample(all_participants, 2)
+    mention1, mention2 = await get_user_mentions(pair, message.chat.id)
+    wish = content.choice("ship_wishes")
+    await message.answer(f"💕 Парочка: {mention1} и {mention2}. {wish}",
+                         parse_mode=ParseMode.MARKDOWN)
+
+
+@commands.command("предсказание")
+async def cmd_prediction(message: Message, args: str):
+    """Случайное предсказание"""
+    await message.answer(content.choice("predictions"))
+
+
+@commands.command("миссия")
+async def cmd_mission(message: Message, args: str):
+    """Тайное задание"""
+    mission = content.choice("missions")
+    await message.answer(f"🎯 Твоя миссия: {mission}")
+
+
+@commands.command("цитата")
+async def cmd_quote(message: Message, args: str):
+    """Мудрая цитата"""
+    await message.answer(content.choice("quotes"))
+
+
+@commands.command("факт")
+async def cmd_fact(message: Message, args: str):
+    """Интересный факт"""
+    await message.answer(content.choice("facts"))
+
+
+@commands.command("комплимент")
+async def cmd_compliment(message: Message, args: str):
+    """Случайный комплимент"""
+    await message.answer(content.choice("compliments"))
+
+
+@commands.command("мотивация")
+async def cmd_motivation(message: Message, args: str):
+    """Мотивирующая фраза"""
+    await message.answer(content.choice("motivations"))
+
+
+@commands.command("викторина")
+async def cmd_quiz(message: Message, args: str):
+    """Вопрос викторины"""
+    await message.answer(content.choice("quiz"))
+
+
+@commands.command("челлендж")
+async def cmd_challenge(message: Message, args: str):
+    """Челлендж дня"""
+    challenge = content.choice("challenges")
+    await message.answer(f"🏆 Челлендж дня: {challenge}")
+
+
+@commands.command("гороскоп")
+async def cmd_horoscope(message: Message, args: str):
+    """Гороскоп для случайного знака"""
+    # Сначала выбираем случайный знак зодиака
+    chosen_sign = content.choice("horoscope")
+    # Выбираем случайное предсказание для этого знака
+    prediction = random.choice(chosen_sign["predictions"])
+
+    await message.answer(f"{chosen_sign['sign']}: {prediction}")
+
+
+@commands.command("рецепт")
+async def cmd_recipe(message: Message, args: str):
+    """Рецепт дня"""
+    recipe = content.choice("recipes")
+    await message.answer(f"👨‍🍳 Рецепт дня:\n{recipe}")
+
+
+@commands.command("игра")
+async def cmd_game(message: Message, args: str):
+    """Интерактивная игра"""
+    game = content.choice("games")
+    await message.answer(f"🎮 {game}")
+
+
+@commands.command("загадка")
+async def cmd_riddle(message: Message, args: str):
+    """Загадка"""
+    riddle = content.choice("riddles")
+    await message.answer(f"🧩 {riddle}")
+
+
+@commands.command("история")
+async def cmd_story(message: Message, args: str):
+    """Исторический факт"""
+    story = content.choice("stories")
+    await message.answer(f"📜 {story}")
+
+
+@commands.command("покер")
+async def cmd_poker(message: Message, args: str):
+    """Случайная карта"""
+    card = content.choice("poker")
+    await message.answer(f"🎰 Ваша карта: {card['card']} {card['name']}")
 
-        await update_chat_members(message.chat.id)
 
-        # Получаем участников из файла и кэша
-        file_participants = load_participants_from_file(message.chat.id)
-        cache_participants = list(chat_members.get(message.chat.id, set()))
-        all_participants = list(set(file_participants + cache_participants))
+@commands.command("монетка")
+async def cmd_coin(message: Message, args: str):
+    """Подбросить монетку"""
+    result = content.choice("coin")
+    await message.answer(f"🎯 {result}")
 
-        admins_count = len(chat_admins.get(message.chat.id, set()))
 
-        stats = f"""📊 **Статистика группы:**
+@commands.command("кубик")
+async def cmd_dice(message: Message, args: str):
+    """Бросить кубик"""
+    dice = content.choice("dice")
+    await message.answer(f"🎲 Выпало: {dice['face']} ({dice['number']})")
+
+
+SPARK_CHARS = "▁▂▃▄▅▆▇█"
+
+
+def sparkline(values: List[int]) -> str:
+    """Мини-график из блочных символов"""
+    peak = max(values, default=0)
+    if not peak:
+        return SPARK_CHARS[0] * len(values)
+    return "".join(SPARK_CHARS[value * (len(SPARK_CHARS) - 1) // peak]
+                   for value in values)
+
+
+async def format_activity(chat_id: int) -> str:
+    """Блок активности для "статистика": сегодня, неделя, топ и пиковый час"""
+    messages, media, reactions = activity.totals(chat_id, days=1)
+    week = activity.by_day(chat_id, days=7)
+    week_messages = sum(counters[0] for _, counters in week)
+    week_media = sum(counters[1] for _, counters in week)
+    week_reactions = sum(counters[2] for _, counters in week)
+    lines = [
+        f"📈 Сегодня: {messages} сообщений, {media} медиа, {reactions} реакций",
+        f"📅 За неделю: {week_messages} сообщений, {week_media} медиа, "
+        f"{week_reactions} реакций",
+        f"📉 По дням: {sparkline([sum(counters) for _, counters in week])}"
+    ]
+    hours = [sum(counters) for counters in activity.by_hour(chat_id, days=7)]
+    if any(hours):
+        lines.append(f"⏰ Самый активный час: {hours.index(max(hours)):02d}:00")
+    top = activity.top_users(chat_id, n=5, days=7)
+    if top:
+        mentions = await get_user_mentions([user_id for user_id, _ in top],
+                                           chat_id)
+        lines.append("🏆 Самые активные за неделю:")
+        lines.extend(f"{place}. {mention} — {score}"
+                     for place, (mention, (_, score)) in enumerate(
+                         zip(mentions, top), 1))
+    return "\n".join(lines) + "\n"
+
+
+@commands.command("статистика")
+async def cmd_stats(message: Message, args: str):
+    """Статистика группы"""
+    if not is_group_chat(message):
+        await message.answer("🐙 Эта команда работает только в группах!")
+        return
+
+    await update_chat_members(message.chat.id)
+
+    # Получаем участников из индекса файла и кэша
+    file_participants = load_participants_from_file(message.chat.id)
+    cache_participants = chat_members.get(message.chat.id, set())
+    all_participants = file_participants | cache_participants
+
+    admins_count = len(chat_admins.get(message.chat.id, set()))
+    members_count = chat_info.member_counts.get(message.chat.id, "?")
+
+    stats = f"""📊 **Статистика группы:**
 
 👥 Всего участников: {len(all_participants)}
+🏠 Участников в чате: {members_count}
 📝 Участников в файле: {len(file_participants)}
 💬 Активных в кэше: {len(cache_participants)}
 👑 Админов: {admins_count}
+""" + await format_activity(message.chat.id) + """
 🐙 Коралл активен и готов помочь!"""
 
-        await message.answer(stats, parse_mode=ParseMode.MARKDOWN)
+    await message.answer(stats, parse_mode=ParseMode.MARKDOWN)
 
-    elif text == "админы":
-        if not is_group_chat(message):
-            await message.answer("🐙 Эта команда работает только в группах!")
-            return
 
-        await update_chat_members(message.chat.id)
-        admin_ids = chat_admins.get(message.chat.id, set())
+@commands.command("админы")
+async def cmd_admins(message: Message, args: str):
+    """Список админов"""
+    if not is_group_chat(message):
+        await message.answer("🐙 Эта команда работает только в группах!")
+        return
+
+    await update_chat_members(message.chat.id)
+    admin_ids = chat_admins.get(message.chat.id, set())
+
+    if not admin_ids:
+        await message.answer("🤷 Не удалось получить список админов")
+        return
+
+    admin_mentions = await get_user_mentions(list(admin_ids),
+                                             message.chat.id)
+
+    admins_text = "\n".join([f"👑 {mention}" for mention in admin_mentions])
+    await message.answer(f"**Администраторы группы:**\n\n{admins_text}",
+                         parse_mode=ParseMode.MARKDOWN)
+
+
+def format_ms(seconds) -> str:
+    return "—" if seconds is None else f"{seconds * 1000:.0f}"
+
+
+def format_metrics() -> str:
+    """Короткая сводка метрик процесса для админа"""
+    lines = ["📈 Метрики Коралла", "", "⏱ Команды (число, p50/p95 мс):"]
+    by_count = sorted(command_latency.values,
+                      key=lambda key: -command_latency.count(command=key[0]))
+    for (command, ) in by_count[:10]:
+        lines.append(
+            f"• {command}: {command_latency.count(command=command)}, "
+            f"{format_ms(command_latency.quantile(0.5, command=command))}/"
+            f"{format_ms(command_latency.quantile(0.95, command=command))}")
+    if not by_count:
+        lines.append("• пока не было")
+
+    total = sum(telegram_requests.values.values())
+    errors: Dict[str, float] = {}
+    for (_, status), count in telegram_requests.values.items():
+        if status != "ok":
+            errors[status] = errors.get(status, 0) + count
+    lines += ["", f"📡 Bot API: {total:.0f} запросов, ошибок "
+              f"{sum(errors.values()):.0f}"]
+    lines += [f"• {status}: {count:.0f}" for status, count in errors.items()]
+
+    stats = cohere.stats()
+    statuses = ", ".join(f"{status}: {count}"
+                         for status, count in cohere.statuses.items()) or "—"
+    lines += [
+        "", f"🤖 Cohere: {stats['requests']} попыток, повторов "
+        f"{stats['retries']}, breaker {stats['breaker_state']}",
+        f"• коды: {statuses}",
+        f"• ответ p50 {format_ms(cohere_latency.quantile(0.5, mode='chat'))} мс, "
+        f"первый кусок p50 "
+        f"{format_ms(cohere_latency.quantile(0.5, mode='stream_first'))} мс"
+    ]
+
+    lines += [
+        "", f"📬 Очереди: ИИ {ai_scheduler.running} в работе, "
+        f"{ai_scheduler.queued} ждут (отказов {ai_scheduler.rejected}); "
+        f"отправка {outbound.waiting}; участники {participant_store.pending}; "
+        f"состояние {state_store.pending if state_store else 0}"
+    ]
+
+    def ratio(hits: int, misses: int) -> str:
+        return f"{hits * 100 / (hits + misses):.0f}%" if hits + misses else "—"
+
+    lines += [
+        f"🎯 Кэши: имена {ratio(user_cache.hits, user_cache.misses)}, "
+        f"чаты {ratio(chat_info.hits, chat_info.misses)}, ответы ИИ "
+        f"{ratio(reply_cache.hits, reply_cache.misses) if reply_cache is not None else '—'}"
+        f" (общих {reply_cache.coalesced if reply_cache is not None else 0})",
+        f"🐢 Лаг event loop: сейчас "
+        f"{format_ms(loop_lag.gauge.get())} мс, p99 "
+        f"{format_ms(loop_lag.histogram.quantile(0.99))} мс"
+    ]
+    return "\n".join(lines)
+
+
+@commands.command("метрики", "metrics")
+async def cmd_metrics(message: Message, args: str):
+    """Сводка метрик, только для ADMIN_ID"""
+    if not ADMIN_ID or message.from_user.id != ADMIN_ID:
+        return
+    await message.answer(format_metrics())
+
+
+@commands.prefix("профиль", "profile")
+async def cmd_profile(message: Message, args: str):
+    """Семплирующий профиль на N секунд, только для ADMIN_ID"""
+    if not ADMIN_ID or message.from_user.id != ADMIN_ID:
+        return
+    try:
+        seconds = float(args) if args else PROFILE_SECONDS
+    except ValueError:
+        await message.answer("🔬 Использование: профиль [секунд]")
+        return
+    seconds = min(max(seconds, 1.0), PROFILE_MAX_SECONDS)
+    if profiler.running:
+        await message.answer("🔬 Профилирование уже идёт")
+        return
+    await message.answer(f"🔬 Профилирую {seconds:.0f} с...")
+    try:
+        result = await profiler.run(seconds)
+    except RuntimeError:
+        # Кто-то успел запустить профиль, пока уходило сообщение
+        await message.answer("🔬 Профилирование уже идёт")
+        return
+    await message.answer(format_profile(result))
+
+
+def profile_on_signal():
+    """SIGUSR1: профиль на PROFILE_SECONDS в фоне, отчёт — в лог"""
+    if not profiler.start(PROFILE_SECONDS):
+        logging.warning("Профилирование уже идёт")
+
+
+@dp.update.outer_middleware()
+async def measure_update(handler, event: Update, data: dict):
+    """Полное время обработки апдейта, включая фильтры и FSM"""
+    started = time.perf_counter()
+    try:
+        return await handler(event, data)
+    finally:
+        update_latency.observe(time.perf_counter() - started,
+                               type=event.event_type)
 
-        if not admin_ids:
-            await message.answer("🤷 Не удалось получить список админов")
-            return
 
-        admin_mentions = []
-        for admin_id in admin_ids:
-            mention = await get_user_mention(admin_id, message.chat.id)
-            admin_mentions.append(mention)
+@dp.message()
+async def handle_message(message: Message, state: FSMContext):
+    if not message.text:
+        # Логируем любую активность (стикеры, фото и т.д.)
+        await log_user_activity(message, "media")
+        return
 
-        admins_text = "\n".join([f"👑 {mention}" for mention in admin_mentions])
-        await message.answer(f"**Администраторы группы:**\n\n{admins_text}",
-                             parse_mode=ParseMode.MARKDOWN)
+    text = message.text.lower().strip()
+
+    # Логируем сообщение
+    await log_user_activity(message, "message")
+
+    if is_group_chat(message):
+        chat_id = message.chat.id
+        if chat_id not in chat_info:
+            # Данные чата подтянутся в фоне, сообщение не ждёт API
+            chat_info.refresh_in_background(chat_id)
+
+    # Команды без слэша: поиск по таблице, обычный текст отсеивается сразу
+    resolved = commands.resolve(text)
+    if resolved is None:
+        return
+    handler, prefix_length = resolved
+    args = message.text.strip()[prefix_length:].strip()
+    command = handler.__name__.removeprefix("cmd_")
+    started = time.perf_counter()
+    try:
+        with span(f"command {command}"):
+            await handler(message, args)
+    finally:
+        command_latency.observe(time.perf_counter() - started,
+                                command=command)
+
+
+# Отсев повторных и слишком частых нажатий кнопок
+seen_callbacks = RecentKeys()
+registration_debounce = Debouncer(CALLBACK_DEBOUNCE)
 
 
 @dp.callback_query()
 async def handle_registration(callback: CallbackQuery):
     """Обработчик регистрации участников"""
     if callback.data.startswith("register_"):
+        # Повторная доставка того же нажатия: на него уже ответили
+        if not seen_callbacks.add(callback.id):
+            return
+        # Частые нажатия одного пользователя только гасим индикатор на кнопке
+        if not registration_debounce.hit(callback.from_user.id):
+            await callback.answer()
+            return
+
         data_parts = callback.data.split("_")
         chat_id = int(data_parts[1])
         user_id = int(data_parts[2])
 
-        # Проверяем, зарегистрирован ли уже пользователь
-        already_registered = False
-        if os.path.exists(participants_file):
-            with open(participants_file, 'r', encoding='utf-8') as f:
-                for line in f:
-                    if f"Chat: {chat_id}, User: {user_id}" in line and "Action: button_register" in line:
-                        already_registered = True
-                        break
-
-        if already_registered:
+        # Зарегистрирован — значит уже в индексе участников, с любым действием
+        if (chat_id, user_id) in participant_store:
             await callback.answer("ℹ️ Вы уже зарегистрированы в этой группе!")
             return
 
         # Добавляем пользователя в кэш участников
-        if chat_id not in chat_members:
-            chat_members[chat_id] = set()
-
-        chat_members[chat_id].add(user_id)
+        add_chat_member(chat_id, user_id)
 
         # Сохраняем в файл
         user = callback.from_user
+        user_cache.remember(user.id, user.username, user.first_name)
         save_participant(chat_id, user_id, user.username, user.first_name,
                          "button_register")
 
         await callback.answer("✅ Вы успешно добавлены в список участников!")
 
-        # Обновляем сообщение
+        # Обновляем сообщение; нажатие кнопки — ответ вне очереди
         user_mention = f"@{user.username}" if user.username else user.first_name
-        await callback.message.edit_text(
-            f"🎉 {user_mention} добавлен(а) в список участников группы!")
+        with outbound.priority(PRIORITY_HIGH):
+            await callback.message.edit_text(
+                f"🎉 {user_mention} добавлен(а) в список участников группы!")
+
+
+# Смена прав участника: если затронуты админы, кэш чата устарел
+@dp.chat_member()
+async def handle_chat_member(update: ChatMemberUpdated):
+    """Сбросить кэш админов при изменениях в администрации"""
+    admin_statuses = {ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.CREATOR}
+    if (update.old_chat_member.status in admin_statuses
+            or update.new_chat_member.status in admin_statuses):
+        chat_info.invalidate(update.chat.id)
 
 
 # Обработчик реакций на сообщения
@@ -756,7 +1168,12 @@ async def handle_registration(callback: CallbackQuery):
 async def handle_reaction(reaction_update):
     """Обработчик реакций"""
     if hasattr(reaction_update, 'user') and reaction_update.user:
+        user_cache.remember(reaction_update.user.id,
+                            getattr(reaction_update.user, 'username', None),
+                            getattr(reaction_update.user, 'first_name', None))
         # Сохраняем реакцию как активность
+        activity.record(reaction_update.chat.id, reaction_update.user.id,
+                        "reaction", reaction_update.date.timestamp())
         save_participant(reaction_update.chat.id, reaction_update.user.id,
                          getattr(reaction_update.user, 'username', None),
                          getattr(reaction_update.user, 'first_name', None),
@@ -773,12 +1190,7 @@ async def log_activity(message: Message):
 # Старые slash команды для совместимости
 @dp.message(Command("start"))
 async def start_cmd(message: Message):
-    start_messages = [
-        "🐙 Привет! Я Коралл — твой групповой помощник!\n\nНапиши 'помощь' чтобы узнать мои команды",
-        "🌊 Приветствую! Коралл к вашим услугам!\n\nИспользуй 'команды' для списка возможностей",
-        "🚀 Добро пожаловать! Я готов помочь!\n\nНабери 'help' для инструкций"
-    ]
-    await message.answer(random.choice(start_messages))
+    await message.answer(content.choice("start"))
 
 
 @dp.message(Command("help"))
@@ -787,29 +1199,92 @@ async def help_cmd(message: Message):
 
 
 # Запуск
+async def start_services():
+    """Поднять хранилища, кэши и клиентов перед приёмом апдейтов"""
+    if state_store is not None:
+        # Сохранённое состояние читается одним запросом до всех остальных
+        await state_store.load()
+        state_store.start()
+    # Индекс участников строится один раз при старте
+    participant_store.load()
+    participant_store.start()
+    # Пулы ответов развлекательных команд
+    content.load()
+    content.start()
+    await cohere.start()
+    user_histories.load()
+    user_histories.start()
+    chat_info.load()
+    load_chat_members()
+    activity.load()
+    loop_lag.start()
+    if metrics_server is not None:
+        await metrics_server.start()
+    if hasattr(signal, "SIGUSR1"):
+        asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1,
+                                                      profile_on_signal)
+
+
+async def stop_services():
+    """Дописать всё накопленное и закрыть соединения"""
+    if hasattr(signal, "SIGUSR1"):
+        asyncio.get_running_loop().remove_signal_handler(signal.SIGUSR1)
+    if metrics_server is not None:
+        await metrics_server.close()
+    await loop_lag.close()
+    # До закрытия сессии бота, иначе обновления упадут с ошибками соединения
+    await chat_info.close()
+    # Дописываем накопленные записи участников перед выходом
+    await participant_store.close()
+    await cohere.close()
+    await user_histories.close()
+    await content.close()
+    if state_store is not None:
+        # Последним: остальные хранилища уже дописали в него изменения
+        await state_store.close()
+    await bot.session.close()
+
+
 async def main():
     logging.basicConfig(level=logging.INFO)
 
+    if SHARD_FRONT:
+        # Фронт только раскладывает апдейты, всё состояние живёт в воркерах
+        if WEBHOOK_URL:
+            await register_webhook(dp, bot, WEBHOOK_URL, WEBHOOK_PATH,
+                                   WEBHOOK_SECRET)
+        await run_sharded(SHARD_WORKERS,
+                          host=WEBHOOK_HOST,
+                          port=WEBHOOK_PORT,
+                          path=WEBHOOK_PATH,
+                          secret_token=WEBHOOK_SECRET)
+        await bot.session.close()
+        return
+
+    await start_services()
+
     # Получить информацию о боте
     me = await bot.get_me()
     print(f"✅ Бот @{me.username} успешно авторизован!")
 
-    print("🔄 Начинаю polling...")
-
-    import signal
-
-    def signal_handler(signum, frame):
-        print("Received SIGTERM signal")
-        raise KeyboardInterrupt
-
-    signal.signal(signal.SIGTERM, signal_handler)
-
     try:
-        await dp.start_polling(bot)
+        if BOT_MODE == "webhook":
+            await run_webhook(dp,
+                              bot,
+                              host=WEBHOOK_HOST,
+                              port=WEBHOOK_PORT,
+                              path=WEBHOOK_PATH,
+                              secret_token=WEBHOOK_SECRET,
+                              public_url=WEBHOOK_URL)
+        else:
+            print("🔄 Начинаю polling...")
+            # start_polling сам останавливается по SIGTERM/SIGINT
+            await dp.start_polling(bot)
     except KeyboardInterrupt:
-        print("🛑 Бот остановлен")
+        pass
     finally:
-        await bot.session.close()
+        print("🛑 Бот остановлен")
+        await stop_services()
 
 
 if __name__ == "__main__":
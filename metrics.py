@@ -0,0 +1,270 @@
+import asyncio
+import bisect
+import logging
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from aiohttp import web
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+
+# Границы корзин задержек в секундах: от миллисекунды до минуты
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+Labels = Tuple[str, ...]
+Collector = Callable[[], Dict[Labels, float]]
+
+
+def _format_labels(names: Iterable[str], values: Labels) -> str:
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace(
+            "\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    """Общая часть метрик: имя, описание и имена меток"""
+
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+
+    def _key(self, labels: Dict[str, object]) -> Labels:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> Iterable[Tuple[str, Labels, float]]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for suffix, (names, values), value in self.samples():
+            lines.append(f"{self.name}{suffix}"
+                         f"{_format_labels(names, values)} {value:g}")
+        return lines
+
+
+class Counter(Metric):
+    """Монотонный счётчик; либо inc(), либо значения из collect()"""
+
+    type = "counter"
+
+    def __init__(self,
+                 name: str,
+                 help: str,
+                 labelnames: Tuple[str, ...] = (),
+                 collect: Optional[Collector] = None):
+        super().__init__(name, help, labelnames)
+        self.collect = collect
+        self.values: Dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        values = self.collect() if self.collect else self.values
+        return values.get(self._key(labels), 0)
+
+    def samples(self):
+        values = self.collect() if self.collect else self.values
+        for key, value in values.items():
+            yield "", (self.labelnames, key), value
+
+
+class Gauge(Counter):
+    """Текущее значение: set() или collect() в момент чтения"""
+
+    type = "gauge"
+
+    def set(self, value: float, **labels):
+        self.values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    """Распределение значений по корзинам, как histogram в Prometheus"""
+
+    type = "histogram"
+
+    def __init__(self,
+                 name: str,
+                 help: str,
+                 labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = buckets
+        # Метки -> [счётчики корзин (последняя — +Inf), сумма, количество]
+        self.values: Dict[Labels, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        entry = self.values.get(key)
+        if entry is None:
+            entry = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    def count(self, **labels) -> int:
+        entry = self.values.get(self._key(labels))
+        return entry[2] if entry else 0
+
+    def quantile(self, q: float, **labels) -> Optional[float]:
+        """Оценка квантиля по корзинам (линейно внутри корзины)"""
+        entry = self.values.get(self._key(labels))
+        if not entry or not entry[2]:
+            return None
+        rank = q * entry[2]
+        seen = 0
+        lower = 0.0
+        for index, count in enumerate(entry[0]):
+            upper = self.buckets[index] if index < len(
+                self.buckets) else self.buckets[-1]
+            if count and seen + count >= rank:
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+            lower = upper
+        return self.buckets[-1]
+
+    def samples(self):
+        bucket_names = self.labelnames + ("le", )
+        for key, (counts, total, count) in self.values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"), ),
+                                           counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                yield "_bucket", (bucket_names, key + (le, )), cumulative
+            yield "_sum", (self.labelnames, key), total
+            yield "_count", (self.labelnames, key), count
+
+
+class Registry:
+    """Набор метрик процесса и их вывод в текстовом формате Prometheus"""
+
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+
+    def _add(self, metric: Metric) -> Metric:
+        if metric.name in self.metrics:
+            raise ValueError(f"Метрика {metric.name} уже есть")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Tuple[str, ...] = (),
+                collect: Optional[Collector] = None) -> Counter:
+        return self._add(Counter(name, help, labelnames, collect))
+
+    def gauge(self, name: str, help: str, labelnames: Tuple[str, ...] = (),
+              collect: Optional[Collector] = None) -> Gauge:
+        return self._add(Gauge(name, help, labelnames, collect))
+
+    def histogram(self, name: str, help: str,
+                  labelnames: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help, labelnames, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics.values():
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                logging.error(f"Ошибка сбора метрики {metric.name}: {e}")
+        return "\n".join(lines) + "\n"
+
+
+class LoopLagMonitor:
+    """Задержка event loop: насколько позже положенного просыпается sleep()"""
+
+    def __init__(self, histogram: Histogram, gauge: Gauge,
+                 interval: float = 0.5):
+        self.histogram = histogram
+        self.gauge = gauge
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - started - self.interval)
+            self.histogram.observe(lag)
+            self.gauge.set(lag)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+class TelegramMetricsMiddleware(BaseRequestMiddleware):
+    """Число, длительность и ошибки запросов к Bot API по методам
+
+    Регистрируется после OutboundLimiter, чтобы ожидание в его очереди не
+    попадало в длительность самого запроса.
+    """
+
+    def __init__(self, requests: Counter, latency: Histogram):
+        self.requests = requests
+        self.latency = latency
+
+    async def __call__(self, make_request: NextRequestMiddlewareType[TelegramType],
+                       bot: Bot,
+                       method: TelegramMethod[TelegramType]) -> Response[TelegramType]:
+        api_method = method.__api_method__
+        started = time.perf_counter()
+        status = "ok"
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            # TelegramRetryAfter, TelegramBadRequest, сетевые ошибки...
+            status = type(e).__name__
+            raise
+        finally:
+            self.latency.observe(time.perf_counter() - started,
+                                 method=api_method)
+            self.requests.inc(method=api_method, status=status)
+
+
+class MetricsServer:
+    """Локальный HTTP-сервер с GET /metrics"""
+
+    def __init__(self, registry: Registry, host: str, port: int):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._runner: Optional[web.AppRunner] = None
+
+    async def handle(self, request: web.Request) -> web.Response:
+        return web.Response(text=self.registry.render(),
+                            content_type="text/plain",
+                            headers={"X-Content-Type-Options": "nosniff"})
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/metrics", self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        logging.info(f"Метрики: http://{self.host}:{self.port}/metrics")
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
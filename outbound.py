@@ -0,0 +1,293 @@
+import asyncio
+import bisect
+import contextvars
+import itertools
+import logging
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Union
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+
+# Приоритеты исходящих запросов: меньше — раньше
+PRIORITY_HIGH = 0  # ответы ИИ, ответы на кнопки
+PRIORITY_NORMAL = 1  # обычные команды
+PRIORITY_LOW = 2  # промежуточные правки потокового ответа, не ждут в очереди
+
+# Методы, на которые распространяются лимиты Telegram на отправку
+LIMITED_METHODS = frozenset({
+    "sendMessage", "editMessageText", "editMessageCaption",
+    "editMessageReplyMarkup", "sendPhoto", "sendAnimation", "sendVideo",
+    "sendAudio", "sendDocument", "sendSticker", "sendVoice", "sendDice",
+    "sendPoll", "sendMediaGroup", "sendLocation", "sendContact",
+    "forwardMessage", "copyMessage", "answerCallbackQuery"
+})
+# Ответ на кнопку пользователь ждёт с крутящимся индикатором
+HIGH_PRIORITY_METHODS = frozenset({"answerCallbackQuery"})
+
+_priority: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar(
+    "outbound_priority", default=None)
+
+ChatKey = Union[int, str]
+
+
+class SendSkipped(Exception):
+    """Запрос с PRIORITY_LOW не отправлен: разрешения на отправку нет сразу"""
+
+    def __init__(self, method: str, chat_id: Optional["ChatKey"]):
+        super().__init__(f"{method} в чат {chat_id} пропущен из-за лимита")
+        self.method = method
+        self.chat_id = chat_id
+
+
+class TokenBucket:
+    """Ведро токенов: rate в секунду, не больше capacity подряд"""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _fill(self, now: float):
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        """Через сколько секунд будет доступен токен"""
+        self._fill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self, now: float):
+        self._fill(now)
+        self.tokens -= 1
+
+    def full(self, now: float) -> bool:
+        self._fill(now)
+        return self.tokens >= self.capacity
+
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "chat_id", "future")
+
+    def __init__(self, priority: int, seq: int, chat_id: Optional[ChatKey],
+                 future: asyncio.Future):
+        self.priority = priority
+        self.seq = seq
+        self.chat_id = chat_id
+        self.future = future
+
+    def __lt__(self, other: "_Waiter") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class OutboundLimiter(BaseRequestMiddleware):
+    """Планировщик исходящих запросов к Bot API с учётом лимитов Telegram
+
+    Подключается к сессии бота (bot.session.middleware(...)), поэтому
+    действует на все message.answer/edit_text без изменения хэндлеров.
+    Отправка проходит через общее ведро (global_rate в секунду) и ведро
+    чата: group_per_minute для групп и каналов, private_rate в секунду для
+    личных чатов. Вёдра подобраны так, что запас плюс пополнение за период
+    не превышают лимит ни в каком скользящем окне.
+    Ждущие запросы выдаются по приоритету, а внутри приоритета — по
+    очереди; запрос в упёршийся в лимит чат не задерживает другие чаты.
+    На 429 чат (или весь бот, если чата нет) ставится на паузу retry_after
+    секунд, и запрос повторяется до max_retries раз.
+
+    Запросы с PRIORITY_LOW в очередь не встают: если разрешения нет сразу,
+    они бросают SendSkipped. Промежуточную правку всё равно заменит
+    следующая, а ожидание токена чата (в группе — секунды) тормозило бы
+    того, кто её отправляет, и отнимало бы токены у настоящих ответов.
+    """
+
+    def __init__(self,
+                 global_rate: float = 30.0,
+                 group_per_minute: float = 20.0,
+                 group_burst: float = 3,
+                 private_rate: float = 1.0,
+                 max_retries: int = 3,
+                 max_buckets: int = 10000):
+        self.global_bucket = TokenBucket(max(global_rate - 1, 0.1), 1)
+        self.group_rate = max(group_per_minute - group_burst, 1) / 60
+        self.group_burst = group_burst
+        self.private_rate = private_rate
+        self.max_retries = max_retries
+        self.max_buckets = max_buckets
+        self.sent = 0
+        self.delayed = 0
+        self.retried = 0
+        self.skipped = 0
+        self._buckets: Dict[ChatKey, TokenBucket] = {}
+        self._paused_until: Dict[Optional[ChatKey], float] = {}
+        self._waiters: List[_Waiter] = []
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._pump_task: Optional[asyncio.Task] = None
+
+    @property
+    def waiting(self) -> int:
+        """Сколько запросов ждут своей очереди"""
+        return len(self._waiters)
+
+    @staticmethod
+    @contextmanager
+    def priority(priority: int) -> Iterator[None]:
+        """Задать приоритет запросов, отправленных внутри блока"""
+        token = _priority.set(priority)
+        try:
+            yield
+        finally:
+            _priority.reset(token)
+
+    def _bucket(self, chat_id: ChatKey) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            if len(self._buckets) >= self.max_buckets:
+                self._prune()
+            # Отрицательные id и @username — группы и каналы
+            if isinstance(chat_id, int) and chat_id > 0:
+                bucket = TokenBucket(self.private_rate, 1)
+            else:
+                bucket = TokenBucket(self.group_rate, self.group_burst)
+            self._buckets[chat_id] = bucket
+        return bucket
+
+    def _prune(self):
+        # Полное ведро ничем не отличается от нового, его можно забыть
+        now = time.monotonic()
+        for chat_id in [
+                chat_id for chat_id, bucket in self._buckets.items()
+                if bucket.full(now)
+        ]:
+            del self._buckets[chat_id]
+
+    def _chat_wait(self, chat_id: Optional[ChatKey], now: float) -> float:
+        wait = self._paused_until.get(chat_id, 0.0) - now
+        if chat_id is not None:
+            wait = max(wait, self._bucket(chat_id).wait_time(now))
+        return max(wait, 0.0)
+
+    def pause(self, chat_id: Optional[ChatKey], retry_after: float):
+        """Не отправлять в чат (None — никуда) ближайшие retry_after секунд"""
+        until = time.monotonic() + retry_after
+        if until > self._paused_until.get(chat_id, 0.0):
+            self._paused_until[chat_id] = until
+        self._wakeup.set()
+
+    async def _pump(self):
+        """Выдавать разрешения ждущим запросам, пока они есть"""
+        while self._waiters:
+            now = time.monotonic()
+            wait = max(self.global_bucket.wait_time(now),
+                       self._paused_until.get(None, 0.0) - now)
+            if wait <= 0:
+                # Первый по приоритету запрос в чат, где лимит не исчерпан
+                granted = False
+                wait = float("inf")
+                for index, waiter in enumerate(self._waiters):
+                    chat_wait = self._chat_wait(waiter.chat_id, now)
+                    if chat_wait <= 0:
+                        del self._waiters[index]
+                        self._grant(waiter, now)
+                        granted = True
+                        break
+                    wait = min(wait, chat_wait)
+                if granted:
+                    continue
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+        # Паузы, которые уже прошли, больше не нужны
+        now = time.monotonic()
+        for chat_id in [
+                chat_id for chat_id, until in self._paused_until.items()
+                if until <= now
+        ]:
+            del self._paused_until[chat_id]
+
+    def _ready(self, chat_id: Optional[ChatKey], now: float) -> bool:
+        return (self.global_bucket.wait_time(now) <= 0
+                and self._paused_until.get(None, 0.0) <= now
+                and self._chat_wait(chat_id, now) <= 0)
+
+    def _consume(self, chat_id: Optional[ChatKey], now: float):
+        self.global_bucket.consume(now)
+        if chat_id is not None:
+            self._bucket(chat_id).consume(now)
+
+    def _grant(self, waiter: _Waiter, now: float):
+        self._consume(waiter.chat_id, now)
+        if not waiter.future.done():
+            waiter.future.set_result(None)
+
+    async def acquire(self, chat_id: Optional[ChatKey], priority: int):
+        """Дождаться разрешения на отправку в чат"""
+        now = time.monotonic()
+        if not self._waiters and self._ready(chat_id, now):
+            self._consume(chat_id, now)
+            return
+        self.delayed += 1
+        waiter = _Waiter(priority, next(self._seq), chat_id,
+                         asyncio.get_running_loop().create_future())
+        bisect.insort(self._waiters, waiter)
+        self._wakeup.set()
+        if self._pump_task is None or self._pump_task.done():
+            self._pump_task = asyncio.create_task(self._pump())
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+            raise
+
+    def try_acquire(self, chat_id: Optional[ChatKey]) -> bool:
+        """Взять разрешение, только если оно есть сразу, без очереди"""
+        now = time.monotonic()
+        # Ждущие запросы в тот же чат идут раньше
+        if not self._ready(chat_id, now) or any(
+                waiter.chat_id == chat_id for waiter in self._waiters):
+            return False
+        self._consume(chat_id, now)
+        return True
+
+    async def __call__(self, make_request: NextRequestMiddlewareType[TelegramType],
+                       bot: Bot,
+                       method: TelegramMethod[TelegramType]) -> Response[TelegramType]:
+        api_method = method.__api_method__
+        if api_method not in LIMITED_METHODS:
+            return await make_request(bot, method)
+        chat_id = getattr(method, "chat_id", None)
+        priority = _priority.get()
+        if priority is None:
+            priority = (PRIORITY_HIGH if api_method in HIGH_PRIORITY_METHODS
+                        else PRIORITY_NORMAL)
+        for attempt in range(self.max_retries + 1):
+            if priority < PRIORITY_LOW:
+                await self.acquire(chat_id, priority)
+            elif not self.try_acquire(chat_id):
+                self.skipped += 1
+                raise SendSkipped(api_method, chat_id)
+            try:
+                response = await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+                self.retried += 1
+                logging.warning(f"Flood control в чате {chat_id}: "
+                                f"пауза {e.retry_after} с")
+                self.pause(chat_id, e.retry_after)
+                continue
+            self.sent += 1
+            return response
@@ -0,0 +1,393 @@
+import asyncio
+import logging
+import os
+import re
+import struct
+import time
+from typing import Dict, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+from storage import ChunkedSets, Namespace
+
+# Бинарный журнал участников: запись = заголовок фиксированной длины
+# (chat_id int64, user_id int64, unix-время uint32, код действия uint8,
+# длина имени uint16, всё little-endian) и имя в UTF-8 такой длины.
+# Разделителей нет, поэтому имя может содержать любые символы.
+RECORD_HEADER = struct.Struct("<qqIBH")
+MAX_NAME_BYTES = 0xFFFF
+# Код действия — индекс в этом кортеже; неизвестные пишутся как "other".
+# Новые действия — только в конец, иначе старые журналы прочитаются неверно
+ACTIONS = ("other", "register", "message", "reaction", "button_register",
+           "media")
+ACTION_CODES = {action: code for code, action in enumerate(ACTIONS)}
+
+
+class ParticipantRecord(NamedTuple):
+    chat_id: int
+    user_id: int
+    timestamp: int
+    action: str
+    name: str
+
+
+def format_user_info(user_id: int,
+                     username: Optional[str] = None,
+                     first_name: Optional[str] = None) -> str:
+    """Имя пользователя в том виде, в котором оно пишется в лог"""
+    return f"@{username}" if username else first_name or f"User_{user_id}"
+
+
+def parse_participant_line(line: str) -> Optional[Tuple[int, int]]:
+    """Достать (chat_id, user_id) из строки старого текстового лога"""
+    # Имя может содержать ", ", поэтому разбираем только первые два поля
+    parts = line.split(", ", 2)
+    if len(parts) < 2:
+        return None
+    chat_part, user_part = parts[0], parts[1]
+    if not chat_part.startswith("Chat: ") or not user_part.startswith(
+            "User: "):
+        return None
+    try:
+        return int(chat_part[6:]), int(user_part[6:])
+    except ValueError:
+        return None
+
+
+def parse_participant_record(line: str) -> Optional[ParticipantRecord]:
+    """Разобрать строку старого текстового лога целиком"""
+    key = parse_participant_line(line)
+    if key is None:
+        return None
+    parts = line.rstrip("\n").split(", ", 2)
+    rest = parts[2] if len(parts) > 2 else ""
+    # Действие — всегда последнее поле, всё между "Name: " и ним — имя
+    name, separator, action = rest.rpartition(", Action: ")
+    if not separator:
+        name, action = rest, "other"
+    if name.startswith("Name: "):
+        name = name[6:]
+    return ParticipantRecord(key[0], key[1], 0, action, name)
+
+
+def encode_record(chat_id: int,
+                  user_id: int,
+                  name: str,
+                  action: str,
+                  timestamp: Optional[int] = None) -> bytes:
+    """Запись бинарного журнала"""
+    name_bytes = name.encode('utf-8')[:MAX_NAME_BYTES]
+    if timestamp is None:
+        timestamp = int(time.time())
+    return RECORD_HEADER.pack(chat_id, user_id, timestamp,
+                              ACTION_CODES.get(action, 0),
+                              len(name_bytes)) + name_bytes
+
+
+def iter_records(data: bytes) -> Iterator[ParticipantRecord]:
+    """Записи журнала по порядку; оборванная последняя запись пропускается"""
+    offset, size, header = 0, len(data), RECORD_HEADER.size
+    unpack_from = RECORD_HEADER.unpack_from
+    while offset + header <= size:
+        chat_id, user_id, timestamp, code, name_len = unpack_from(data, offset)
+        offset += header
+        if offset + name_len > size:
+            break
+        name = data[offset:offset + name_len].decode('utf-8', 'replace')
+        offset += name_len
+        yield ParticipantRecord(chat_id, user_id, timestamp,
+                                ACTIONS[code] if code < len(ACTIONS) else
+                                "other", name)
+    if offset != size:
+        logging.warning(f"Оборванная запись в конце журнала участников "
+                        f"({size - offset} байт)")
+
+
+def iter_keys(data: bytes) -> Iterator[Tuple[int, int]]:
+    """Только (chat_id, user_id) записей: имя не декодируется"""
+    offset, size, header = 0, len(data), RECORD_HEADER.size
+    unpack_from = RECORD_HEADER.unpack_from
+    while offset + header <= size:
+        chat_id, user_id, _, _, name_len = unpack_from(data, offset)
+        offset += header + name_len
+        if offset > size:
+            break
+        yield chat_id, user_id
+
+
+def log_segments(path: str) -> List[str]:
+    """Файлы журнала от старых к новым: path.1, path.2, ..., затем path"""
+    directory = os.path.dirname(path)
+    pattern = re.compile(re.escape(os.path.basename(path)) + r"\.(\d+)$")
+    numbered = []
+    for filename in os.listdir(directory or "."):
+        match = pattern.match(filename)
+        if match:
+            numbered.append(
+                (int(match.group(1)), os.path.join(directory, filename)))
+    segments = [segment for _, segment in sorted(numbered)]
+    if os.path.exists(path):
+        segments.append(path)
+    return segments
+
+
+def read_log(path: str) -> bytes:
+    """Все сегменты журнала подряд (запись не пересекает границу файлов)"""
+    chunks = []
+    for segment in log_segments(path):
+        with open(segment, 'rb') as f:
+            chunks.append(f.read())
+    return b"".join(chunks)
+
+
+def rotate_log(path: str) -> Optional[str]:
+    """Переименовать текущий файл журнала в следующий номерной сегмент
+
+    Через link()+unlink(): если несколько процессов ротируют одновременно,
+    сегмент не перезаписывается, а записи, дописанные в старый файл до
+    unlink(), остаются в нём.
+    """
+    number = max((int(segment.rsplit(".", 1)[1])
+                  for segment in log_segments(path) if segment != path),
+                 default=0)
+    while True:
+        number += 1
+        segment = f"{path}.{number}"
+        try:
+            os.link(path, segment)
+        except FileExistsError:
+            continue
+        except FileNotFoundError:
+            # Файл уже ротировал другой процесс
+            return None
+        os.unlink(path)
+        return segment
+
+
+def write_records(path: str, records: List[ParticipantRecord]):
+    """Записать журнал целиком во временный файл и атомарно подменить path"""
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, 'wb') as f:
+        f.write(b"".join(
+            encode_record(r.chat_id, r.user_id, r.name, r.action, r.timestamp)
+            for r in records))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def compact_log(path: str) -> Tuple[int, int]:
+    """Оставить в журнале последнюю запись на (chat_id, user_id)
+
+    Только при остановленном боте. Все сегменты сливаются в один файл path.
+    Возвращает число записей до и после.
+    """
+    segments = log_segments(path)
+    latest: Dict[Tuple[int, int], ParticipantRecord] = {}
+    total = 0
+    for record in iter_records(read_log(path)):
+        total += 1
+        key = (record.chat_id, record.user_id)
+        # Порядок — по первому появлению, запись — последняя
+        latest[key] = record
+    write_records(path, list(latest.values()))
+    # Сегменты удаляются после подмены: при сбое останутся дубли, не потери
+    for segment in segments:
+        if segment != path:
+            os.unlink(segment)
+    return total, len(latest)
+
+
+def convert_text_log(src: str, dst: str) -> int:
+    """Перевести старый текстовый participants.txt в бинарный журнал
+
+    Готовый файл появляется атомарно; если dst уже существует (его создал
+    другой процесс), бросается FileExistsError. Возвращает число записей.
+    """
+    records = []
+    with open(src, 'r', encoding='utf-8') as f:
+        for line in f:
+            record = parse_participant_record(line)
+            if record is not None:
+                records.append(record)
+    tmp_path = f"{dst}.tmp{os.getpid()}"
+    write_records(tmp_path, records)
+    try:
+        os.link(tmp_path, dst)
+    finally:
+        os.unlink(tmp_path)
+    return len(records)
+
+
+class ParticipantStore:
+    """Индекс участников поверх бинарного журнала
+
+    Журнал читается один раз при старте, после этого проверка дубликатов идёт
+    по индексу chat_id -> {user_id} в памяти, а новые записи только
+    дописываются в конец файла без повторного чтения. Когда файл дорастает
+    до max_bytes, он уходит в номерной сегмент path.N и начинается новый. Тот же индекс отдаёт
+    готовое множество участников чата для "шип" и "статистика".
+
+    После start() запись идёт в фоне: записи копятся в буфере и сбрасываются
+    пачкой по размеру или по таймеру в отдельном потоке, чтобы диск не
+    тормозил event loop. Без start() запись синхронная.
+
+    Если передан namespace постоянного хранилища, индекс держится и там:
+    при рестарте он поднимается из базы без разбора всего файла, а файл
+    остаётся журналом регистраций.
+
+    Если журнала ещё нет, а есть старый текстовый legacy_path, load()
+    один раз переводит его в бинарный формат.
+    """
+
+    def __init__(self,
+                 path: str,
+                 batch_size: int = 100,
+                 flush_interval: float = 1.0,
+                 namespace: Optional[Namespace] = None,
+                 max_bytes: int = 16 * 1024 * 1024,
+                 legacy_path: Optional[str] = None):
+        self.path = path
+        self.legacy_path = legacy_path
+        self.max_bytes = max_bytes
+        self.namespace = namespace
+        # Новые участники пишутся в базу кусками, а не всем чатом сразу
+        self._saved = ChunkedSets(namespace) if namespace is not None else None
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._by_chat: Dict[int, Set[int]] = {}
+        self._size = 0
+        self._pending: List[bytes] = []
+        self._batch_ready = asyncio.Event()
+        self._write_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def load(self):
+        """Построить индекс по хранилищу или по существующему журналу"""
+        self._by_chat.clear()
+        self._size = 0
+        self._migrate_legacy()
+        if self.namespace is not None and len(self.namespace):
+            for chat_key, members in self._saved.load().items():
+                self._by_chat[int(chat_key)] = members
+                self._size += len(members)
+            logging.info(f"Загружено {self._size} участников из хранилища")
+            return
+        for key in iter_keys(read_log(self.path)):
+            self._remember(*key)
+        # При первом запуске с хранилищем _remember() переносит туда индекс
+        logging.info(f"Загружено {self._size} участников из {self.path}")
+
+    def _remember(self, chat_id: int, user_id: int) -> bool:
+        members = self._by_chat.get(chat_id)
+        if members is None:
+            members = self._by_chat[chat_id] = set()
+        elif user_id in members:
+            return False
+        members.add(user_id)
+        self._size += 1
+        if self._saved is not None:
+            self._saved.add(str(chat_id), user_id)
+        return True
+
+    def __contains__(self, key: Tuple[int, int]) -> bool:
+        chat_id, user_id = key
+        return user_id in self._by_chat.get(chat_id, ())
+
+    def __len__(self) -> int:
+        return self._size
+
+    def members(self, chat_id: int) -> Set[int]:
+        """Множество участников чата (не изменять снаружи)"""
+        return self._by_chat.get(chat_id, set())
+
+    def chats(self) -> List[int]:
+        """Все чаты, в которых есть участники"""
+        return list(self._by_chat)
+
+    def add(self,
+            chat_id: int,
+            user_id: int,
+            username: str = None,
+            first_name: str = None,
+            action: str = "register") -> bool:
+        """Дописать участника, если его ещё нет. Вернуть True, если добавлен"""
+        if not self._remember(chat_id, user_id):
+            return False
+        record = encode_record(chat_id, user_id,
+                               format_user_info(user_id, username, first_name),
+                               action)
+        if self._task is None:
+            self._write([record])
+            return True
+        self._pending.append(record)
+        if len(self._pending) >= self.batch_size:
+            self._batch_ready.set()
+        return True
+
+    @property
+    def pending(self) -> int:
+        """Сколько записей ждут сброса на диск"""
+        return len(self._pending)
+
+    def _migrate_legacy(self):
+        if (not self.legacy_path or not os.path.exists(self.legacy_path)
+                or log_segments(self.path)):
+            return
+        try:
+            count = convert_text_log(self.legacy_path, self.path)
+        except FileExistsError:
+            # Журнал успел создать другой процесс
+            return
+        logging.info(f"{self.legacy_path} переведён в {self.path}: "
+                     f"{count} записей")
+
+    def _write(self, records: List[bytes]):
+        # Одним write() в O_APPEND-файл: пачки из разных процессов не
+        # перемешиваются посреди записи
+        with open(self.path, 'ab', buffering=0) as f:
+            f.write(b"".join(records))
+            size = os.fstat(f.fileno()).st_size
+        if self.max_bytes and size >= self.max_bytes:
+            segment = rotate_log(self.path)
+            if segment:
+                logging.info(f"Журнал участников ротирован в {segment}")
+
+    async def flush(self):
+        """Сбросить накопленные записи на диск"""
+        self._batch_ready.clear()
+        if not self._pending:
+            return
+        records, self._pending = self._pending, []
+        async with self._write_lock:
+            try:
+                await asyncio.to_thread(self._write, records)
+            except Exception as e:
+                logging.error(f"Ошибка записи участников: {e}")
+                # Возвращаем записи в начало буфера, попробуем в следующий раз
+                self._pending[:0] = records
+
+    async def _run(self):
+        while True:
+            # Не wait_for: в Python 3.11 он теряет отмену, если событие
+            # сработало одновременно с ней, и close() зависает
+            ready = asyncio.ensure_future(self._batch_ready.wait())
+            try:
+                await asyncio.wait((ready, ), timeout=self.flush_interval)
+            finally:
+                ready.cancel()
+            await self.flush()
+
+    def start(self):
+        """Включить фоновую запись"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """Остановить фоновую запись и дописать всё, что осталось"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
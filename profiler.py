@@ -0,0 +1,127 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import List, NamedTuple, Optional, Tuple
+
+
+class ProfileResult(NamedTuple):
+    path: str
+    samples: int
+    top_self: List[Tuple[str, int]]
+    top_total: List[Tuple[str, int]]
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    # Папка плюс файл: main.py бота и pydantic/main.py должны различаться
+    directory, filename = os.path.split(code.co_filename)
+    return f"{code.co_name} ({os.path.basename(directory)}/{filename}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """Семплирующий профилировщик потока event loop
+
+    Отдельный поток каждые interval секунд снимает стек потока event loop
+    через sys._current_frames() и считает одинаковые стеки. Бот при этом не
+    останавливается и не перезапускается. Результат пишется в directory в
+    формате collapsed stacks ("a;b;c число"), который понимают flamegraph.pl
+    и speedscope.
+
+    В топе "вместе с вызванными" считаются только функции из source_root
+    (кода бота): иначе его целиком занимают обвязка asyncio и aiogram.
+    """
+
+    def __init__(self,
+                 directory: str = "profiles",
+                 interval: float = 0.005,
+                 source_root: Optional[str] = None):
+        self.directory = directory
+        self.interval = interval
+        self.source_root = source_root
+        self._running = False
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        return self._running or (self._task is not None
+                                 and not self._task.done())
+
+    def start(self, duration: float) -> bool:
+        """Профилировать в фоне, отчёт — в лог. False, если уже идёт"""
+        if self.running:
+            return False
+        self._task = asyncio.create_task(self._run_logged(duration))
+        return True
+
+    async def _run_logged(self, duration: float):
+        logging.info(f"Профилирование на {duration:.0f} с")
+        try:
+            logging.info(format_profile(await self.run(duration)))
+        except Exception as e:
+            logging.error(f"Ошибка профилирования: {e}")
+
+    async def run(self, duration: float, top: int = 10) -> ProfileResult:
+        """Профилировать duration секунд, вернуть путь к файлу и топ функций"""
+        if self._running:
+            raise RuntimeError("Профилирование уже идёт")
+        self._running = True
+        try:
+            return await asyncio.to_thread(self._profile, threading.get_ident(),
+                                           duration, top)
+        finally:
+            self._running = False
+
+    def _profile(self, thread_id: int, duration: float,
+                 top: int) -> ProfileResult:
+        stacks: Counter = Counter()
+        own_code = set()
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            frame = sys._current_frames().get(thread_id)
+            stack = []
+            while frame is not None:
+                name = _frame_name(frame)
+                stack.append(name)
+                code = frame.f_code
+                if code.co_name != "<module>" and (
+                        self.source_root is None
+                        or code.co_filename.startswith(self.source_root)):
+                    own_code.add(name)
+                frame = frame.f_back
+            if stack:
+                stacks[tuple(reversed(stack))] += 1
+            time.sleep(self.interval)
+
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory,
+                            time.strftime("profile-%Y%m%d-%H%M%S.txt"))
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{';'.join(stack)} {count}\n")
+
+        own: Counter = Counter()
+        total: Counter = Counter()
+        for stack, count in stacks.items():
+            own[stack[-1]] += count
+            # Рекурсия не должна считать функцию дважды
+            for name in set(stack) & own_code:
+                total[name] += count
+        return ProfileResult(path, sum(stacks.values()), own.most_common(top),
+                             total.most_common(top))
+
+
+def format_profile(result: ProfileResult, limit: Optional[int] = None) -> str:
+    """Короткий текстовый отчёт по результату профилирования"""
+    samples = max(result.samples, 1)
+    lines = [f"Профиль: {result.path}, семплов {result.samples}", "",
+             "Сами по себе:"]
+    lines += [f"• {count * 100 / samples:.0f}% {name}"
+              for name, count in result.top_self[:limit]]
+    lines += ["", "Вместе с вызванными:"]
+    lines += [f"• {count * 100 / samples:.0f}% {name}"
+              for name, count in result.top_total[:limit]]
+    return "\n".join(lines)
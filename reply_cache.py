@@ -0,0 +1,138 @@
+import asyncio
+import hashlib
+import json
+import re
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Вопрос без регистра, лишних пробелов и знаков в конце"""
+    return _SPACES.sub(" ", prompt.lower()).strip().rstrip("?!.… ")
+
+
+class ReplyCache:
+    """Кэш ответов ИИ на одинаковые вопросы и объединение запросов в полёте
+
+    Ключ — вопрос после normalize_prompt() вместе с моделью, преамбулой и
+    историей диалога; кэшируются только вопросы без истории или с короткой
+    (не длиннее max_history сообщений), иначе ответ зависит от беседы.
+    Ответы живут ttl секунд, всего хранится не больше max_size (LRU).
+
+    Пока по ключу идёт запрос, одинаковые вопросы не уходят в API, а ждут
+    его ответа (single-flight): ведущий вызывает begin()/end() или run(),
+    остальные — join(). Ошибка ведущего достаётся и ожидающим, а если
+    ведущий снят без ответа (abandon()), запрос делает один из ожидающих.
+    """
+
+    def __init__(self,
+                 max_size: int = 500,
+                 ttl: float = 600.0,
+                 max_history: int = 0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_history = max_history
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._replies: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    def __len__(self) -> int:
+        return len(self._replies)
+
+    def key(self, payload: dict) -> Optional[str]:
+        """Ключ запроса к Cohere или None, если его ответ не кэшируется"""
+        history = payload.get("chat_history") or []
+        if len(history) > self.max_history:
+            return None
+        raw = json.dumps([
+            payload.get("model"),
+            payload.get("preamble"),
+            normalize_prompt(payload["message"]), history
+        ],
+                         ensure_ascii=False)
+        return hashlib.sha1(raw.encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self._replies.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        stored_at, reply = entry
+        if time.monotonic() - stored_at > self.ttl:
+            del self._replies[key]
+            self.misses += 1
+            return None
+        self._replies.move_to_end(key)
+        self.hits += 1
+        return reply
+
+    def put(self, key: str, reply: str):
+        if not reply.strip():
+            return
+        self._replies[key] = (time.monotonic(), reply)
+        self._replies.move_to_end(key)
+        while len(self._replies) > self.max_size:
+            self._replies.popitem(last=False)
+
+    async def join(self, key: str) -> Optional[str]:
+        """Ответ из кэша или из уже идущего запроса; None — запрашивать самому"""
+        reply = self.get(key)
+        if reply is not None:
+            return reply
+        while True:
+            future = self._inflight.get(key)
+            if future is None:
+                return None
+            self.coalesced += 1
+            try:
+                # shield: отмена одного ожидающего не отменяет общий ответ
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                # Ведущего отменили — запрос делает кто-то из ожидающих
+
+    def begin(self, key: str):
+        """Объявить себя ведущим запроса по ключу (сразу после join() -> None)"""
+        self._inflight[key] = asyncio.get_running_loop().create_future()
+
+    def end(self,
+            key: str,
+            reply: Optional[str] = None,
+            error: Optional[BaseException] = None):
+        """Отдать ответ (и закэшировать) или ошибку всем ожидающим"""
+        future = self._inflight.pop(key, None)
+        if future is None:
+            return
+        if error is None:
+            self.put(key, reply)
+            future.set_result(reply)
+        elif isinstance(error, asyncio.CancelledError):
+            future.cancel()
+        else:
+            future.set_exception(error)
+            # Если никто не ждал, asyncio не должен ругаться на ошибку
+            future.exception()
+
+    def abandon(self, key: str):
+        """Снять запрос без ответа: ожидающие сделают его сами"""
+        self.end(key, error=asyncio.CancelledError())
+
+    async def run(self, key: str, fetch: Callable[[], Awaitable[str]]) -> str:
+        """Ответ из кэша, из идущего запроса или от fetch()"""
+        reply = await self.join(key)
+        if reply is not None:
+            return reply
+        self.begin(key)
+        try:
+            reply = await fetch()
+        except BaseException as e:
+            self.end(key, error=e)
+            raise
+        self.end(key, reply)
+        return reply
@@ -0,0 +1,273 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import queue
+import secrets
+import signal
+import sys
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+from aiohttp import web
+
+# Апдейты, в которых чат лежит в поле "chat" вложенного объекта
+CHAT_UPDATE_FIELDS = ("message", "edited_message", "channel_post",
+                      "edited_channel_post", "business_message",
+                      "edited_business_message", "my_chat_member",
+                      "chat_member", "chat_join_request", "chat_boost",
+                      "removed_chat_boost", "message_reaction",
+                      "message_reaction_count")
+# Апдейты без чата: шардируем по пользователю
+USER_UPDATE_FIELDS = ("inline_query", "chosen_inline_result",
+                      "shipping_query", "pre_checkout_query", "poll_answer")
+
+# Сколько апдейтов воркер забирает из очереди за раз
+WORKER_BATCH = 100
+# Как часто воркер, ожидая апдейты, проверяет, жив ли фронт, секунд
+PARENT_CHECK_INTERVAL = 1.0
+# Сигналы остановки: воркеры их не получают, их останавливает фронт
+STOP_SIGNALS = (signal.SIGINT, signal.SIGTERM)
+
+
+def update_chat_id(update: dict) -> Optional[int]:
+    """chat.id апдейта (или id пользователя, если чата нет)"""
+    for field in CHAT_UPDATE_FIELDS:
+        obj = update.get(field)
+        if obj and "chat" in obj:
+            return obj["chat"]["id"]
+    callback = update.get("callback_query")
+    if callback:
+        message = callback.get("message")
+        if message and "chat" in message:
+            return message["chat"]["id"]
+        return callback["from"]["id"]
+    for field in USER_UPDATE_FIELDS:
+        obj = update.get(field)
+        if obj:
+            user = obj.get("from") or obj.get("user")
+            if user:
+                return user["id"]
+    return None
+
+
+def shard_for(update: dict, workers: int) -> int:
+    """Номер воркера для апдейта: все апдейты одного чата — одному воркеру"""
+    chat_id = update_chat_id(update)
+    return 0 if chat_id is None else chat_id % workers
+
+
+def _get_batch(updates: multiprocessing.Queue) -> List[Optional[dict]]:
+    while True:
+        try:
+            batch = [updates.get(timeout=PARENT_CHECK_INTERVAL)]
+            break
+        except queue.Empty:
+            # Фронт убит, не успев прислать None: останавливаемся сами
+            if not multiprocessing.parent_process().is_alive():
+                logging.warning("Фронт завершился, воркер останавливается")
+                return [None]
+    while len(batch) < WORKER_BATCH and batch[-1] is not None:
+        try:
+            batch.append(updates.get_nowait())
+        except queue.Empty:
+            break
+    return batch
+
+
+def worker_env(index: int, workers: int) -> Dict[str, str]:
+    """Переменные окружения воркера поверх окружения фронта"""
+    env = {"SHARD_INDEX": str(index)}
+    # Своя база состояния на шард: чаты за воркерами закреплены
+    state_db = os.getenv("STATE_DB")
+    if state_db:
+        env["STATE_DB"] = f"{state_db}.shard{index}"
+    # Общий лимит Telegram на бота делится между воркерами, лимиты чатов —
+    # нет: чат обслуживает только один воркер
+    global_rate = float(os.getenv("OUTBOUND_GLOBAL_RATE", "30"))
+    env["OUTBOUND_GLOBAL_RATE"] = str(global_rate / workers)
+    # Метрики каждого воркера на своём порту: METRICS_PORT + номер
+    metrics_port = int(os.getenv("METRICS_PORT", "0"))
+    if metrics_port:
+        env["METRICS_PORT"] = str(metrics_port + index)
+    return env
+
+
+@contextmanager
+def _environ(env: Dict[str, str]) -> Iterator[None]:
+    saved = {name: os.environ.get(name) for name in env}
+    os.environ.update(env)
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def _bot_module():
+    """Модуль бота в процессе-воркере
+
+    spawn ещё до worker_main выполняет в воркере главный скрипт фронта как
+    __mp_main__ (уже с окружением воркера, см. ShardRouter.start()). Если это
+    main.py, берём его: import main построил бы второго бота, второе
+    хранилище и второе соединение с базой.
+    """
+    module = sys.modules.get("__mp_main__")
+    if module is not None and hasattr(module, "start_services"):
+        return module
+    import main
+    return main
+
+
+async def _run_worker(index: int, updates: multiprocessing.Queue,
+                      ready: multiprocessing.Queue):
+    bot_main = _bot_module()
+
+    await bot_main.start_services()
+    ready.put(index)
+    logging.info(f"Воркер {index} готов (pid {os.getpid()})")
+
+    loop = asyncio.get_running_loop()
+    tasks = set()
+    running = True
+    while running:
+        for update in await loop.run_in_executor(None, _get_batch, updates):
+            if update is None:
+                running = False
+                break
+            task = asyncio.create_task(
+                bot_main.dp.feed_raw_update(bot_main.bot, update))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+    if tasks:
+        await asyncio.wait(tasks)
+    await bot_main.stop_services()
+    logging.info(f"Воркер {index} остановлен")
+
+
+def worker_main(index: int, updates: multiprocessing.Queue,
+                ready: multiprocessing.Queue):
+    """Точка входа процесса-воркера"""
+    # Останавливает воркеров фронт (None в очереди): SIGINT из терминала и
+    # SIGTERM всей группе процессов (systemd, timeout) иначе убили бы их, не
+    # дав дописать участников и состояние
+    for sig in STOP_SIGNALS:
+        signal.signal(sig, signal.SIG_IGN)
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(_run_worker(index, updates, ready))
+
+
+class ShardRouter:
+    """Фронт: принимает вебхук и раскладывает апдейты по воркерам
+
+    Апдейты одного чата всегда попадают в один и тот же процесс
+    (chat.id % workers), поэтому состояние чата (кэши, история, очереди ИИ)
+    живёт в одном воркере, а чаты обрабатываются параллельно на всех ядрах.
+    """
+
+    def __init__(self, workers: int, secret_token: Optional[str] = None):
+        self.workers = workers
+        self.secret_token = secret_token
+        self.routed = [0] * workers
+        context = multiprocessing.get_context("spawn")
+        self._ready = context.Queue()
+        self._queues = [context.Queue() for _ in range(workers)]
+        self._processes = [
+            context.Process(target=worker_main,
+                            args=(index, self._queues[index], self._ready),
+                            name=f"coral-shard-{index}")
+            for index in range(workers)
+        ]
+        self._ready_count = 0
+
+    def start(self):
+        # Окружение воркера и игнорирование сигналов остановки нужны уже при
+        # запуске процесса: spawn выполняет в нём главный скрипт (main.py)
+        # раньше worker_main. Игнорирование сигналов наследуется
+        handlers = {sig: signal.signal(sig, signal.SIG_IGN) for sig in STOP_SIGNALS}
+        try:
+            for index, process in enumerate(self._processes):
+                with _environ(worker_env(index, self.workers)):
+                    process.start()
+        finally:
+            for sig, handler in handlers.items():
+                signal.signal(sig, handler)
+
+    def _poll_ready(self) -> bool:
+        while self._ready_count < self.workers:
+            try:
+                self._ready.get_nowait()
+            except queue.Empty:
+                return False
+            self._ready_count += 1
+        return True
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        if self.secret_token and not secrets.compare_digest(
+                request.headers.get("X-Telegram-Bot-Api-Secret-Token", ""),
+                self.secret_token):
+            return web.Response(status=401, text="Unauthorized")
+        update = await request.json()
+        shard = shard_for(update, self.workers)
+        self.routed[shard] += 1
+        self._queues[shard].put_nowait(update)
+        return web.Response()
+
+    async def healthz(self, request: web.Request) -> web.Response:
+        if not self._poll_ready():
+            return web.Response(status=503, text="starting")
+        return web.Response(text="ok")
+
+    async def stop(self, timeout: float = 30.0):
+        """Дать воркерам доработать очередь и остановиться"""
+        for updates in self._queues:
+            updates.put(None)
+        loop = asyncio.get_running_loop()
+        for process in self._processes:
+            await loop.run_in_executor(None, process.join, timeout)
+            if process.is_alive():
+                logging.warning(f"{process.name} не остановился, завершаю")
+                # SIGTERM воркер игнорирует
+                process.kill()
+        logging.info(f"Апдейтов по шардам: {self.routed}")
+
+
+async def run_sharded(workers: int,
+                      host: str,
+                      port: int,
+                      path: str,
+                      secret_token: Optional[str] = None):
+    """Фронт-вебхук с воркерами до SIGTERM/SIGINT
+
+    Воркеры эти сигналы игнорируют: их останавливает фронт, и они сначала
+    дорабатывают очередь и вызывают stop_services(). Поэтому SIGTERM можно
+    слать и всей группе процессов (KillMode=control-group в systemd,
+    timeout). Если фронт убит без остановки воркеров, они замечают это за
+    PARENT_CHECK_INTERVAL и останавливаются так же.
+    """
+    router = ShardRouter(workers, secret_token)
+    router.start()
+
+    app = web.Application()
+    app.router.add_post(path, router.handle_update)
+    app.router.add_get("/healthz", router.healthz)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    print(f"🌐 Фронт слушает http://{host}:{port}{path}, воркеров: {workers}")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+    try:
+        await stop.wait()
+    finally:
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.remove_signal_handler(sig)
+        await runner.cleanup()
+        await router.stop()
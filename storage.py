@@ -0,0 +1,260 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+from typing import Any, Dict, Iterator, List, Mapping, Optional, Set, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+
+
+class StorageBackend:
+    """Постоянное хранилище пар (namespace, key) -> JSON"""
+
+    def load_all(self) -> Dict[str, Dict[str, Any]]:
+        raise NotImplementedError
+
+    def write_batch(self, upserts: List[Tuple[str, str, str]],
+                    deletes: List[Tuple[str, str]]):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class SQLiteBackend(StorageBackend):
+    """Встроенная SQLite-база в одном файле
+
+    Методы вызываются из рабочего потока, поэтому соединение общее и
+    защищено блокировкой.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS state ("
+                           "namespace TEXT NOT NULL, "
+                           "key TEXT NOT NULL, "
+                           "value TEXT NOT NULL, "
+                           "PRIMARY KEY (namespace, key))")
+        self._conn.commit()
+
+    def load_all(self) -> Dict[str, Dict[str, Any]]:
+        data: Dict[str, Dict[str, Any]] = {}
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT namespace, key, value FROM state").fetchall()
+        for namespace, key, value in rows:
+            data.setdefault(namespace, {})[key] = json.loads(value)
+        return data
+
+    def write_batch(self, upserts: List[Tuple[str, str, str]],
+                    deletes: List[Tuple[str, str]]):
+        with self._lock, self._conn:
+            if upserts:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO state (namespace, key, value) "
+                    "VALUES (?, ?, ?)", upserts)
+            if deletes:
+                self._conn.executemany(
+                    "DELETE FROM state WHERE namespace = ? AND key = ?",
+                    deletes)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class Namespace:
+    """Словарь в памяти; изменения копятся и пишутся в базу пачкой"""
+
+    def __init__(self, store: "StateStore", name: str):
+        self.name = name
+        self._store = store
+        self._data: Dict[str, Any] = {}
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self._data.get(key, default)
+
+    def items(self) -> Iterator[Tuple[str, Any]]:
+        return iter(list(self._data.items()))
+
+    def set(self, key: str, value: Any):
+        """Записать значение; в базу оно попадёт при следующем сбросе.
+        Значение сериализуется в момент сброса, так что изменяемый объект
+        можно менять на месте и просто снова вызвать set()"""
+        self._data[key] = value
+        self._store._dirty.add((self.name, key))
+
+    def delete(self, key: str):
+        if self._data.pop(key, None) is not None:
+            self._store._dirty.add((self.name, key))
+
+
+class ChunkedSets:
+    """Большие множества чисел в Namespace, записываемые кусками
+
+    Множество по ключу key хранится ключами "key/0", "key/1"... со списками
+    не длиннее chunk_size. add() дописывает только в последний кусок, поэтому
+    сброс сериализует не больше chunk_size чисел, а не всё множество (в чате
+    на 200 тысяч участников это десятки миллисекунд на каждый сброс).
+    Ключ без номера — старый формат, всё множество одним списком; он
+    читается, но больше не пишется.
+    """
+
+    def __init__(self, namespace: Namespace, chunk_size: int = 1000):
+        self.namespace = namespace
+        self.chunk_size = chunk_size
+        # key -> (номер последнего куска, его список)
+        self._tails: Dict[str, Tuple[int, list]] = {}
+
+    def load(self) -> Dict[str, Set[int]]:
+        """Все множества из namespace"""
+        sets: Dict[str, Set[int]] = {}
+        self._tails.clear()
+        for chunk_key, values in self.namespace.items():
+            key, _, number = chunk_key.partition("/")
+            sets.setdefault(key, set()).update(values)
+            if number:
+                tail = self._tails.get(key)
+                if tail is None or int(number) > tail[0]:
+                    self._tails[key] = (int(number), values)
+        return sets
+
+    def add(self, key: str, value: int):
+        """Записать новый элемент (проверка на повтор — у вызывающего)"""
+        tail = self._tails.get(key)
+        if tail is None:
+            tail = self._tails[key] = (0, [])
+        elif len(tail[1]) >= self.chunk_size:
+            tail = self._tails[key] = (tail[0] + 1, [])
+        number, values = tail
+        values.append(value)
+        self.namespace.set(f"{key}/{number}", values)
+
+
+class StateStore:
+    """Состояние бота: чтение из памяти, пакетная запись в StorageBackend
+
+    При старте load() одним запросом поднимает всё сохранённое, после этого
+    все чтения идут из памяти. Изменённые ключи сбрасываются в базу раз в
+    flush_interval секунд одной транзакцией в рабочем потоке.
+    """
+
+    def __init__(self, backend: StorageBackend, flush_interval: float = 2.0):
+        self.backend = backend
+        self.flush_interval = flush_interval
+        self._namespaces: Dict[str, Namespace] = {}
+        self._dirty: Set[Tuple[str, str]] = set()
+        self._task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+
+    def namespace(self, name: str) -> Namespace:
+        namespace = self._namespaces.get(name)
+        if namespace is None:
+            namespace = self._namespaces[name] = Namespace(self, name)
+        return namespace
+
+    async def load(self):
+        data = await asyncio.to_thread(self.backend.load_all)
+        for name, values in data.items():
+            self.namespace(name)._data.update(values)
+        logging.info("Состояние загружено: " + ", ".join(
+            f"{name}={len(values)}" for name, values in data.items()))
+
+    @property
+    def pending(self) -> int:
+        return len(self._dirty)
+
+    async def flush(self):
+        """Записать все изменённые ключи одной транзакцией"""
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, set()
+        upserts, deletes = [], []
+        for name, key in dirty:
+            data = self._namespaces[name]._data
+            if key in data:
+                # Сериализуем здесь, в потоке loop: объект могут менять
+                upserts.append((name, key,
+                                json.dumps(data[key],
+                                           ensure_ascii=False,
+                                           default=list)))
+            else:
+                deletes.append((name, key))
+        async with self._flush_lock:
+            try:
+                await asyncio.to_thread(self.backend.write_batch, upserts,
+                                        deletes)
+            except Exception as e:
+                logging.error(f"Ошибка записи состояния: {e}")
+                self._dirty |= dirty
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        await asyncio.to_thread(self.backend.close)
+
+
+class PersistentFSMStorage(BaseStorage):
+    """FSM-хранилище aiogram поверх Namespace: состояние переживает рестарт"""
+
+    def __init__(self, namespace: Namespace):
+        self._namespace = namespace
+        self._key_builder = DefaultKeyBuilder(with_bot_id=True,
+                                              with_business_connection_id=True,
+                                              with_destiny=True)
+
+    def _record(self, key: StorageKey) -> Tuple[str, dict]:
+        record_key = self._key_builder.build(key)
+        return record_key, self._namespace.get(record_key) or {}
+
+    def _save(self, record_key: str, record: dict):
+        if record.get("state") is None and not record.get("data"):
+            self._namespace.delete(record_key)
+        else:
+            self._namespace.set(record_key, record)
+
+    async def set_state(self, key: StorageKey, state: StateType = None):
+        record_key, record = self._record(key)
+        record = dict(record,
+                      state=state.state if isinstance(state, State) else state)
+        self._save(record_key, record)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return self._record(key)[1].get("state")
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]):
+        record_key, record = self._record(key)
+        self._save(record_key, dict(record, data=dict(data)))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return dict(self._record(key)[1].get("data") or {})
+
+    async def close(self):
+        pass
@@ -0,0 +1,63 @@
+import asyncio
+
+from ai_scheduler import AIScheduler
+
+
+def gated_first():
+    """Запрос, который выполняется, пока не открыт gate"""
+    gate = asyncio.get_running_loop().create_future()
+
+    async def first():
+        await gate
+        return "first"
+
+    return gate, first
+
+
+async def second():
+    return "second"
+
+
+async def test_cancel_while_queued():
+    """Отмена ожидающего в тот же момент, когда слот отдаётся ему"""
+    scheduler = AIScheduler(max_concurrent=1)
+    gate, first = gated_first()
+
+    t1 = asyncio.create_task(scheduler.run(1, 1, first))
+    await asyncio.sleep(0)
+    t2 = asyncio.create_task(scheduler.run(1, 2, second))
+    await asyncio.sleep(0)
+    assert scheduler.running == 1 and scheduler.queued == 1
+
+    gate.set_result(None)
+    t2.cancel()
+    results = await asyncio.gather(t1, t2, return_exceptions=True)
+
+    assert results[0] == "first"
+    assert isinstance(results[1], asyncio.CancelledError)
+    assert scheduler.running == 0
+    assert scheduler.queued == 0
+    assert not scheduler._user_load
+    assert not scheduler._queues and not scheduler._chat_ring
+
+    # Слот снова свободен
+    assert await scheduler.run(1, 3, second) == "second"
+
+
+async def test_cancel_queued_frees_its_place():
+    scheduler = AIScheduler(max_concurrent=1)
+    gate, first = gated_first()
+
+    t1 = asyncio.create_task(scheduler.run(1, 1, first))
+    await asyncio.sleep(0)
+    t2 = asyncio.create_task(scheduler.run(1, 2, second))
+    t3 = asyncio.create_task(scheduler.run(2, 3, second))
+    await asyncio.sleep(0)
+    t2.cancel()
+    await asyncio.sleep(0)
+    assert scheduler.queued == 1
+
+    gate.set_result(None)
+    assert await t1 == "first"
+    assert await t3 == "second"
+    assert scheduler.running == 0 and not scheduler._user_load
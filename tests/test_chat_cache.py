@@ -0,0 +1,22 @@
+import asyncio
+
+from chat_cache import ChatInfoCache
+
+
+async def test_close_cancels_refreshes():
+    started = asyncio.Event()
+
+    async def fetch_admins(chat_id):
+        started.set()
+        await asyncio.Event().wait()
+
+    async def fetch_member_count(chat_id):
+        return 10
+
+    cache = ChatInfoCache(fetch_admins, fetch_member_count)
+    task = cache.refresh_in_background(-100)
+    await started.wait()
+    await cache.close()
+
+    assert task.cancelled()
+    assert not cache._refreshing
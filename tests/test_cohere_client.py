@@ -0,0 +1,26 @@
+import asyncio
+
+from cohere_client import CircuitBreaker, CohereClient
+
+
+class HangingSession:
+    closed = False
+
+    async def post(self, *args, **kwargs):
+        await asyncio.Event().wait()
+
+
+async def test_cancelled_probe_frees_half_open():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    breaker.record_failure()
+    client = CohereClient("key", breaker=breaker)
+    client._session = HangingSession()
+
+    task = asyncio.create_task(client.chat({"message": "привет"}))
+    await asyncio.sleep(0)
+    assert not breaker.allow()
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.allow()
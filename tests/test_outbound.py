@@ -0,0 +1,62 @@
+import asyncio
+import time
+
+import pytest
+from aiogram.methods import EditMessageText, SendMessage
+
+from outbound import PRIORITY_LOW, OutboundLimiter, SendSkipped
+
+CHAT_ID = -100
+# Интервал промежуточных правок потокового ответа по умолчанию
+EDIT_INTERVAL = 1.5
+
+
+async def make_request(bot, method):
+    return True
+
+
+def edit(text: str) -> EditMessageText:
+    return EditMessageText(chat_id=CHAT_ID, message_id=1, text=text)
+
+
+async def test_low_edit_never_waits_for_chat_limit():
+    limiter = OutboundLimiter()
+    # Запас ведра группы израсходован: следующий токен через ~3.5 с
+    for _ in range(limiter.group_burst):
+        await limiter(make_request, None, SendMessage(chat_id=CHAT_ID,
+                                                      text="ответ"))
+
+    with limiter.priority(PRIORITY_LOW):
+        for index in range(20):
+            started = time.monotonic()
+            with pytest.raises(SendSkipped):
+                await limiter(make_request, None, edit(f"кусок {index}"))
+            assert time.monotonic() - started < EDIT_INTERVAL
+    assert limiter.skipped == 20
+    assert limiter.waiting == 0
+
+
+async def test_low_edit_yields_to_queued_reply():
+    limiter = OutboundLimiter()
+    for _ in range(limiter.group_burst):
+        await limiter(make_request, None, SendMessage(chat_id=CHAT_ID,
+                                                      text="ответ"))
+    reply = asyncio.create_task(
+        limiter(make_request, None, SendMessage(chat_id=CHAT_ID, text="ещё")))
+    await asyncio.sleep(0)
+    assert limiter.waiting == 1
+
+    # Токен пополнился, но пока pump не проснулся, он принадлежит ждущему
+    # ответу, а не правке
+    limiter._bucket(CHAT_ID).tokens = 1
+    with limiter.priority(PRIORITY_LOW), pytest.raises(SendSkipped):
+        await limiter(make_request, None, edit("кусок"))
+    limiter._wakeup.set()
+    assert await reply is True
+
+
+async def test_low_edit_sent_when_tokens_available():
+    limiter = OutboundLimiter()
+    with limiter.priority(PRIORITY_LOW):
+        assert await limiter(make_request, None, edit("кусок")) is True
+    assert limiter.sent == 1 and limiter.skipped == 0
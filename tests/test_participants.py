@@ -0,0 +1,27 @@
+from participants import (ACTIONS, encode_record, iter_records,
+                          parse_participant_record)
+
+
+def test_actions_keep_their_codes():
+    # Коды уже записанных журналов не должны поменять смысл
+    assert ACTIONS[:5] == ("other", "register", "message", "reaction",
+                           "button_register")
+
+
+def test_media_roundtrip():
+    data = encode_record(-100, 7, "@user", "media", timestamp=1)
+    assert [record.action for record in iter_records(data)] == ["media"]
+
+
+def test_text_log_media_action():
+    record = parse_participant_record(
+        "Chat: -100, User: 7, Name: a, b, Action: media\n")
+    data = encode_record(record.chat_id, record.user_id, record.name,
+                         record.action)
+    (converted, ) = iter_records(data)
+    assert (converted.name, converted.action) == ("a, b", "media")
+
+
+def test_unknown_action_is_other():
+    data = encode_record(-100, 7, "x", "something", timestamp=1)
+    assert [record.action for record in iter_records(data)] == ["other"]
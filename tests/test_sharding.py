@@ -0,0 +1,24 @@
+import os
+
+from sharding import _environ, worker_env
+
+
+def test_worker_env(monkeypatch):
+    monkeypatch.setenv("STATE_DB", "state.db")
+    monkeypatch.setenv("OUTBOUND_GLOBAL_RATE", "30")
+    monkeypatch.setenv("METRICS_PORT", "9100")
+    assert worker_env(1, 2) == {
+        "SHARD_INDEX": "1",
+        "STATE_DB": "state.db.shard1",
+        "OUTBOUND_GLOBAL_RATE": "15.0",
+        "METRICS_PORT": "9101",
+    }
+
+
+def test_environ_restored(monkeypatch):
+    monkeypatch.setenv("STATE_DB", "state.db")
+    monkeypatch.delenv("SHARD_INDEX", raising=False)
+    with _environ({"STATE_DB": "state.db.shard0", "SHARD_INDEX": "0"}):
+        assert os.environ["STATE_DB"] == "state.db.shard0"
+    assert os.environ["STATE_DB"] == "state.db"
+    assert "SHARD_INDEX" not in os.environ
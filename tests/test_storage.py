@@ -0,0 +1,38 @@
+import json
+
+from storage import ChunkedSets, SQLiteBackend, StateStore
+
+
+async def test_chunked_sets_roundtrip(tmp_path):
+    store = StateStore(SQLiteBackend(str(tmp_path / "state.db")))
+    namespace = store.namespace("members")
+    # Старый формат: всё множество чата одним ключом
+    namespace.set("-1", [1, 2])
+    sets = ChunkedSets(namespace, chunk_size=3)
+    for user_id in range(3, 10):
+        sets.add("-1", user_id)
+    sets.add("-2", 100)
+    await store.close()
+
+    store = StateStore(SQLiteBackend(str(tmp_path / "state.db")))
+    await store.load()
+    loaded = ChunkedSets(store.namespace("members"), chunk_size=3)
+    assert loaded.load() == {"-1": set(range(1, 10)), "-2": {100}}
+    # Дописывается последний неполный кусок, а не новый
+    loaded.add("-1", 10)
+    assert store.namespace("members").get("-1/2") == [9, 10]
+    assert len(store.namespace("members")) == 5
+    await store.close()
+
+
+def test_chunked_sets_flush_only_tail():
+    store = StateStore(None)
+    sets = ChunkedSets(store.namespace("members"), chunk_size=1000)
+    for user_id in range(2500):
+        sets.add("-1", user_id)
+    store._dirty.clear()
+    sets.add("-1", 2500)
+    (name, key), = store._dirty
+    value = store.namespace(name).get(key)
+    assert key == "-1/2" and json.loads(json.dumps(value)) == list(
+        range(2000, 2501))
@@ -0,0 +1,75 @@
+import asyncio
+import os
+import socket
+import time
+
+import pytest
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.types import Message
+
+from fake_telegram import FakeBotAPI, make_message
+
+CONTENT_FILE = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "content.json")
+CHAT_ID = -100
+WORDS = 200
+
+
+@pytest.fixture(scope="module")
+def bot_main(tmp_path_factory):
+    workdir = tmp_path_factory.mktemp("bot")
+    os.environ.update({
+        "TELEGRAM_TOKEN": "123456:TEST",
+        "COHERE_API_KEY": "test",
+        "CONTENT_FILE": CONTENT_FILE,
+        "PARTICIPANTS_FILE": str(workdir / "participants.log"),
+    })
+    import main
+    return main
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def test_stream_not_slowed_by_chat_limit(bot_main, monkeypatch):
+    """Правки упираются в лимит группы, а поток читается с полной скоростью"""
+    port = free_port()
+    # Заглушка с задержкой и лимитом Telegram на группу; лимиты бота — по
+    # умолчанию
+    api = FakeBotAPI(latency=0.2, chat_per_minute=20)
+    await api.start("127.0.0.1", port)
+    monkeypatch.setattr(bot_main.bot.session, "api",
+                        TelegramAPIServer.from_base(f"http://127.0.0.1:{port}"))
+    monkeypatch.setattr(bot_main, "AI_STREAM_EDIT_INTERVAL", 0.05)
+
+    read_at = []
+
+    async def chat_stream(payload):
+        for index in range(WORDS):
+            read_at.append(time.monotonic())
+            yield f"слово{index} "
+            await asyncio.sleep(0.005)
+
+    monkeypatch.setattr(bot_main.cohere, "chat_stream", chat_stream)
+    message = Message.model_validate(make_message(CHAT_ID, 7, "коралл вопрос"),
+                                     context={"bot": bot_main.bot})
+    try:
+        await bot_main.answer_cohere_streaming(message, 7, "вопрос")
+    finally:
+        await bot_main.bot.session.close()
+        await api.close()
+
+    # Ни правки, ни ожидание токена группы (~3.5 с) не попадают между
+    # кусками потока; ждёт только первое сообщение
+    gaps = [b - a for a, b in zip(read_at[1:], read_at[2:])]
+    assert max(gaps) < 0.1
+    assert api.flood_errors == 0
+    final = api.sent[-1]
+    assert final["method"] == "editmessagetext"
+    assert final["text"].split() == [f"слово{index}" for index in range(WORDS)]
+    assert len(api.sent) <= 20
+    assert bot_main.outbound.skipped > 0
@@ -0,0 +1,98 @@
+"""Локальная заглушка Cohere /v1/chat с настраиваемой задержкой
+
+    python tools/fake_cohere.py --port 8082 --latency 0.5
+
+и бот с COHERE_URL=http://127.0.0.1:8082.
+"""
+import argparse
+import asyncio
+import json
+from typing import Optional
+
+from aiohttp import web
+
+REPLY = "🐙 Коралл думает, что это отличный вопрос! Ответ где-то в глубине океана."
+
+
+class FakeCohere:
+    """Заглушка /v1/chat: обычный и потоковый (NDJSON) ответ
+
+    latency — задержка до первого байта ответа, token_delay — пауза между
+    кусками потокового ответа.
+    """
+
+    def __init__(self,
+                 latency: float = 0.0,
+                 token_delay: float = 0.0,
+                 reply: str = REPLY):
+        self.latency = latency
+        self.token_delay = token_delay
+        self.reply = reply
+        self.requests = 0
+        self.streamed = 0
+        self.app = web.Application()
+        self.app.router.add_post("/v1/chat", self.handle)
+        self._runner: Optional[web.AppRunner] = None
+
+    async def handle(self, request: web.Request) -> web.StreamResponse:
+        payload = await request.json()
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if not payload.get("stream"):
+            return web.json_response({"text": self.reply})
+
+        self.streamed += 1
+        resp = web.StreamResponse(
+            headers={"Content-Type": "application/stream+json"})
+        await resp.prepare(request)
+        await resp.write(
+            json.dumps({"event_type": "stream-start"}).encode() + b"\n")
+        for word in self.reply.split(" "):
+            await resp.write(
+                json.dumps({
+                    "event_type": "text-generation",
+                    "text": word + " "
+                }, ensure_ascii=False).encode() + b"\n")
+            if self.token_delay:
+                await asyncio.sleep(self.token_delay)
+        await resp.write(
+            json.dumps({
+                "event_type": "stream-end",
+                "finish_reason": "COMPLETE"
+            }).encode() + b"\n")
+        await resp.write_eof()
+        return resp
+
+    async def start(self, host: str, port: int):
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8082)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--token-delay", type=float, default=0.05)
+    args = parser.parse_args()
+
+    cohere = FakeCohere(args.latency, args.token_delay)
+    await cohere.start("127.0.0.1", args.port)
+    print(f"Заглушка Cohere: http://127.0.0.1:{args.port}/v1/chat")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        print(f"Запросов: {cohere.requests}, потоковых: {cohere.streamed}")
+        await cohere.close()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,335 @@
+"""Локальная заглушка Telegram: Bot API для ответов бота и отправитель апдейтов
+
+Запуск бота против заглушки в режиме вебхука:
+
+    TELEGRAM_API_URL=http://127.0.0.1:8081 BOT_MODE=webhook \\
+        WEBHOOK_SECRET=s3cret python main.py
+
+и в соседнем терминале:
+
+    python tools/fake_telegram.py --webhook http://127.0.0.1:8080/webhook \\
+        --secret s3cret --api-port 8081 --updates 1000 --concurrency 50
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import statistics
+import math
+import time
+from collections import Counter, deque
+from typing import Deque, Dict, List, Optional
+
+import aiohttp
+from aiohttp import web
+
+BOT_USER = {
+    "id": 1,
+    "is_bot": True,
+    "first_name": "Коралл",
+    "username": "frozencoral_bot"
+}
+
+_message_ids = itertools.count(1)
+
+
+def make_user(user_id: int) -> dict:
+    return {
+        "id": user_id,
+        "is_bot": False,
+        "first_name": f"User{user_id}",
+        "username": f"user{user_id}"
+    }
+
+
+def make_chat(chat_id: int) -> dict:
+    if chat_id < 0:
+        return {"id": chat_id, "type": "supergroup", "title": f"Chat {chat_id}"}
+    return {"id": chat_id, "type": "private", "first_name": f"User{chat_id}"}
+
+
+def make_message(chat_id: int,
+                 user_id: int,
+                 text: Optional[str] = None,
+                 message_id: Optional[int] = None) -> dict:
+    message = {
+        "message_id": message_id or next(_message_ids),
+        "date": int(time.time()),
+        "chat": make_chat(chat_id),
+        "from": make_user(user_id)
+    }
+    if text is None:
+        # Нетекстовое сообщение (стикер)
+        message["sticker"] = {
+            "file_id": "sticker",
+            "file_unique_id": "sticker",
+            "type": "regular",
+            "width": 512,
+            "height": 512,
+            "is_animated": False,
+            "is_video": False
+        }
+    else:
+        message["text"] = text
+    return message
+
+
+def make_message_update(update_id: int,
+                        chat_id: int,
+                        user_id: int,
+                        text: Optional[str] = None) -> dict:
+    return {
+        "update_id": update_id,
+        "message": make_message(chat_id, user_id, text)
+    }
+
+
+def make_callback_update(update_id: int, chat_id: int, user_id: int,
+                         data: str) -> dict:
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": make_user(user_id),
+            "chat_instance": str(chat_id),
+            "data": data,
+            "message": make_message(chat_id, BOT_USER["id"], "🐙")
+        }
+    }
+
+
+def make_reaction_update(update_id: int, chat_id: int, user_id: int) -> dict:
+    return {
+        "update_id": update_id,
+        "message_reaction": {
+            "chat": make_chat(chat_id),
+            "message_id": next(_message_ids),
+            "user": make_user(user_id),
+            "date": int(time.time()),
+            "old_reaction": [],
+            "new_reaction": [{
+                "type": "emoji",
+                "emoji": "👍"
+            }]
+        }
+    }
+
+
+class FakeBotAPI:
+    """Заглушка Bot API: отвечает успехом на любой метод и записывает вызовы
+
+    Бот подключается к ней через TELEGRAM_API_URL. Если заданы global_rate
+    (сообщений в секунду на бота) и/или chat_per_minute (сообщений в минуту
+    на чат), отправка сверх лимита получает 429 с retry_after, как в Telegram.
+    """
+
+    def __init__(self,
+                 latency: float = 0.0,
+                 global_rate: Optional[float] = None,
+                 chat_per_minute: Optional[float] = None):
+        self.latency = latency
+        self.global_rate = global_rate
+        self.chat_per_minute = chat_per_minute
+        self.calls: Counter = Counter()
+        self.sent: List[dict] = []
+        self.flood_errors = 0
+        self._global_window: Deque[float] = deque()
+        self._chat_windows: Dict[str, Deque[float]] = {}
+        self.app = web.Application()
+        self.app.router.add_post("/bot{token}/{method}", self.handle)
+        self._runner: Optional[web.AppRunner] = None
+
+    async def _params(self, request: web.Request) -> dict:
+        if request.content_type == "application/json":
+            return await request.json()
+        data = await request.post()
+        params = {}
+        for key, value in data.items():
+            try:
+                params[key] = json.loads(value)
+            except (TypeError, ValueError):
+                params[key] = value
+        return params
+
+    def result_for(self, method: str, params: dict):
+        chat_id = params.get("chat_id", 0)
+        if method == "getme":
+            return BOT_USER
+        if method in ("sendmessage", "editmessagetext"):
+            message = make_message(int(chat_id or 0), BOT_USER["id"],
+                                   params.get("text", ""),
+                                   params.get("message_id"))
+            message["from"] = BOT_USER
+            return message
+        if method == "getchatadministrators":
+            return [{
+                "status": "creator",
+                "user": make_user(abs(int(chat_id)) % 1000 + 1),
+                "is_anonymous": False
+            }]
+        if method == "getchatmembercount":
+            return 100
+        if method == "getchatmember":
+            return {
+                "status": "member",
+                "user": make_user(int(params.get("user_id", 0)))
+            }
+        if method == "getupdates":
+            return []
+        return True
+
+    @staticmethod
+    def _over_limit(window: Deque[float], limit: float, period: float,
+                    now: float) -> Optional[int]:
+        # Скользящее окно: retry_after — когда освободится самое старое место
+        while window and now - window[0] >= period:
+            window.popleft()
+        if len(window) >= limit:
+            return max(1, math.ceil(window[0] + period - now))
+        return None
+
+    def retry_after(self, params: dict) -> Optional[int]:
+        """Секунды до разрешения отправки или None, если лимит не превышен"""
+        now = time.monotonic()
+        chat_window = None
+        if self.global_rate:
+            retry = self._over_limit(self._global_window, self.global_rate,
+                                     1.0, now)
+            if retry:
+                return retry
+        if self.chat_per_minute and "chat_id" in params:
+            chat_window = self._chat_windows.setdefault(
+                str(params["chat_id"]), deque())
+            retry = self._over_limit(chat_window, self.chat_per_minute, 60.0,
+                                     now)
+            if retry:
+                return retry
+        if self.global_rate:
+            self._global_window.append(now)
+        if chat_window is not None:
+            chat_window.append(now)
+        return None
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"].lower()
+        params = await self._params(request)
+        self.calls[method] += 1
+        if method in ("sendmessage", "editmessagetext"):
+            retry = self.retry_after(params)
+            if retry:
+                self.flood_errors += 1
+                return web.json_response(
+                    {
+                        "ok": False,
+                        "error_code": 429,
+                        "description":
+                        f"Too Many Requests: retry after {retry}",
+                        "parameters": {
+                            "retry_after": retry
+                        }
+                    },
+                    status=429)
+            self.sent.append({"method": method, **params})
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return web.json_response({
+            "ok": True,
+            "result": self.result_for(method, params)
+        })
+
+    async def start(self, host: str, port: int):
+        self._runner = web.AppRunner(self.app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+
+async def send_updates(webhook_url: str,
+                       updates: List[dict],
+                       concurrency: int = 10,
+                       secret_token: Optional[str] = None) -> dict:
+    """Отправить апдейты на вебхук, вернуть коды ответов и задержки"""
+    headers = {}
+    if secret_token:
+        headers["X-Telegram-Bot-Api-Secret-Token"] = secret_token
+    statuses: Counter = Counter()
+    latencies: List[float] = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with aiohttp.ClientSession() as session:
+
+        async def send(update: dict):
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    async with session.post(webhook_url,
+                                            json=update,
+                                            headers=headers) as resp:
+                        await resp.read()
+                        statuses[resp.status] += 1
+                except aiohttp.ClientError as e:
+                    statuses[type(e).__name__] += 1
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(send(update) for update in updates))
+        elapsed = time.perf_counter() - started
+
+    return {"statuses": statuses, "latencies": latencies, "elapsed": elapsed}
+
+
+def synthetic_updates(count: int, chats: int, users: int) -> List[dict]:
+    texts = ["привет", "пинг", "факт", "кубик", None, "как дела?", "цитата"]
+    return [
+        make_message_update(update_id, -1000000000000 - random.randrange(chats),
+                            random.randrange(1, users + 1),
+                            random.choice(texts))
+        for update_id in range(1, count + 1)
+    ]
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--webhook", required=True, help="URL вебхука бота")
+    parser.add_argument("--secret", help="секретный токен вебхука")
+    parser.add_argument("--api-port", type=int,
+                        help="поднять заглушку Bot API на этом порту")
+    parser.add_argument("--updates", type=int, default=100)
+    parser.add_argument("--chats", type=int, default=5)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--settle", type=float, default=2.0,
+                        help="сколько ждать ответов бота после отправки")
+    args = parser.parse_args()
+
+    api = None
+    if args.api_port:
+        api = FakeBotAPI()
+        await api.start("127.0.0.1", args.api_port)
+        print(f"Заглушка Bot API: http://127.0.0.1:{args.api_port}")
+        await asyncio.to_thread(
+            input, "Запустите бота с этим TELEGRAM_API_URL и нажмите Enter...")
+
+    result = await send_updates(args.webhook,
+                                synthetic_updates(args.updates, args.chats,
+                                                  args.users),
+                                args.concurrency, args.secret)
+    latencies = sorted(result["latencies"])
+    print(f"Отправлено {args.updates} апдейтов за {result['elapsed']:.2f} с "
+          f"({args.updates / result['elapsed']:.0f}/с)")
+    print(f"Коды ответов: {dict(result['statuses'])}")
+    print(f"Задержка доставки: p50 {statistics.median(latencies) * 1000:.1f} мс, "
+          f"p99 {latencies[int(len(latencies) * 0.99) - 1] * 1000:.1f} мс")
+
+    if api is not None:
+        await asyncio.sleep(args.settle)
+        print(f"Вызовы Bot API: {dict(api.calls)}")
+        await api.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
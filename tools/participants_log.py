@@ -0,0 +1,87 @@
+"""Обслуживание бинарного журнала участников (participants.log)
+
+    python tools/participants_log.py convert participants.txt participants.log
+    python tools/participants_log.py compact participants.log
+    python tools/participants_log.py stats participants.log
+    python tools/participants_log.py dump participants.log > participants.txt
+
+compact и convert запускаются при остановленном боте.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from participants import (compact_log, convert_text_log, iter_keys,  # noqa: E402
+                          iter_records, log_segments, read_log)
+
+
+def total_size(path: str) -> int:
+    return sum(os.path.getsize(segment) for segment in log_segments(path))
+
+
+def cmd_convert(args):
+    started = time.perf_counter()
+    count = convert_text_log(args.src, args.dst)
+    print(f"{args.src} ({os.path.getsize(args.src)} байт) -> {args.dst} "
+          f"({os.path.getsize(args.dst)} байт): {count} записей "
+          f"за {time.perf_counter() - started:.2f} с")
+
+
+def cmd_compact(args):
+    before_size = total_size(args.path)
+    segments = len(log_segments(args.path))
+    before, after = compact_log(args.path)
+    print(f"Записей: {before} -> {after}, сегментов: {segments} -> 1, "
+          f"байт: {before_size} -> {total_size(args.path)}")
+
+
+def cmd_stats(args):
+    started = time.perf_counter()
+    data = read_log(args.path)
+    keys = list(iter_keys(data))
+    elapsed = time.perf_counter() - started
+    print(f"Сегментов: {len(log_segments(args.path))}, байт: {len(data)}")
+    print(f"Записей: {len(keys)}, уникальных участников: {len(set(keys))}, "
+          f"чатов: {len({chat_id for chat_id, _ in keys})}")
+    print(f"Чтение индекса: {elapsed * 1000:.1f} мс")
+
+
+def cmd_dump(args):
+    # Тот же вид, что у старого participants.txt
+    for record in iter_records(read_log(args.path)):
+        print(f"Chat: {record.chat_id}, User: {record.user_id}, "
+              f"Name: {record.name}, Action: {record.action}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    convert = subparsers.add_parser("convert",
+                                    help="текстовый лог -> бинарный журнал")
+    convert.add_argument("src")
+    convert.add_argument("dst")
+    convert.set_defaults(func=cmd_convert)
+
+    compact = subparsers.add_parser(
+        "compact", help="оставить последнюю запись на участника чата")
+    compact.add_argument("path")
+    compact.set_defaults(func=cmd_compact)
+
+    stats = subparsers.add_parser("stats", help="размер и число записей")
+    stats.add_argument("path")
+    stats.set_defaults(func=cmd_stats)
+
+    dump = subparsers.add_parser("dump", help="вывести журнал текстом")
+    dump.add_argument("path")
+    dump.set_defaults(func=cmd_dump)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
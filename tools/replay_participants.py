@@ -0,0 +1,272 @@
+"""Воспроизведение журнала участников как нагрузки на бота
+
+Журнал (бинарный participants.log с сегментами или старый текстовый
+participants.txt) превращается в апдейты aiogram: message — текст,
+media/other — стикер, reaction — реакция, button_register — нажатие
+"участие", register — команда "участие". Апдейты подаются прямо в
+Dispatcher бота, запущенного на локальных заглушках Bot API и Cohere, как в
+benchmarks/bench_bot.py. Чаты воспроизводятся параллельно, апдейты одного
+чата — по порядку, как их отдаёт Telegram.
+
+    python tools/replay_participants.py participants.log              # как было
+    python tools/replay_participants.py participants.log --speed 60   # в 60 раз быстрее
+    python tools/replay_participants.py participants.txt --rate 200   # 200 апд/с
+    python tools/replay_participants.py participants.log --max --commands 0.1
+
+В бинарном журнале время записей с точностью до секунды; в текстовом его
+нет, поэтому без --rate или --max он идёт со скоростью DEFAULT_RATE.
+В журнале одна запись на участника чата, --repeat N прогоняет его N раз —
+повторные проходы нагружают путь "участник уже известен".
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_telegram import (make_callback_update,  # noqa: E402
+                           make_message_update, make_reaction_update)
+from participants import (ParticipantRecord, iter_records,  # noqa: E402
+                          parse_participant_record, read_log)
+
+TEXTS = ["привет всем", "как дела?", "ахаха", "кто идёт вечером?", "ок",
+         "смотрите что нашёл", "😂😂😂", "согласен"]
+COMMANDS = ["пинг", "факт", "цитата", "кубик", "монетка", "гороскоп", "шип",
+            "статистика", "админы", "коралл что такое коралловый риф?"]
+# Скорость текстового журнала, если не задано иное
+DEFAULT_RATE = 50.0
+
+
+def load_records(path: str) -> Tuple[List[ParticipantRecord], bool]:
+    """Записи журнала и признак того, что у них есть время"""
+    with open(path, 'rb') as f:
+        head = f.read(6)
+    if head == b"Chat: ":
+        with open(path, encoding='utf-8', errors='replace') as f:
+            records = [record for record in map(parse_participant_record, f)
+                       if record is not None]
+        return records, False
+    records = list(iter_records(read_log(path)))
+    # Журнал, сконвертированный из текстового, времени тоже не знает
+    return records, any(record.timestamp for record in records)
+
+
+def make_update(update_id: int, record: ParticipantRecord,
+                rng: random.Random, commands: float) -> dict:
+    """Апдейт, порождающий такую же запись журнала"""
+    chat_id, user_id, action = record.chat_id, record.user_id, record.action
+    if action == "reaction":
+        update = make_reaction_update(update_id, chat_id, user_id)
+        user = update["message_reaction"]["user"]
+    elif action == "button_register":
+        update = make_callback_update(update_id, chat_id, user_id,
+                                      f"register_{chat_id}_{user_id}")
+        user = update["callback_query"]["from"]
+    else:
+        if action == "register":
+            text = "участие"
+        elif action == "message":
+            text = (rng.choice(COMMANDS)
+                    if rng.random() < commands else rng.choice(TEXTS))
+        else:
+            # media и прочее — нетекстовое сообщение
+            text = None
+        update = make_message_update(update_id, chat_id, user_id, text)
+        user = update["message"]["from"]
+    # Имя из журнала: "@username" или first_name
+    if record.name.startswith("@"):
+        user["username"] = record.name[1:]
+    elif record.name:
+        user["first_name"] = record.name
+        user.pop("username", None)
+    return update
+
+
+def schedule(records: List[ParticipantRecord], timed: bool,
+             speed: Optional[float], rate: Optional[float],
+             repeat: int) -> List[Tuple[float, ParticipantRecord]]:
+    """(секунда от начала прогона, запись); при --max все в момент 0"""
+    if timed and speed:
+        first = records[0].timestamp
+        span = records[-1].timestamp - first + 1
+        return [((lap * span + record.timestamp - first) / speed, record)
+                for lap in range(repeat) for record in records]
+    if rate:
+        return [(index / rate, record)
+                for index, record in enumerate(records * repeat)]
+    return [(0.0, record) for record in records * repeat]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values: List[float], share: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * share))] if values else 0.0
+
+
+async def replay(args) -> dict:
+    records, timed = load_records(args.log)
+    if not timed and not args.max and not args.rate:
+        args.rate = DEFAULT_RATE
+    if timed:
+        records.sort(key=lambda record: record.timestamp)
+    if args.chats:
+        chosen = set(sorted({record.chat_id for record in records})[:args.chats])
+        records = [record for record in records if record.chat_id in chosen]
+    if args.limit:
+        records = records[:args.limit]
+    if not records:
+        raise SystemExit("В журнале нет записей")
+    plan = schedule(records, timed, None if args.max else args.speed,
+                    None if args.max else args.rate, args.repeat)
+
+    rng = random.Random(args.seed)
+    by_chat: Dict[int, List[Tuple[float, dict]]] = defaultdict(list)
+    actions: Counter = Counter()
+    for update_id, (at, record) in enumerate(plan, 1):
+        by_chat[record.chat_id].append(
+            (at, make_update(update_id, record, rng, args.commands)))
+        actions[record.action] += 1
+    print(f"Записей: {len(records)}, апдейтов: {len(plan)}, чатов: "
+          f"{len(by_chat)}, длительность по плану: {plan[-1][0]:.1f} с "
+          f"({dict(actions)})", file=sys.stderr)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="coral-replay-")
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+
+    from fake_cohere import FakeCohere
+    from fake_telegram import FakeBotAPI
+    api_port, cohere_port = free_port(), free_port()
+    api = FakeBotAPI(latency=args.api_latency)
+    await api.start("127.0.0.1", api_port)
+    cohere = FakeCohere(latency=args.cohere_latency)
+    await cohere.start("127.0.0.1", cohere_port)
+    os.environ.update({
+        "TELEGRAM_TOKEN": "123456:REPLAY",
+        "TELEGRAM_API_URL": f"http://127.0.0.1:{api_port}",
+        "COHERE_API_KEY": "replay",
+        "COHERE_URL": f"http://127.0.0.1:{cohere_port}",
+        "CONTENT_FILE": os.path.join(ROOT, "content.json"),
+        "PARTICIPANTS_FILE": os.path.join(workdir, "participants.log"),
+    })
+    if args.state_db:
+        os.environ["STATE_DB"] = os.path.join(workdir, "state.db")
+    if not args.flood_limits:
+        os.environ.update({
+            "OUTBOUND_GLOBAL_RATE": "1000000",
+            "OUTBOUND_GROUP_PER_MINUTE": "1000000",
+            "OUTBOUND_PRIVATE_RATE": "1000000",
+        })
+
+    import main as bot_main
+    await bot_main.start_services()
+
+    latencies: List[float] = []
+    behind: List[float] = []
+    errors = 0
+    started = time.perf_counter()
+
+    async def run_chat(updates: List[Tuple[float, dict]]):
+        nonlocal errors
+        for at, update in updates:
+            delay = started + at - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            update_started = time.perf_counter()
+            # Насколько подача отстала от плана: бот не успевает за нагрузкой
+            behind.append(update_started - started - at)
+            try:
+                await bot_main.dp.feed_raw_update(bot_main.bot, update)
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - update_started)
+
+    await asyncio.gather(*(run_chat(updates) for updates in by_chat.values()))
+    elapsed = time.perf_counter() - started
+
+    await bot_main.stop_services()
+    await cohere.close()
+    await api.close()
+
+    latencies.sort()
+    behind.sort()
+    return {
+        "updates": len(plan),
+        "chats": len(by_chat),
+        "elapsed": elapsed,
+        "throughput": len(plan) / elapsed,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "max_ms": latencies[-1] * 1000,
+        "behind_p99_ms": percentile(behind, 0.99) * 1000,
+        "behind_max_ms": behind[-1] * 1000,
+        "errors": errors,
+        "api_calls": dict(api.calls),
+        "cohere_requests": cohere.requests,
+        "participants": len(bot_main.participant_store),
+        "workdir": workdir,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("log", help="participants.log или participants.txt")
+    pace = parser.add_mutually_exclusive_group()
+    pace.add_argument("--speed", type=float, default=1.0,
+                      help="ускорение относительно времени журнала (1 — как было)")
+    pace.add_argument("--rate", type=float, help="равномерно, апдейтов в секунду")
+    pace.add_argument("--max", action="store_true", help="без пауз")
+    parser.add_argument("--repeat", type=int, default=1,
+                        help="прогнать журнал несколько раз подряд")
+    parser.add_argument("--chats", type=int, help="только первые N чатов")
+    parser.add_argument("--limit", type=int, help="только первые N записей")
+    parser.add_argument("--commands", type=float, default=0.0,
+                        help="доля сообщений, заменяемых командами (0-1)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--api-latency", type=float, default=0.0)
+    parser.add_argument("--cohere-latency", type=float, default=0.05)
+    parser.add_argument("--state-db", action="store_true",
+                        help="с постоянным хранилищем состояния (STATE_DB)")
+    parser.add_argument("--flood-limits", action="store_true",
+                        help="не снимать лимиты отправки OutboundLimiter")
+    parser.add_argument("--workdir", help="папка для файлов бота (по умолчанию временная)")
+    parser.add_argument("--json", help="сохранить результат в файл")
+    args = parser.parse_args()
+    # Бот работает в своей папке, пути — от текущей
+    args.log = os.path.abspath(args.log)
+    args.workdir = args.workdir and os.path.abspath(args.workdir)
+    args.json = args.json and os.path.abspath(args.json)
+
+    result = asyncio.run(replay(args))
+    print(f"Апдейтов: {result['updates']} в {result['chats']} чатах за "
+          f"{result['elapsed']:.2f} с ({result['throughput']:.0f}/с), "
+          f"ошибок: {result['errors']}")
+    print(f"Обработка апдейта: p50 {result['p50_ms']:.2f} мс, p99 "
+          f"{result['p99_ms']:.2f} мс, max {result['max_ms']:.1f} мс")
+    if not args.max:
+        print(f"Отставание от плана: p99 {result['behind_p99_ms']:.1f} мс, "
+              f"max {result['behind_max_ms']:.1f} мс")
+    print(f"Вызовы Bot API: {result['api_calls']}, запросов Cohere: "
+          f"{result['cohere_requests']}, участников в индексе: "
+          f"{result['participants']}")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from aiogram import Bot, Dispatcher
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import Response, TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiogram.types import TelegramObject, Update
+
+Handler = Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]]
+
+
+class Trace:
+    """Спаны одного апдейта: (начало от старта апдейта, длительность, глубина, имя)"""
+
+    __slots__ = ("started", "spans", "max_spans", "dropped")
+
+    def __init__(self, max_spans: int):
+        self.started = time.perf_counter()
+        self.spans: List[Tuple[float, float, int, str]] = []
+        self.max_spans = max_spans
+        self.dropped = 0
+
+
+# Трасса текущего апдейта и глубина вложенности спанов; задачи, созданные
+# внутри обработчика, наследуют их вместе с контекстом
+_trace: ContextVar[Optional[Trace]] = ContextVar("trace", default=None)
+_depth: ContextVar[int] = ContextVar("trace_depth", default=0)
+
+
+@contextmanager
+def span(name: str):
+    """Засечь участок кода внутри трассы апдейта; вне апдейта ничего не делает"""
+    trace = _trace.get()
+    if trace is None:
+        yield
+        return
+    depth = _depth.get()
+    token = _depth.set(depth + 1)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _depth.reset(token)
+        if len(trace.spans) < trace.max_spans:
+            trace.spans.append((started - trace.started,
+                                time.perf_counter() - started, depth, name))
+        else:
+            trace.dropped += 1
+
+
+class Tracer:
+    """Трассировка апдейтов: обработчики, команды и запросы к Bot API
+
+    Внешний middleware апдейта открывает трассу, внутренние middleware
+    событий и span() в коде добавляют в неё участки. Если апдейт
+    обрабатывался дольше threshold секунд, разбивка по участкам пишется в
+    лог; быстрые апдейты просто забываются.
+    """
+
+    def __init__(self, threshold: float = 1.0, max_spans: int = 200):
+        self.threshold = threshold
+        self.max_spans = max_spans
+        self.slow = 0
+
+    def setup(self, dp: Dispatcher):
+        """Подключить к диспетчеру: трасса на апдейт и спан на каждый обработчик
+
+        Запросы к Bot API попадают в трассу через TraceRequestMiddleware,
+        он регистрируется в сессии бота отдельно.
+        """
+        dp.update.outer_middleware(self.trace_update)
+        for name, observer in dp.observers.items():
+            if name not in ("update", "error"):
+                observer.middleware(self.trace_handler)
+
+    async def trace_update(self, handler: Handler, event: Update,
+                           data: Dict[str, Any]) -> Any:
+        trace = Trace(self.max_spans)
+        token = _trace.set(trace)
+        try:
+            return await handler(event, data)
+        finally:
+            _trace.reset(token)
+            elapsed = time.perf_counter() - trace.started
+            if elapsed >= self.threshold:
+                self.slow += 1
+                self.report(event, data, trace, elapsed)
+
+    async def trace_handler(self, handler: Handler, event: TelegramObject,
+                            data: Dict[str, Any]) -> Any:
+        with span(f"handler {data['handler'].callback.__name__}"):
+            return await handler(event, data)
+
+    def report(self, event: Update, data: Dict[str, Any], trace: Trace,
+               elapsed: float):
+        chat = data.get("event_chat")
+        lines = [
+            f"Медленный апдейт {event.update_id} ({event.event_type}"
+            f"{f', чат {chat.id}' if chat else ''}): {elapsed * 1000:.0f} мс"
+        ]
+        for offset, duration, depth, name in sorted(trace.spans):
+            lines.append(f"{'  ' * (depth + 1)}+{offset * 1000:.0f} мс "
+                         f"{name}: {duration * 1000:.0f} мс")
+        if trace.dropped:
+            lines.append(f"  ... ещё {trace.dropped} участков")
+        logging.warning("\n".join(lines))
+
+
+class TraceRequestMiddleware(BaseRequestMiddleware):
+    """Спан на каждый запрос к Bot API внутри трассы апдейта
+
+    Зарегистрированный до OutboundLimiter, спан включает и ожидание в его
+    очереди; чистое время запроса видно в метриках.
+    """
+
+    async def __call__(self, make_request: NextRequestMiddlewareType[TelegramType],
+                       bot: Bot,
+                       method: TelegramMethod[TelegramType]) -> Response[TelegramType]:
+        with span(f"api {method.__api_method__}"):
+            return await make_request(bot, method)
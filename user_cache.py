@@ -0,0 +1,49 @@
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+UserInfo = Tuple[Optional[str], Optional[str]]
+
+
+class UserCache:
+    """LRU-кэш отображаемых данных пользователей (username, first_name)
+
+    Заполняется из from_user входящих апдейтов, поэтому для упоминаний
+    почти никогда не нужен get_chat_member. Записи старше ttl секунд
+    считаются устаревшими, всего хранится не больше max_size записей.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 3600.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._users: "OrderedDict[int, Tuple[float, UserInfo]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    def remember(self,
+                 user_id: int,
+                 username: Optional[str] = None,
+                 first_name: Optional[str] = None):
+        """Запомнить или обновить данные пользователя"""
+        self._users[user_id] = (time.monotonic(), (username, first_name))
+        self._users.move_to_end(user_id)
+        while len(self._users) > self.max_size:
+            self._users.popitem(last=False)
+
+    def get(self, user_id: int) -> Optional[UserInfo]:
+        """(username, first_name) из кэша или None"""
+        entry = self._users.get(user_id)
+        if entry is None:
+            self.misses += 1
+            return None
+        stored_at, info = entry
+        if time.monotonic() - stored_at > self.ttl:
+            del self._users[user_id]
+            self.misses += 1
+            return None
+        self._users.move_to_end(user_id)
+        self.hits += 1
+        return info
@@ -0,0 +1,99 @@
+import asyncio
+import logging
+import signal
+from typing import Optional
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+
+class DrainingRequestHandler(SimpleRequestHandler):
+    """Приём апдейтов, который при остановке дожидается их обработки
+
+    Сессию бота не закрывает — этим занимается main() после остановки.
+    """
+
+    def __init__(self, *args, drain_timeout: float = 10.0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.drain_timeout = drain_timeout
+
+    async def close(self):
+        tasks = set(self._background_feed_update_tasks)
+        if not tasks:
+            return
+        logging.info(f"Дожидаюсь обработки {len(tasks)} апдейтов...")
+        done, pending = await asyncio.wait(tasks, timeout=self.drain_timeout)
+        if pending:
+            logging.warning(f"Не дождались {len(pending)} апдейтов")
+
+
+async def healthz(request: web.Request) -> web.Response:
+    return web.Response(text="ok")
+
+
+def build_webhook_app(dispatcher: Dispatcher,
+                      bot: Bot,
+                      path: str,
+                      secret_token: Optional[str] = None,
+                      drain_timeout: float = 10.0) -> web.Application:
+    """aiohttp-приложение, принимающее апдейты Telegram на path"""
+    app = web.Application()
+    handler = DrainingRequestHandler(dispatcher=dispatcher,
+                                     bot=bot,
+                                     secret_token=secret_token,
+                                     drain_timeout=drain_timeout)
+    handler.register(app, path=path)
+    app.router.add_get("/healthz", healthz)
+    setup_application(app, dispatcher, bot=bot)
+    return app
+
+
+async def register_webhook(dispatcher: Dispatcher,
+                           bot: Bot,
+                           public_url: str,
+                           path: str,
+                           secret_token: Optional[str] = None):
+    """Выставить вебхук в Telegram на public_url + path"""
+    await bot.set_webhook(f"{public_url.rstrip('/')}{path}",
+                          secret_token=secret_token,
+                          allowed_updates=dispatcher.resolve_used_update_types())
+
+
+async def run_webhook(dispatcher: Dispatcher,
+                      bot: Bot,
+                      host: str,
+                      port: int,
+                      path: str,
+                      secret_token: Optional[str] = None,
+                      public_url: Optional[str] = None,
+                      drain_timeout: float = 10.0):
+    """Принимать апдейты через вебхук до SIGTERM/SIGINT
+
+    Если задан public_url, вебхук регистрируется в Telegram на
+    public_url + path; иначе предполагается, что его выставили заранее
+    (например, за локальным reverse proxy).
+    """
+    app = build_webhook_app(dispatcher, bot, path, secret_token,
+                            drain_timeout)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    print(f"🌐 Вебхук слушает http://{host}:{port}{path}")
+
+    if public_url:
+        await register_webhook(dispatcher, bot, public_url, path,
+                               secret_token)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+    try:
+        await stop.wait()
+    finally:
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.remove_signal_handler(sig)
+        # Новые запросы больше не принимаются, начатые дорабатываются
+        await runner.cleanup()